@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Benchmarks of the agent framework.
+
+Every case reports the best time out of a few repeats. Results can be saved
+as a baseline and later runs compared to it, the exit code is 1 when a case
+got slower than the baseline by more than the threshold.
+
+    python benchmarks/suite.py --save baseline.json
+    python benchmarks/suite.py --compare baseline.json
+"""
+
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from dciagent.core import credentials
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+from dciagent.core.agents.ansible import Agent as AnsibleAgent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = os.path.join(os.path.dirname(HERE), "samples")
+
+# name -> function returning the best time in seconds
+CASES = collections.OrderedDict()
+
+
+def case(name):
+    def register(func):
+        CASES[name] = func
+        return func
+
+    return register
+
+
+def best(func, repeat=5, number=1):
+    "Best average time per call of func() out of `repeat` rounds"
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def _command(argv):
+    return lambda: subprocess.run(
+        argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+case("startup/python")(lambda: best(_command([sys.executable, "-c", "pass"])))
+case("startup/dci-agent-ctl --help")(
+    lambda: best(_command([sys.executable, "-m", "dciagent.core.cli", "--help"]))
+)
+case("startup/dummy-ctl --help")(
+    lambda: best(
+        _command([sys.executable, os.path.join(SAMPLES, "dummy.py"), "--help"])
+    )
+)
+case("startup/dci-agent-client --help")(
+    lambda: best(_command([sys.executable, "-m", "dciagent.core.client"]))
+)
+
+# dci-agent-ctl with the sample dummy agent registered under a name, selected
+# through the registry then run up to its command line
+_REGISTERED = """
+import sys
+sys.path.insert(0, {!r})
+import dciagent.core.cli as cli
+import dciagent.core.registry as registry
+registry.AGENTS["sample"] = registry.Entry("dummy:Agent", "sample agent")
+sys.exit(cli.main(sys.argv[1:]))
+""".format(SAMPLES)
+case("startup/dci-agent-ctl sample --dry-run")(
+    lambda: best(_command([sys.executable, "-c", _REGISTERED, "sample", "--dry-run"]))
+)
+
+
+def _agent_class(arguments):
+    attrs = {
+        "arg{}".format(i): Argument("argument", long="--arg{}".format(i), env="A")
+        for i in range(arguments)
+    }
+    attrs["__init__"] = lambda self: Base.__init__(self, "bench", "bench", "0")
+    return type("Agent{}".format(arguments), (Base,), attrs)
+
+
+def _parse(arguments):
+    def run():
+        cls = _agent_class(arguments)
+        argv = ["--arg0", "value"]
+
+        def parse():
+            agent = cls()
+            agent._load_args(vars(agent._cli(argv)))
+
+        return best(parse, number=20)
+
+    return run
+
+
+for _n in (10, 100, 1000):
+    case("cli/{} arguments".format(_n))(_parse(_n))
+
+
+def _credentials(lines, cached):
+    def run():
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "dcirc.sh")
+            with open(path, "w") as f:
+                for i in range(lines):
+                    f.write("export DCI_VAR_{}='value {}'\n".format(i, i))
+
+            def read():
+                if not cached:
+                    credentials._cache.clear()
+                credentials.read(path)
+
+            return best(read, number=20)
+        finally:
+            shutil.rmtree(tmp)
+
+    return run
+
+
+for _n in (10, 100, 1000):
+    case("credentials/{} lines".format(_n))(_credentials(_n, False))
+    case("credentials/{} lines, cached".format(_n))(_credentials(_n, True))
+
+
+class _Ansible(AnsibleAgent):
+    def __init__(self):
+        super().__init__("bench", "bench", "0")
+
+
+def _build_command(extra_vars):
+    def run():
+        tmp = tempfile.mkdtemp()
+        try:
+            agent = _Ansible()
+            argv = ["-i", "hosts", "--extra-vars-dir", tmp, "site.yml"]
+            for i in range(extra_vars):
+                argv.extend(["-e", "var{}=value-{}".format(i, i)])
+            agent._load_args(vars(agent._cli(argv)))
+            return best(agent._build_command, number=20)
+        finally:
+            shutil.rmtree(tmp)
+
+    return run
+
+
+for _n in (10, 100, 1000):
+    case("build_command/{} extra vars".format(_n))(_build_command(_n))
+
+
+class _Stub(Base):
+    executable = "true"
+
+    def __init__(self):
+        super().__init__("bench", "bench", "0")
+
+    def _build_command(self):
+        self.command_line = [self.executable]
+
+
+case("run/spawn to exit")(lambda: best(lambda: _Stub().run([]), number=10))
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    ap.add_argument("-k", "--filter", help="only run the cases containing this")
+    ap.add_argument("--save", help="save the results as a baseline to this file")
+    ap.add_argument("--compare", help="compare the results to this baseline")
+    ap.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown ratio considered a regression (default: 1.25)",
+    )
+    args = ap.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = collections.OrderedDict()
+    regressions = 0
+    for name, func in CASES.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = func()
+        line = "{:<40} {:10.3f}ms".format(name, results[name] * 1000)
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += "  x{:.2f}".format(ratio)
+            if ratio > args.threshold:
+                line += "  REGRESSION"
+                regressions += 1
+        print(line, flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
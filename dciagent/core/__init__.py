@@ -1,6 +1,23 @@
-try:
-    import importlib.metadata as metadata
-except ModuleNotFoundError:
-    import importlib_metadata as metadata
+import sys
 
-__version__ = metadata.version("python-dciagent")
+
+def _version():
+    try:
+        import importlib.metadata as metadata
+    except ModuleNotFoundError:
+        import importlib_metadata as metadata
+
+    return metadata.version("python-dciagent")
+
+
+# looking the version up costs more than the rest of a thin client's start-up,
+# so it is only done when asked for where python supports module __getattr__
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        if name == "__version__":
+            return _version()
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+else:
+    __version__ = _version()
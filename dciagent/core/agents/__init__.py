@@ -13,14 +13,36 @@
 # under the License.
 
 import argparse
-import distutils.util as distutil
+import collections
+import functools
+import inspect
 import os
+import re
 import shutil
+import signal
 import subprocess
+import time
 
 import dciagent.core.context as ctx
 import dciagent.core.errors as errors
 import dciagent.core.printer as printer
+import dciagent.core.report as report
+import dciagent.core.retry as retry
+import dciagent.core.stream as stream
+import dciagent.core.supervisor as supervisor
+import dciagent.core.timing as timing
+import dciagent.core.utils as utils
+
+# parser default of the arguments whose real default is read from the
+# environment at parse time
+_FROM_ENV = object()
+
+# (class, prog, description, version) -> parser
+_parsers = {}
+
+
+def _identity(value):
+    return value
 
 
 class Argument:
@@ -40,6 +62,7 @@ class Argument:
         nargs=None,
         dest=None,
         metavar=None,
+        path=False,
     ):
         if nargs is None and short is None and long is None:
             raise errors.ArgumentError(
@@ -56,6 +79,43 @@ class Argument:
         self.nargs = nargs
         self.dest = dest
         self.metavar = metavar
+        # relative to the working directory of the run, see Base.cwd
+        self.path = path
+        self.convert = self._converter()
+
+    def _converter(self):
+        "The function turning the parsed value in the attribute's value"
+
+        if self.type is None:
+            if self.action == "count":
+                return int
+            elif self.action in ("store_true", "store_false"):
+                return bool
+            else:
+                return _identity
+        elif self.type in (int, float, bool):
+            convert = self.type
+            # unset options without a default stay unset
+            return lambda value: None if value is None else convert(value)
+        else:
+            return str
+
+    def default_from(self, environ):
+        "The default value of this argument for the given environment"
+
+        if self.env is not None:
+            if self.action in (
+                "store_true",
+                "store_false",
+            ):
+                return utils.strtobool(environ.get(self.env, "false"))
+            elif self.action == "append" and self.env in environ:
+                # the options given are appended to it
+                return [environ[self.env]]
+            else:
+                return environ.get(self.env, self.default)
+        else:
+            return self.default
 
     def arg(self):
         args = []
@@ -80,20 +140,7 @@ class Argument:
             "dest": self.dest,
         }
 
-        # figure out the right default
-        default = None
-        if self.env is not None:
-            if self.action in (
-                "store_true",
-                "store_false",
-            ):
-                default = distutil.strtobool(os.getenv(self.env, "false"))
-            else:
-                default = os.getenv(self.env, self.default)
-        else:
-            default = self.default
-
-        kwargs["default"] = default
+        kwargs["default"] = self.default_from(os.environ)
 
         if self.type is not None:
             kwargs["type"] = self.type
@@ -111,6 +158,25 @@ class Base(object):
     executable = None
     environment = {}
     command_line = []
+    # output sinks, when empty the child just inherits our stdout/stderr
+    sinks = []
+    process = None
+    # environment the extra variables are layered on, None means os.environ
+    parent_environment = None
+    # working directory of the run and its child, None means ours
+    cwd = None
+    # runs the blocking hooks of run_async(), default: the loop's executor
+    executor = None
+    # seconds between SIGTERM and SIGKILL when an async run is cancelled
+    termination_grace = 10
+    # report.Result of the last run
+    result = None
+    # output lines kept in the result when the output is captured
+    tail_lines = 20
+    # number of times the command was run by the last run
+    attempts = 0
+    # why the supervisor killed the command: timeout, idle or interrupted
+    expired = None
     ap = None
     verbosity = Argument(
         "increase the verbosity",
@@ -134,16 +200,110 @@ class Base(object):
         default=False,
         env="NO_VALIDATION",
     )
+    timings_file = Argument(
+        "write the time spent in each phase of the run to this file, in the"
+        " OpenMetrics format for .prom/.om/.txt files or as JSON otherwise",
+        long="--timings-file",
+        env="TIMINGS_FILE",
+        path=True,
+    )
+    retries = Argument(
+        "run the command again this many times when it fails",
+        long="--retries",
+        type=int,
+        default=0,
+        env="RETRIES",
+    )
+    retry_delay = Argument(
+        "seconds to wait before the first retry, doubled at every attempt",
+        long="--retry-delay",
+        type=float,
+        default=0.0,
+        env="RETRY_DELAY",
+    )
+    retry_codes = Argument(
+        "only retry on these return codes, comma separated",
+        long="--retry-codes",
+        env="RETRY_CODES",
+    )
+    retry_pattern = Argument(
+        "only retry when the last output lines match this regular expression",
+        long="--retry-pattern",
+        env="RETRY_PATTERN",
+    )
+    timeout = Argument(
+        "kill the command and all its processes after this many seconds",
+        long="--timeout",
+        type=float,
+        env="TIMEOUT",
+    )
+    idle_timeout = Argument(
+        "kill the command and all its processes when it did not output"
+        " anything for this many seconds",
+        long="--idle-timeout",
+        type=float,
+        env="IDLE_TIMEOUT",
+    )
+    report_file = Argument(
+        "append a JSON line describing the run (return code, timings, command"
+        " line, artifacts, last output lines) to this file",
+        long="--report-file",
+        env="REPORT_FILE",
+        path=True,
+    )
 
     def __init__(self, prog, description, version):
-        self.ap = argparse.ArgumentParser(
-            prog=prog,
-            description=description,
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-        )
-        self.ap.add_argument(
-            "-V", "--version", action="version", version="{} {}".format(prog, version)
-        )
+        self.ap = self._parser(prog, description, version)
+        self.timer = timing.Timer()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile_arguments()
+
+    @classmethod
+    def _compile_arguments(cls):
+        """
+        Collects the class' Argument definitions once, instances only go
+        through this schema instead of scanning their attributes
+        """
+
+        cls._arguments = collections.OrderedDict()
+        for name in sorted(dir(cls)):
+            e = getattr(cls, name)
+            if isinstance(e, Argument):
+                dest = e.dest or (e.long or e.short).lstrip("-").replace("-", "_")
+                cls._arguments[dest] = (name, e)
+
+    @classmethod
+    def _parser(cls, prog, description, version):
+        """
+        Returns the argument parser, built only once per class and program.
+        The defaults coming from the environment are filled in by _cli() so
+        the parser itself doesn't depend on it and can be reused.
+        """
+
+        key = (cls, prog, description, version)
+        ap = _parsers.get(key)
+        if ap is None:
+            ap = argparse.ArgumentParser(
+                prog=prog,
+                description=description,
+                formatter_class=argparse.RawDescriptionHelpFormatter,
+            )
+            ap.add_argument(
+                "-V",
+                "--version",
+                action="version",
+                version="{} {}".format(prog, version),
+            )
+            for _, e in cls._arguments.values():
+                args, kwargs = e.arg()
+                if e.env is not None:
+                    kwargs["default"] = _FROM_ENV
+                ap.add_argument(*args, **kwargs)
+            ap = _parsers.setdefault(key, ap)
+
+        return ap
 
     def _build_command(self):
         """
@@ -153,47 +313,63 @@ class Base(object):
 
         raise NotImplementedError("Define the _build_command() method in your agent")
 
-    def _cli(self, argv):
-        for m in sorted(dir(self)):
-            e = getattr(self, m)
-            if isinstance(e, Argument):
-                args, kwargs = e.arg()
-                self.ap.add_argument(*args, **kwargs)
+    @classmethod
+    def _parse(cls, ap, argv, environ, known=False):
+        # options not given keep the value already in the namespace, which
+        # is where the environment defaults go
+        namespace = argparse.Namespace()
+        for dest, (_, e) in cls._arguments.items():
+            if e.env is not None:
+                setattr(namespace, dest, e.default_from(environ))
+
+        if known:
+            args = ap.parse_known_args(argv, namespace)[0]
+        else:
+            args = ap.parse_args(argv, namespace)
+
+        # positionals not given are set to the parser default though
+        for dest, (_, e) in cls._arguments.items():
+            if getattr(args, dest, None) is _FROM_ENV:
+                setattr(args, dest, e.default_from(environ))
+
+        return args
 
-        return self.ap.parse_args(argv)
+    @classmethod
+    def peek(cls, argv, environ=None):
+        """
+        The arguments an agent of this class would get from the command line
+        and the environment, without creating it. Unknown ones are ignored.
+        """
+
+        ap = cls._parser(cls.__name__, cls.__doc__, None)
+        return cls._parse(ap, argv, utils.environ(environ), known=True)
+
+    def _cli(self, argv):
+        environ = utils.environ(self.parent_environment)
+        return self._parse(self.ap, argv, environ)
 
     def _load_args(self, args):
         for k, v in args.items():
-            e = getattr(self, k)
-            if isinstance(e, Argument):
-                if e.type is None:
-                    if e.action == "count":
-                        value = int(v)
-                    elif e.action in ("store_true", "store_false",):
-                        value = bool(v)
-                    else:
-                        value = v
-                elif e.type == int:
-                    value = int(v)
-                elif e.type == float:
-                    value = float(v)
-                elif e.type == bool:
-                    value = bool(v)
-                else:
-                    value = str(v)
-
-                setattr(self, k, value)
+            arg = self._arguments.get(k)
+            if arg is not None:
+                name, e = arg
+                v = e.convert(v)
+                if e.path and self.cwd is not None and isinstance(v, str):
+                    v = os.path.join(self.cwd, v)
+                setattr(self, name, v)
 
     def _build_env(self):
         pass
 
     def _normalize(self):
         if self.executable is not None:
-            self.executable = shutil.which(self.executable)
+            environ = utils.environ(self.parent_environment)
+            self.executable = shutil.which(self.executable, path=environ.get("PATH"))
 
     def _validate(self):
         if self.executable is None:
             raise (errors.ValidationError("The defined executable does not exist"))
+        self._retry_policy()
 
     def _pre(self):
         pass
@@ -201,41 +377,365 @@ class Base(object):
     def _post(self):
         pass
 
-    def run(self, argv):
-        "Validates the data and executes the playbook"
+    def _prepare(self, argv):
+        "Parses the arguments, normalizes and validates them"
 
-        args = self._cli(argv)
-        self._load_args(vars(args))
-        self._normalize()
+        self.timer = timing.Timer()
+        self._started = time.time()
+        self.attempts = 0
+        self.expired = None
+        with self.timer.phase("cli"):
+            args = self._cli(argv)
+            self._load_args(vars(args))
+        with self.timer.phase("normalize"):
+            self._normalize()
 
         if not self.no_validation:
-            self._validate()
+            with self.timer.phase("validate"):
+                self._validate()
 
-        self._pre()
-        self._build_command()
-        self._build_env()
+    def _build(self):
+        "Builds the command line and its environment"
+
+        with self.timer.phase("build_command"):
+            self._build_command()
+        with self.timer.phase("build_env"):
+            self._build_env()
 
         if self.verbosity > 0:
             if len(self.environment) > 0:
                 with printer.section("Running with the following extra environment:"):
-                    for k, v in self.environment.items():
-                        val = v
-                        if "password" in k.lower() or "secret" in k.lower():
-                            val = "<redacted>"
-                        print("{}={}".format(k, val))
+                    for k, v in report.redact(self.environment).items():
+                        print("{}={}".format(k, v))
+
+    def _print_dry_run(self):
+        with printer.section("Dry-run mode, should execute this command:"):
+            print(" \\\n".join(self.command_line))
+
+    def run(self, argv):
+        "Validates the data and executes the playbook"
+
+        self._prepare(argv)
+        self._capture()
 
-        rc = 0
+        rc = None
+        error = None
+        # _post releases whatever _pre and _build acquired, even if they fail
         try:
+            with self.timer.phase("pre"):
+                self._pre()
+            self._build()
             if self.dry_run:
-                with printer.section("Dry-run mode, should execute this command:"):
-                    print(" \\\n".join(self.command_line))
+                self._print_dry_run()
             else:
                 if len(self.command_line) > 0:
-                    with ctx.env(**self.environment):
-                        p = subprocess.Popen(self.command_line)
-                        p.communicate()
-                        rc = p.returncode
+                    with self.timer.phase("execute"):
+                        rc = self._execute_retrying()
+        except BaseException as e:
+            error = e
+            raise
         finally:
-            self._post()
+            with self.timer.phase("post"):
+                # _post may remove or move them
+                self._artifacts = self.artifacts()
+                self._post()
+            self._finish(rc, error)
 
+        return self.result.rc
+
+    def _capture(self):
+        """
+        The output is only captured when something looks at it, the tail for
+        the report or retries and the supervisor for the idle timeout
+        """
+
+        self._sinks = self.sinks
+        self._tail = None
+        capture = (self.report_file, self.retry_pattern, self.idle_timeout)
+        if any(option is not None for option in capture):
+            self._tail = stream.RingBuffer(self.tail_lines)
+            self.sinks = list(self.sinks or [stream.Terminal()]) + [self._tail]
+
+    def artifacts(self):
+        "Paths of the files of the run, name -> path"
+
+        return {}
+
+    def _retry_policy(self):
+        try:
+            codes = retry.parse_codes(self.retry_codes)
+        except ValueError:
+            raise (
+                errors.ValidationError(
+                    "Invalid return codes to retry on: {}".format(self.retry_codes)
+                )
+            )
+        try:
+            return retry.Policy(
+                self.retries, self.retry_delay, codes=codes, pattern=self.retry_pattern
+            )
+        except re.error as e:
+            raise (errors.ValidationError("Invalid retry pattern: {}".format(e)))
+
+    def _output_lines(self):
+        "The last output lines, matched against the retry pattern"
+
+        return self._tail.lines() if self._tail is not None else []
+
+    def _resume(self, rc):
+        """
+        Called before the command is run again, may change the command line
+        to pick up where the failed attempt stopped. Returns False to give up.
+        """
+
+        return True
+
+    def _next_attempt(self, policy, rc):
+        "Seconds to wait before the next attempt, None when there is none"
+
+        if not policy.retryable(self.attempts, rc, self._output_lines()):
+            return None
+        if not self._resume(rc):
+            return None
+        delay = policy.wait(self.attempts)
+        printer.header(
+            "Attempt {}/{} failed with {}, retrying in {:.0f}s".format(
+                self.attempts, policy.retries + 1, rc, delay
+            )
+        )
+        return delay
+
+    def _execute_retrying(self):
+        policy = self._retry_policy()
+        self.attempts = 0
+        while True:
+            self.attempts += 1
+            rc = self._execute()
+            delay = self._next_attempt(policy, rc)
+            if delay is None:
+                return rc
+            time.sleep(delay)
+
+    async def _execute_retrying_async(self, grace):
+        import asyncio
+
+        policy = self._retry_policy()
+        self.attempts = 0
+        while True:
+            self.attempts += 1
+            rc = await self._execute_async(grace)
+            delay = await self._blocking(self._next_attempt, policy, rc)
+            if delay is None:
+                return rc
+            await asyncio.sleep(delay)
+
+    def _finish(self, rc, error):
+        "Builds the result of the run and writes out the timings and report"
+
+        self._write_timings()
+        self.sinks = self._sinks
+
+        if rc is None and error is None:  # dry-run or nothing to run
+            rc = 0
+        if error is not None:
+            error = "{}: {}".format(type(error).__name__, error)
+
+        self.result = report.Result(
+            self.ap.prog,
+            rc,
+            error=error,
+            timings=self.timings,
+            command_line=self.command_line,
+            environment=self.environment,
+            artifacts=self._artifacts,
+            tail=self._tail.lines() if self._tail is not None else None,
+            started=self._started,
+            attempts=self.attempts,
+            expired=self.expired,
+        )
+        if self.report_file is not None:
+            report.append(self.report_file, self.result)
+
+    @property
+    def timings(self):
+        "Time spent in each phase of the last run and the child's resource usage"
+
+        return self.timer.to_dict()
+
+    def _write_timings(self):
+        self.timer.stop()
+        if self.timings_file is not None:
+            timing.write(self.timings_file, self.timings)
+
+    def _child_env(self):
+        """
+        The environment for the child: the extra variables layered on top of
+        the parent environment, os.environ itself is never modified so agents
+        can run concurrently in the same process
+        """
+
+        return ctx.Environment(self.parent_environment, **self.environment)
+
+    def _pass_fds(self):
+        "File descriptors the child inherits, besides the standard ones"
+
+        return ()
+
+    def _supervise(self, process):
+        return supervisor.Supervisor(
+            process, self.timeout, self.idle_timeout, self.termination_grace
+        ).start()
+
+    def _expired(self, guard):
+        "Tells why the supervisor killed the command, if it did"
+
+        if guard.expired is not None:
+            self.expired = guard.expired
+            printer.header(
+                "Killed the command, reason: {} (after {:.0f}s)".format(
+                    guard.expired, guard.elapsed
+                )
+            )
+
+    def _execute(self):
+        "Spawns the command line and waits for it to finish"
+
+        pipe = subprocess.PIPE if self.sinks else None
+        start = time.perf_counter()
+        # in its own process group, signalled as a whole by the supervisor
+        self.process = subprocess.Popen(
+            self.command_line,
+            stdout=pipe,
+            stderr=pipe,
+            env=self._child_env(),
+            pass_fds=self._pass_fds(),
+            cwd=self.cwd,
+            start_new_session=True,
+        )
+        guard = self._supervise(self.process)
+        try:
+            if self.sinks:
+                stream.pump(self.process, self.sinks + [guard])
+            rc, self.timer.child = timing.wait(self.process)
+        except KeyboardInterrupt:
+            guard.interrupt()
+            timing.wait(self.process)
+            raise
+        finally:
+            guard.stop()
+            self._expired(guard)
+        self.timer.child["wall"] = time.perf_counter() - start
         return rc
+
+    async def run_async(self, argv, grace=None):
+        """
+        Same as run() but the child is awaited from the running event loop,
+        the _pre() and _post() hooks may be coroutines, the other hooks run
+        in the executor. Cancelling the task sends SIGTERM to the child and
+        SIGKILL after `grace` seconds.
+        """
+
+        await self._blocking(self._prepare, argv)
+        self._capture()
+
+        rc = None
+        error = None
+        try:
+            with self.timer.phase("pre"):
+                await self._blocking(self._pre)
+            await self._blocking(self._build)
+            if self.dry_run:
+                self._print_dry_run()
+            else:
+                if len(self.command_line) > 0:
+                    with self.timer.phase("execute"):
+                        rc = await self._execute_retrying_async(
+                            self.termination_grace if grace is None else grace
+                        )
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with self.timer.phase("post"):
+                # _post may remove or move them
+                self._artifacts = self.artifacts()
+                await self._blocking(self._post)
+            await self._blocking(self._finish, rc, error)
+
+        return self.result.rc
+
+    async def _blocking(self, hook, *args):
+        """
+        Awaits the hook, run by the executor unless it is a coroutine function
+        so the event loop keeps serving the other jobs in the meantime
+        """
+
+        # imported by the async runs only, it costs more than all the rest
+        # of the start-up of a synchronous one
+        import asyncio
+
+        if inspect.iscoroutinefunction(hook):
+            return await hook(*args)
+        loop = asyncio.get_event_loop()
+        value = await loop.run_in_executor(
+            self.executor, functools.partial(hook, *args)
+        )
+        return await _maybe_await(value)
+
+    async def _execute_async(self, grace):
+        "Spawns the command line and awaits it, terminating it on cancellation"
+
+        import asyncio
+
+        # the event loop reaps the child itself, only the wall time of the
+        # "execute" phase is available here, no resource usage
+        pipe = asyncio.subprocess.PIPE if self.sinks else None
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command_line,
+            stdout=pipe,
+            stderr=pipe,
+            env=self._child_env(),
+            pass_fds=self._pass_fds(),
+            cwd=self.cwd,
+            start_new_session=True,
+        )
+        guard = self._supervise(self.process)
+        try:
+            if self.sinks:
+                sinks = self.sinks + [guard]
+                await asyncio.gather(
+                    stream.pump_async(self.process.stdout, "stdout", sinks),
+                    stream.pump_async(self.process.stderr, "stderr", sinks),
+                )
+            return await self.process.wait()
+        except asyncio.CancelledError:
+            await _terminate(self.process, grace)
+            raise
+        finally:
+            guard.stop()
+            self._expired(guard)
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+async def _terminate(process, grace):
+    "SIGTERM the process group, then SIGKILL it if still around after grace"
+
+    import asyncio
+
+    if process.returncode is not None:
+        return
+
+    supervisor.signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        supervisor.signal_group(process, signal.SIGKILL)
+        await process.wait()
+
+
+Base._compile_arguments()
@@ -14,9 +14,30 @@
 
 import os.path
 import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
 
 import dciagent.core.agents as agents
+import dciagent.core.ansiblecfg as ansiblecfg
 import dciagent.core.errors as errors
+import dciagent.core.events as events
+import dciagent.core.extravars as extravars
+import dciagent.core.inventory as inventory
+import dciagent.core.printer as printer
+import dciagent.core.shard as shard
+import dciagent.core.stream as stream
+import dciagent.core.supervisor as supervisor
+import dciagent.core.timing as timing
+import dciagent.core.utils as utils
+import dciagent.core.validation as validation
+import dciagent.core.watch as watch
+
+# how a failed run is retried
+RESUME_MODES = ("all", "hosts", "task")
 
 
 class Agent(agents.Base):
@@ -25,11 +46,20 @@ class Agent(agents.Base):
     default_ansible_inventory = "/etc/ansible/hosts"
     default_playbook = None
     environment = {}
+    # (hosts, command line) of every shard when running sharded
+    shard_commands = []
+    processes = []
+    _retry_tmp = None
+    _generated_tmp = None
+    # the events of the playbook, from the bundled callback plugin
+    events = None
+    _last_failure = None
     ansible_config = agents.Argument(
         "override path to ansible.cfg",
         short="-c",
         long="--ansible-config",
         env="ANSIBLE_CONFIG",
+        path=True,
     )
     ansible_limit = agents.Argument(
         "limit playbook execution to the given subset",
@@ -71,6 +101,55 @@ class Agent(agents.Base):
         nargs="?",
         dest="playbook",
         env="ANSIBLE_PLAYBOOK",
+        path=True,
+    )
+    validation_cache = agents.Argument(
+        "also cache the validation verdicts in this directory",
+        long="--validation-cache",
+        env="VALIDATION_CACHE",
+        path=True,
+    )
+    shards = agents.Argument(
+        "split the inventory hosts in this many playbook runs done concurrently",
+        long="--shards",
+        type=int,
+        default=1,
+        env="ANSIBLE_SHARDS",
+    )
+    shard_by = agents.Argument(
+        "how the hosts are split in shards: count, group or hash",
+        long="--shard-by",
+        default="count",
+        env="ANSIBLE_SHARD_BY",
+    )
+
+    extra_vars_dir = agents.Argument(
+        "write the merged extra variables file in this directory, identical"
+        " sets of variables are reused across runs",
+        long="--extra-vars-dir",
+        env="ANSIBLE_EXTRA_VARS_DIR",
+        path=True,
+    )
+    ansible_profile = agents.Argument(
+        "layer this performance profile over ansible.cfg: {}".format(
+            ", ".join(ansiblecfg.PROFILES)
+        ),
+        long="--ansible-profile",
+        env="ANSIBLE_PROFILE",
+    )
+    resume = agents.Argument(
+        "what a retry runs again: all, hosts (only the failed ones) or task"
+        " (from the failed task on)",
+        long="--resume",
+        default="all",
+        env="ANSIBLE_RESUME",
+    )
+    no_events = agents.Argument(
+        "do not enable the callback plugin sending the playbook events",
+        long="--no-events",
+        action="store_true",
+        default=False,
+        env="ANSIBLE_NO_EVENTS",
     )
 
     def __init__(self, prog, desc, version):
@@ -94,11 +173,73 @@ class Agent(agents.Base):
             if self.default_ansible_config is not None:
                 self.ansible_config = self.default_ansible_config
 
+        # a single string when given as is e.g. by a batch or daemon job
+        if isinstance(self.ansible_extra_vars, str):
+            self.ansible_extra_vars = [self.ansible_extra_vars]
+
+        if self.cwd is not None:
+            self._resolve_paths()
+
+    def _resolve_paths(self):
+        "The inventory and @files given relative to the run's directory"
+
+        # not a list of hosts e.g. "node1,node2"
+        inventory = self.ansible_inventory
+        if inventory is not None and "," not in inventory:
+            self.ansible_inventory = os.path.join(self.cwd, inventory)
+        if self.ansible_extra_vars is not None:
+            self.ansible_extra_vars = [
+                "@" + os.path.join(self.cwd, e[1:]) if e.startswith("@") else e
+                for e in self.ansible_extra_vars
+            ]
+
     def _build_env(self):
         cfg = self.ansible_config
 
+        # never update the class-level dict, it is shared by all instances
+        self.environment = {}
+        if self.ansible_profile is not None:
+            cfg = self._overlay_config(cfg)
         if cfg is not None:
-            self.environment = {"ANSIBLE_CONFIG": cfg}
+            self.environment["ANSIBLE_CONFIG"] = cfg
+
+        if self.retries > 0 and self.resume == "hosts" and not self.dry_run:
+            self.environment["ANSIBLE_RETRY_FILES_ENABLED"] = "True"
+            self.environment["ANSIBLE_RETRY_FILES_SAVE_PATH"] = self._retry_dir()
+
+        if not self.no_events:
+            self.environment["ANSIBLE_CALLBACK_PLUGINS"] = self._callback_plugins(cfg)
+            if not self.dry_run:
+                self._last_failure = None
+                self.events = events.Pipe(self._on_event).start()
+                self.environment.update(self.events.environment())
+
+    def _callback_plugins(self, cfg):
+        """
+        The callback plugin directories ansible would use, with the one of
+        the bundled plugin first
+        """
+
+        environ = utils.environ(self.parent_environment)
+        current = environ.get("ANSIBLE_CALLBACK_PLUGINS")
+        if current is None:
+            path = ansiblecfg.find(cfg)
+            if path is not None:
+                current = ansiblecfg.get(path, "defaults", "callback_plugins")
+        if current is None:
+            current = ansiblecfg.DEFAULT_CALLBACK_PLUGINS
+        return os.pathsep.join([events.PLUGIN_DIR, current])
+
+    def _pass_fds(self):
+        if self.events is None:
+            return ()
+        return (self.events.fd,)
+
+    def _on_event(self, event):
+        "Called from the reader's thread with every event of the playbook"
+
+        if event.get("event") in ("failed", "unreachable") and not event.get("ignored"):
+            self._last_failure = event
 
     def _validate(self):
         super()._validate()
@@ -112,6 +253,7 @@ class Agent(agents.Base):
                     "Cannot read ansible playbook {}".format(playbook)
                 )
             )
+        validation.check("playbook", playbook, self.validation_cache)
 
         inventory = self.ansible_inventory
         if not os.path.isfile(inventory):
@@ -120,6 +262,7 @@ class Agent(agents.Base):
                     "Cannot read ansible inventory file {}".format(inventory)
                 )
             )
+        validation.check("inventory", inventory, self.validation_cache)
 
         cfg = self.ansible_config
         if cfg is None:
@@ -131,6 +274,45 @@ class Agent(agents.Base):
                 raise (
                     errors.ValidationError("Cannot read ansible config {}".format(cfg))
                 )
+            validation.check("config", cfg, self.validation_cache)
+
+        if (
+            self.ansible_profile is not None
+            and self.ansible_profile not in ansiblecfg.PROFILES
+        ):
+            raise (
+                errors.ValidationError(
+                    "Unknown ansible profile {}, use one of: {}".format(
+                        self.ansible_profile, ", ".join(ansiblecfg.PROFILES)
+                    )
+                )
+            )
+
+        if self.resume not in RESUME_MODES:
+            raise (
+                errors.ValidationError(
+                    "Unknown resume mode {}, use one of: {}".format(
+                        self.resume, ", ".join(RESUME_MODES)
+                    )
+                )
+            )
+
+        if self.shards < 1:
+            raise (errors.ValidationError("The number of shards must be at least 1"))
+        if self.shard_by not in shard.STRATEGIES:
+            raise (
+                errors.ValidationError(
+                    "Unknown sharding strategy {}, use one of: {}".format(
+                        self.shard_by, ", ".join(shard.STRATEGIES)
+                    )
+                )
+            )
+        if self.shards > 1 and os.access(inventory, os.X_OK):
+            raise (
+                errors.ValidationError(
+                    "Cannot shard the dynamic inventory {}".format(inventory)
+                )
+            )
 
     def _build_command(self):
         self.command_line = [
@@ -139,7 +321,8 @@ class Agent(agents.Base):
             self.ansible_inventory,
         ]
 
-        if self.ansible_limit is not None:
+        # the limit is resolved per shard when running sharded
+        if self.ansible_limit is not None and self.shards <= 1:
             self.command_line.extend(["--limit", shlex.quote(self.ansible_limit)])
 
         if self.ansible_tags is not None:
@@ -151,8 +334,8 @@ class Agent(agents.Base):
             )
 
         if self.ansible_extra_vars is not None:
-            for extra_var in self.ansible_extra_vars:
-                self.command_line.extend(["--extra-vars", shlex.quote(extra_var)])
+            for extra_var in self._extra_vars():
+                self.command_line.extend(["--extra-vars", extra_var])
 
         if self.ansible_args is not None:
             self.command_line.extend(shlex.split(self.ansible_args))
@@ -162,3 +345,334 @@ class Agent(agents.Base):
             self.command_line.append(verbosity)
 
         self.command_line.append(self.playbook)
+
+        self.shard_commands = []
+        if self.shards > 1:
+            self._build_shards()
+
+    def _build_shards(self):
+        "Splits the inventory hosts and builds the command line of each shard"
+
+        try:
+            hosts = inventory.hosts(self.ansible_inventory)
+        except (OSError, ValueError) as e:
+            raise (
+                errors.ValidationError(
+                    "Cannot read the hosts of {}: {}".format(self.ansible_inventory, e)
+                )
+            )
+        if self.ansible_limit is not None:
+            selected = inventory.select(hosts, self.ansible_limit)
+            hosts = type(hosts)((h, hosts[h]) for h in selected)
+
+        # never fall back to a run without the limit i.e. on every host
+        if not hosts:
+            raise (
+                errors.ValidationError(
+                    "No host of {} matches the limit {}".format(
+                        self.ansible_inventory, self.ansible_limit or "all"
+                    )
+                )
+            )
+
+        for part in shard.partition(hosts, self.shards, self.shard_by):
+            command_line = self.command_line[:-1]
+            command_line.extend(["--limit", ",".join(part), self.command_line[-1]])
+            self.shard_commands.append((part, command_line))
+
+    def _overlay_config(self, cfg):
+        "Generates the ansible.cfg with the profile, returns its path"
+
+        hosts = None
+        if self.ansible_inventory is not None and os.path.isfile(
+            self.ansible_inventory
+        ):
+            try:
+                hosts = len(inventory.hosts(self.ansible_inventory))
+            except ValueError:
+                pass
+
+        text = ansiblecfg.overlay(cfg, self.ansible_profile, hosts)
+        if self.dry_run:
+            return os.path.join(self._generated_dir(), ansiblecfg.name(text))
+        return ansiblecfg.write(self._generated_dir(), text)
+
+    def _extra_vars_dir(self):
+        if self.extra_vars_dir is not None:
+            return self.extra_vars_dir
+        return self._generated_dir()
+
+    def _generated_dir(self):
+        """
+        Where the files generated for the run go, they may hold secrets of
+        the extra variables and are removed at the end of the run
+        """
+
+        if self.dry_run:  # only shows where they would be
+            return "<tempdir>"
+        if self._generated_tmp is None:
+            self._generated_tmp = tempfile.mkdtemp(prefix="ansible-generated-")
+        return self._generated_tmp
+
+    def _extra_vars(self):
+        """
+        The --extra-vars arguments, everything that can be merged goes in a
+        single @file named after its content
+        """
+
+        args = []
+        for item in extravars.merge(self.ansible_extra_vars):
+            if not isinstance(item, dict):
+                args.append(shlex.quote(item))
+            elif self.dry_run:
+                # only show where it would be
+                name = extravars.dump(item)[1]
+                args.append("@{}".format(os.path.join(self._extra_vars_dir(), name)))
+            else:
+                args.append("@{}".format(extravars.write(self._extra_vars_dir(), item)))
+        return args
+
+    def _retry_dir(self):
+        "Where ansible saves the retry files, removed at the end of the run"
+
+        if self._retry_tmp is None:
+            self._retry_tmp = tempfile.mkdtemp(prefix="ansible-retry-")
+        return self._retry_tmp
+
+    def _post(self):
+        super()._post()
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+        if self._retry_tmp is not None:
+            shutil.rmtree(self._retry_tmp, ignore_errors=True)
+            self._retry_tmp = None
+        if self._generated_tmp is not None:
+            shutil.rmtree(self._generated_tmp, ignore_errors=True)
+            self._generated_tmp = None
+
+    def _failed_task(self):
+        "Name of the task the last attempt failed at, from the events or log"
+
+        if self.events is not None and self.events.sync() and self.events.count:
+            failure = self._last_failure
+            return failure["task"] if failure else None
+
+        watcher = watch.Watcher(log_path=self.environment.get("ANSIBLE_LOG_PATH"))
+        if watcher.logs:
+            watcher.poll(final=True)
+        else:
+            watcher.feed(self._output_lines())
+        failures = watcher.progress.failures
+        return failures[-1]["task"] if failures else None
+
+    def _set_option(self, option, value):
+        "Sets the option of the command line, before the playbook"
+
+        if option in self.command_line[:-1]:
+            self.command_line[self.command_line.index(option) + 1] = value
+        else:
+            self.command_line[-1:-1] = [option, value]
+
+    def _resume(self, rc):
+        # the shards are simply run again
+        if self.shard_commands:
+            return True
+
+        if self.resume == "hosts":
+            name = os.path.splitext(os.path.basename(self.playbook))[0]
+            path = os.path.join(self._retry_dir(), "{}.retry".format(name))
+            if os.path.isfile(path):
+                self._set_option("--limit", "@{}".format(path))
+        elif self.resume == "task":
+            task = self._failed_task()
+            if task is not None:
+                self._set_option("--start-at-task", task)
+        return True
+
+    def _print_dry_run(self):
+        if not self.shard_commands:
+            return super()._print_dry_run()
+
+        for i, (hosts, command_line) in enumerate(self.shard_commands):
+            with printer.section(
+                "Dry-run mode, shard {}/{} ({} hosts) should execute this "
+                "command:".format(i + 1, len(self.shard_commands), len(hosts))
+            ):
+                print(" \\\n".join(command_line))
+
+    def _shard_env(self, index):
+        """
+        The environment of one shard, the log file and the JUnit output are
+        kept apart and merged once all the shards are done
+        """
+
+        overrides = {}
+        log = self.environment.get("ANSIBLE_LOG_PATH")
+        if log is not None:
+            overrides["ANSIBLE_LOG_PATH"] = "{}.shard-{}".format(log, index)
+        junit = self.environment.get("JUNIT_OUTPUT_DIR")
+        if junit is not None:
+            overrides["JUNIT_OUTPUT_DIR"] = os.path.join(
+                junit, "shard-{}".format(index)
+            )
+        return self._child_env().layer(**overrides)
+
+    def _shard_sinks(self, index):
+        if not self.sinks:
+            return []
+        return [stream.Prefixed("[shard {}] ".format(index), self.sinks)]
+
+    def _merge_shards(self):
+        "Appends the shard logs to the main one, moves the JUnit files up"
+
+        log = self.environment.get("ANSIBLE_LOG_PATH")
+        junit = self.environment.get("JUNIT_OUTPUT_DIR")
+        for index in range(len(self.shard_commands)):
+            if log is not None:
+                path = "{}.shard-{}".format(log, index)
+                if os.path.isfile(path):
+                    with open(log, "ab") as dest, open(path, "rb") as src:
+                        shutil.copyfileobj(src, dest)
+                    os.unlink(path)
+            if junit is not None:
+                path = os.path.join(junit, "shard-{}".format(index))
+                if os.path.isdir(path):
+                    for name in sorted(os.listdir(path)):
+                        os.replace(
+                            os.path.join(path, name),
+                            os.path.join(junit, "shard-{}-{}".format(index, name)),
+                        )
+                    os.rmdir(path)
+
+    def _execute(self):
+        if not self.shard_commands:
+            return super()._execute()
+
+        pipe = subprocess.PIPE if self.sinks else None
+        start = time.perf_counter()
+        self.processes = [
+            subprocess.Popen(
+                command_line,
+                stdout=pipe,
+                stderr=pipe,
+                env=self._shard_env(i),
+                pass_fds=self._pass_fds(),
+                cwd=self.cwd,
+                start_new_session=True,
+            )
+            for i, (_, command_line) in enumerate(self.shard_commands)
+        ]
+        results = [None] * len(self.processes)
+        failures = [None] * len(self.processes)
+        guards = [self._supervise(p) for p in self.processes]
+
+        def wait(index, process):
+            try:
+                sinks = self._shard_sinks(index)
+                if sinks:
+                    stream.pump(process, sinks + [guards[index]])
+                results[index] = timing.wait(process)
+            except Exception as e:
+                # e.g. a sink failing, raised again once all the shards are done
+                failures[index] = e
+                supervisor.signal_group(process, signal.SIGKILL)
+                process.wait()
+            finally:
+                guards[index].stop()
+
+        threads = [
+            threading.Thread(target=wait, args=(i, p))
+            for i, p in enumerate(self.processes)
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                t.join()
+        except KeyboardInterrupt:
+            for guard in guards:
+                guard.interrupt()
+            for t in threads:
+                t.join()
+            raise
+        finally:
+            for guard in guards:
+                self._expired(guard)
+            self._merge_shards()
+        for failure in failures:
+            if failure is not None:
+                raise failure
+        self.timer.child = _sum_usage([usage for _, usage in results])
+        self.timer.child["wall"] = time.perf_counter() - start
+        return _returncode([rc for rc, _ in results])
+
+    async def _execute_async(self, grace):
+        if not self.shard_commands:
+            return await super()._execute_async(grace)
+
+        import asyncio
+
+        pipe = asyncio.subprocess.PIPE if self.sinks else None
+        self.processes = []
+
+        async def one(index, command_line):
+            process = await asyncio.create_subprocess_exec(
+                *command_line,
+                stdout=pipe,
+                stderr=pipe,
+                env=self._shard_env(index),
+                pass_fds=self._pass_fds(),
+                cwd=self.cwd,
+                start_new_session=True,
+            )
+            self.processes.append(process)
+            guard = self._supervise(process)
+            try:
+                sinks = self._shard_sinks(index)
+                if sinks:
+                    sinks = sinks + [guard]
+                    await asyncio.gather(
+                        stream.pump_async(process.stdout, "stdout", sinks),
+                        stream.pump_async(process.stderr, "stderr", sinks),
+                    )
+                return await process.wait()
+            except asyncio.CancelledError:
+                await agents._terminate(process, grace)
+                raise
+            finally:
+                guard.stop()
+                self._expired(guard)
+
+        try:
+            rcs = await asyncio.gather(
+                *(one(i, c) for i, (_, c) in enumerate(self.shard_commands))
+            )
+        finally:
+            self._merge_shards()
+        return _returncode(rcs)
+
+
+def _returncode(rcs):
+    """
+    Return code of the sharded run: the first failing shard's, negative when
+    killed by a signal, or 0 if all passed
+    """
+
+    for rc in rcs:
+        if rc != 0:
+            return rc
+    return 0
+
+
+def _sum_usage(usages):
+    "Resource usage of all the shards together"
+
+    total = {}
+    for usage in usages:
+        for k, v in usage.items():
+            if k == "max_rss_kb":
+                total[k] = max(total.get(k, 0), v)
+            else:
+                total[k] = total.get(k, 0) + v
+    return total
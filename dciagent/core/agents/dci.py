@@ -13,20 +13,36 @@
 # under the License.
 
 import os.path
-import shutil
-import subprocess
-import tempfile
+import signal
 
-import dciagent.core.agent as agent
+import dciagent.core.agents as agent
+import dciagent.core.agents.ansible
+import dciagent.core.ansiblecfg as ansiblecfg
+import dciagent.core.credentials as credentials
+import dciagent.core.errors as errors
+import dciagent.core.factcache as factcache
+import dciagent.core.logarchive as logarchive
 import dciagent.core.printer as printer
-import dciagent.core.agent.ansible
+import dciagent.core.supervisor as supervisor
+import dciagent.core.tempdirs as tempdirs
+import dciagent.core.upload as upload
+import dciagent.core.utils as utils
+import dciagent.core.validation as validation
+import dciagent.core.watch as watch
 
 
-class Agent(dciagent.core.agent.ansible.Agent):
+class Agent(dciagent.core.agents.ansible.Agent):
     default_auth_file = "dcirc.sh"
     default_inventory = "hosts"
     default_settings_file = "settings.yml"
     default_config_dir = None
+    # seconds between two looks at the log and JUnit files during the run
+    watch_interval = 2.0
+    watcher = None
+    archive = None
+    uploader = None
+    fact_cache = None
+    _tempdir = None
     prefix = agent.Argument(
         "prefix all auto-discovered settings with this string",
         "-P",
@@ -39,18 +55,21 @@ class Agent(dciagent.core.agent.ansible.Agent):
         short="-C",
         long="--config-dir",
         env="DCI_CONFIG_DIR",
+        path=True,
     )
     auth_file = agent.Argument(
         "override DCI agent authentication file i.e. dcirc.sh",
         short="-A",
         long="--auth-file",
         env="DCI_AUTH_FILE",
+        path=True,
     )
     settings_file = agent.Argument(
         "override DCI agent settings file i.e. settings.yml",
         short="-S",
         long="--settings-file",
         env="DCI_SETTINGS_FILE",
+        path=True,
     )
     no_cleanup = agent.Argument(
         "do not remove temporary directory",
@@ -59,10 +78,102 @@ class Agent(dciagent.core.agent.ansible.Agent):
         default=False,
         env="DCI_NO_CLEANUP",
     )
+    cleanup = agent.Argument(
+        "how the temporary directory is removed: sync, background (by a"
+        " detached process) or defer (to dci-agent-sweep)",
+        long="--cleanup",
+        default="sync",
+        env="DCI_CLEANUP",
+    )
+    no_fact_cache = agent.Argument(
+        "do not keep the facts of the hosts between runs",
+        long="--no-fact-cache",
+        action="store_true",
+        default=False,
+        env="DCI_NO_FACT_CACHE",
+    )
+    fact_cache_dir = agent.Argument(
+        "root of the fact caches, one per configuration directory and prefix"
+        " (default: ~/.cache/dciagent/facts)",
+        long="--fact-cache-dir",
+        env="DCI_FACT_CACHE_DIR",
+        path=True,
+    )
+    fact_cache_ttl = agent.Argument(
+        "seconds the cached facts are valid",
+        long="--fact-cache-ttl",
+        type=int,
+        default=3600,
+        env="DCI_FACT_CACHE_TTL",
+    )
+    fact_cache_size = agent.Argument(
+        "MiB the fact caches may use all together, the oldest facts go first",
+        long="--fact-cache-size",
+        type=int,
+        default=256,
+        env="DCI_FACT_CACHE_SIZE",
+    )
+    log_archive = agent.Argument(
+        "also keep ansible.log compressed in this file, zstd for .zst files"
+        " and gzip otherwise, with an index of the tasks next to it",
+        long="--log-archive",
+        env="DCI_LOG_ARCHIVE",
+        path=True,
+    )
+    upload_url = agent.Argument(
+        "upload the JUnit files and ansible.log to this URL as soon as they are"
+        " complete, one chunked PUT per file to <url>/<name>",
+        long="--upload-url",
+        env="DCI_UPLOAD_URL",
+    )
+    upload_user = agent.Argument(
+        "user of the upload server, https only, the password is read from"
+        " $DCI_UPLOAD_PASSWORD. The remoteci's credentials are never sent",
+        long="--upload-user",
+        env="DCI_UPLOAD_USER",
+    )
+    upload_workers = agent.Argument(
+        "uploads running at the same time",
+        long="--upload-workers",
+        type=int,
+        default=4,
+        env="DCI_UPLOAD_WORKERS",
+    )
+    tempdir_root = agent.Argument(
+        "create the temporary directory in this directory e.g. a tmpfs",
+        long="--tempdir-root",
+        env="DCI_TEMPDIR_ROOT",
+        path=True,
+    )
+    credentials_cache = agent.Argument(
+        "also cache the parsed authentication file in this directory",
+        long="--credentials-cache",
+        env="DCI_CREDENTIALS_CACHE",
+        path=True,
+    )
+    abort_on_failure = agent.Argument(
+        "terminate the playbook as soon as a task failure shows in the logs",
+        long="--abort-on-failure",
+        action="store_true",
+        default=False,
+        env="DCI_ABORT_ON_FAILURE",
+    )
 
     def __init__(self, prog, desc, version):
         super().__init__(prog, desc, version)
-        self.tempdir = tempfile.mkdtemp(prefix="dci-")
+
+    @property
+    def tempdir(self):
+        "Working directory of the run, only created when first needed"
+
+        if self._tempdir is None:
+            self._tempdir = tempdirs.create(self.tempdir_root)
+        return self._tempdir
+
+    def _tempdir_path(self, *parts):
+        # a dry-run only shows where the files would go
+        tempdir = "<tempdir>" if self.dry_run else self.tempdir
+        return os.path.join(tempdir, *parts)
 
     def _normalize(self):
 
@@ -90,39 +201,272 @@ class Agent(dciagent.core.agent.ansible.Agent):
                     "{}{}".format(self.prefix, self.default_settings_file),
                 )
 
+        # we run the super() normalize after because we have to munge the
+        # values according to the given prefix
+        super()._normalize()
+
         if self.ansible_extra_vars is None:
             self.ansible_extra_vars = []
 
-        self.ansible_extra_vars.append(
-            "JOB_ID_FILE={}".format(os.path.join(self.tempdir, "dci.job"))
-        )
         if self.settings_file is not None:
             self.ansible_extra_vars.append("@{}".format(self.settings_file))
 
-        # we run the super() normalize after because we have to munge the
-        # values according to the given prefix
-        super()._normalize()
+    def _validate(self):
+        super()._validate()
+
+        if self.auth_file is not None:
+            if not os.path.isfile(self.auth_file) or not os.access(
+                self.auth_file, os.R_OK
+            ):
+                raise (
+                    errors.ValidationError(
+                        "Cannot read authentication file {}".format(self.auth_file)
+                    )
+                )
+
+        if self.settings_file is not None:
+            if not os.path.isfile(self.settings_file):
+                raise (
+                    errors.ValidationError(
+                        "Cannot read settings file {}".format(self.settings_file)
+                    )
+                )
+            validation.check("settings", self.settings_file, self.validation_cache)
+
+        if self.cleanup not in tempdirs.MODES:
+            raise (
+                errors.ValidationError(
+                    "Unknown cleanup mode {}, use one of: {}".format(
+                        self.cleanup, ", ".join(tempdirs.MODES)
+                    )
+                )
+            )
+
+        if self.log_archive is not None:
+            try:
+                logarchive.codec(self.log_archive)
+            except ValueError as e:
+                raise (errors.ValidationError(str(e)))
+
+        if self.upload_url is not None:
+            try:
+                upload.Uploader.check(self.upload_url, self._upload_headers())
+            except ValueError as e:
+                raise (errors.ValidationError(str(e)))
+
+    def _generated_dir(self):
+        return self._tempdir_path()
+
+    def _upload_headers(self):
+        if self.upload_user is None:
+            return {}
+        environ = utils.environ(self.parent_environment)
+        return upload.basic_auth(
+            self.upload_user, environ.get("DCI_UPLOAD_PASSWORD", "")
+        )
+
+    def _retry_dir(self):
+        path = self._tempdir_path("retry")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _build_command(self):
+        extra_vars = self.ansible_extra_vars
+        job_id = "JOB_ID_FILE={}".format(self._tempdir_path("dci.job"))
+        # before the settings file, so it can still be overridden there
+        if self.settings_file is not None:
+            self.ansible_extra_vars = extra_vars[:-1] + [job_id] + extra_vars[-1:]
+        else:
+            self.ansible_extra_vars = extra_vars + [job_id]
+        try:
+            super()._build_command()
+        finally:
+            self.ansible_extra_vars = extra_vars
 
     def _build_env(self):
         super()._build_env()
-        creds = self._read_credentials()
+        with self.timer.phase("read_credentials"):
+            creds = self._read_credentials()
         self.environment.update(creds)
         self.environment.update(
             {
-                "ANSIBLE_LOG_PATH": os.path.join(self.tempdir, "ansible.log"),
-                "JUNIT_OUTPUT_DIR": self.tempdir,
+                "ANSIBLE_LOG_PATH": self._tempdir_path("ansible.log"),
+                "JUNIT_OUTPUT_DIR": self._tempdir_path(),
                 "JUNIT_TEST_CASE_PREFIX": "test_",
                 "JUNIT_TASK_CLASS": "yes",
             }
         )
+        if not self.no_fact_cache:
+            self.environment.update(self._fact_cache_env())
+
+    def _fact_cache_env(self):
+        """
+        Enables the lab's fact cache, unless another run is using it or the
+        user configured a cache of their own
+        """
+
+        environ = utils.environ(self.parent_environment)
+        if "ANSIBLE_CACHE_PLUGIN" in environ:
+            return {}
+        # the environment would override the user's ansible.cfg
+        cfg = ansiblecfg.find(
+            self.environment.get("ANSIBLE_CONFIG", self.ansible_config)
+        )
+        if cfg is not None:
+            caching = ansiblecfg.get(cfg, "defaults", "fact_caching")
+            if caching not in (None, "memory"):
+                return {}
+        gathering = "ANSIBLE_GATHERING" not in environ and (
+            cfg is None or ansiblecfg.get(cfg, "defaults", "gathering") is None
+        )
+
+        cache = factcache.FactCache(
+            self.fact_cache_dir or factcache.default_root(),
+            factcache.lab_key(self.config_dir, self.prefix),
+            ttl=self.fact_cache_ttl,
+            max_bytes=self.fact_cache_size * 1024 * 1024,
+        )
+        if not self.dry_run:
+            if not cache.acquire():
+                printer.header(
+                    "Fact cache {} in use by another run, skipping it".format(
+                        cache.path
+                    )
+                )
+                return {}
+            self.fact_cache = cache
+            cache.prune()
+        return cache.environment(gathering)
+
+    def _pre(self):
+        super()._pre()
+
+        if not self.dry_run:
+            on_line = None
+            if self.log_archive is not None:
+                self.archive = logarchive.Writer(self.log_archive)
+                on_line = self.archive.line
+            on_junit = None
+            if self.upload_url is not None:
+                self.uploader = upload.Uploader(
+                    self.upload_url,
+                    workers=self.upload_workers,
+                    headers=self._upload_headers(),
+                )
+                on_junit = self.uploader.submit
+            self.watcher = watch.Watcher(
+                log_path=os.path.join(self.tempdir, "ansible.log"),
+                junit_dir=self.tempdir,
+                interval=self.watch_interval,
+                on_failure=self._on_failure,
+                on_line=on_line,
+                on_junit=on_junit,
+            )
+            self.watcher.start()
+
+    def _on_failure(self, failure):
+        "Called from the watcher's thread for every failure it finds"
+
+        if not self.abort_on_failure:
+            return
+        processes = self.processes if self.shard_commands else [self.process]
+        running = [p for p in processes if p is not None and p.returncode is None]
+        if not running:
+            return
+        printer.header(
+            "Aborting, task {} failed on {}".format(failure["task"], failure["host"])
+        )
+        for process in running:
+            # works for both Popen and asyncio processes from any thread
+            supervisor.signal_group(process, signal.SIGTERM)
+
+    def _shard_env(self, index):
+        env = super()._shard_env(index)
+        if self.watcher is not None:
+            # the shards write their own files, merged once they are done
+            self.watcher.unwatch(
+                self.environment.get("ANSIBLE_LOG_PATH"),
+                self.environment.get("JUNIT_OUTPUT_DIR"),
+            )
+            self.watcher.watch(env.get("ANSIBLE_LOG_PATH"), env.get("JUNIT_OUTPUT_DIR"))
+        return env
+
+    def _merge_shards(self):
+        if self.watcher is not None:
+            # the last lines and JUnit files, before they are moved
+            self.watcher.poll(final=True)
+        super()._merge_shards()
+
+    def _on_event(self, event):
+        super()._on_event(event)
+        if self.watcher is not None:
+            self.watcher.event(event)
+
+    @property
+    def progress(self):
+        "Live progress of the playbook, tasks run and failures found so far"
+
+        return self.watcher.progress if self.watcher is not None else None
+
+    def artifacts(self):
+        artifacts = {}
+        if self.archive is not None:
+            artifacts["log_archive"] = self.archive.path
+        if self._tempdir is None:  # never created or already removed
+            return artifacts
+
+        artifacts.update({"tempdir": self._tempdir, "junit_dir": self._tempdir})
+        log = os.path.join(self._tempdir, "ansible.log")
+        if os.path.isfile(log):
+            artifacts["ansible_log"] = log
+        return artifacts
 
     def _post(self):
+        super()._post()
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.archive is not None:
+            self.archive.close()
+        if self.uploader is not None:
+            self._upload()
+        if self.fact_cache is not None:
+            self.fact_cache.release()
+            self.fact_cache = None
+
+        if self._tempdir is None:
+            return
         if self.no_cleanup:
             printer.header(
-                "Skipping removal of temp directory: {}".format(self.tempdir)
+                "Skipping removal of temp directory: {}".format(self._tempdir)
             )
         else:
-            shutil.rmtree(self.tempdir)
+            trashed = tempdirs.discard(self._tempdir, self.cleanup)
+            self._relocate(self._tempdir, trashed)
+            self._tempdir = None
+
+    def _relocate(self, old, new):
+        "The artifacts under old were moved to new, or removed if it is None"
+
+        artifacts = {}
+        for name, path in self._artifacts.items():
+            if path == old or path.startswith(old + os.sep):
+                if new is None:
+                    continue
+                path = new + path[len(old) :]
+            artifacts[name] = path
+        self._artifacts = artifacts
+
+    def _upload(self):
+        "Uploads the remaining artifacts, waits for all of them to be sent"
+
+        for name in ("ansible_log", "log_archive"):
+            path = self.artifacts().get(name)
+            if path is not None:
+                self.uploader.submit(path)
+        failed = self.uploader.wait()
+        self.uploader.close()
+        for name, error in failed:
+            printer.header("Upload of {} failed: {}".format(name, error))
 
     def _read_credentials(self):
         """
@@ -130,18 +474,4 @@ class Agent(dciagent.core.agent.ansible.Agent):
         values
         """
 
-        pipe = subprocess.Popen(
-            ". {}; env".format(self.auth_file),
-            stdout=subprocess.PIPE,
-            shell=True,
-            env={},  # start with a clean environment
-            universal_newlines=True,
-        )
-        data = pipe.communicate()[0]
-        env = {}
-        for line in data.splitlines():
-            if line.startswith("DCI_"):
-                k, v = line.split("=")
-                env[k] = v
-
-        return env
+        return credentials.read(self.auth_file, cache_dir=self.credentials_cache)
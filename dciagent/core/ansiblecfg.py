@@ -0,0 +1,218 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Performance profiles layered over the user's ansible.cfg.
+
+A profile gives the settings the user's ansible.cfg doesn't have, the
+user's own settings always win. The result is written to a new file named
+after its content, so the relative paths of the user's file are made
+absolute first.
+"""
+
+import collections
+import configparser
+import hashlib
+import io
+import os
+
+import dciagent.core.utils as utils
+
+# "auto" forks, per CPU and overall maximum
+FORKS_PER_CPU = 4
+MAX_FORKS = 100
+
+_SSH = "-C -o ControlMaster=auto -o ControlPersist={}"
+_CONTROL_PATH = "%(directory)s/%%h-%%p-%%r"
+
+PROFILES = collections.OrderedDict(
+    [
+        (
+            "safe",
+            {
+                "defaults": {"forks": "auto"},
+                "ssh_connection": {
+                    "ssh_args": _SSH.format("60s"),
+                    "control_path": _CONTROL_PATH,
+                },
+            },
+        ),
+        (
+            # pipelining needs sudo without requiretty on the targets
+            "fast",
+            {
+                "defaults": {
+                    "forks": "auto",
+                    "gathering": "smart",
+                    "internal_poll_interval": "0.005",
+                },
+                "ssh_connection": {
+                    "pipelining": "True",
+                    "ssh_args": _SSH.format("30m"),
+                    "control_path": _CONTROL_PATH,
+                },
+            },
+        ),
+        (
+            # hosts don't wait for each other between tasks
+            "free",
+            {
+                "defaults": {
+                    "forks": "auto",
+                    "gathering": "smart",
+                    "internal_poll_interval": "0.005",
+                    "strategy": "free",
+                },
+                "ssh_connection": {
+                    "pipelining": "True",
+                    "ssh_args": _SSH.format("30m"),
+                    "control_path": _CONTROL_PATH,
+                },
+            },
+        ),
+    ]
+)
+
+# settings holding paths, relative to the directory of the ansible.cfg
+PATH_SETTINGS = frozenset(
+    [
+        "action_plugins",
+        "become_plugins",
+        "cache_plugins",
+        "callback_plugins",
+        "cliconf_plugins",
+        "collections_path",
+        "collections_paths",
+        "connection_plugins",
+        "doc_fragment_plugins",
+        "fact_caching_connection",
+        "filter_plugins",
+        "httpapi_plugins",
+        "inventory",
+        "inventory_plugins",
+        "library",
+        "local_tmp",
+        "log_path",
+        "lookup_plugins",
+        "module_utils",
+        "netconf_plugins",
+        "private_key_file",
+        "roles_path",
+        "strategy_plugins",
+        "terminal_plugins",
+        "test_plugins",
+        "vars_plugins",
+        "vault_password_file",
+    ]
+)
+
+# where ansible looks for its config when $ANSIBLE_CONFIG is not a file
+SEARCH_PATH = ("ansible.cfg", "~/.ansible.cfg", "/etc/ansible/ansible.cfg")
+DEFAULT_CALLBACK_PLUGINS = os.pathsep.join(
+    ["~/.ansible/plugins/callback", "/usr/share/ansible/plugins/callback"]
+)
+
+
+def forks(hosts=None):
+    "Forks for the CPU count, no more than there are hosts"
+
+    n = min((os.cpu_count() or 1) * FORKS_PER_CPU, MAX_FORKS)
+    if hosts is not None:
+        n = min(n, max(hosts, 1))
+    return n
+
+
+def _absolute(value, base):
+    paths = []
+    for path in value.split(os.pathsep):
+        path = path.strip()
+        if path and not path.startswith(("/", "~", "$")):
+            path = os.path.normpath(os.path.join(base, path))
+        paths.append(path)
+    return os.pathsep.join(paths)
+
+
+def overlay(path, profile, hosts=None):
+    """
+    The text of the user's ansible.cfg (if any) completed with the profile's
+    settings, forks are computed for the number of hosts when "auto"
+    """
+
+    cp = configparser.ConfigParser(interpolation=None)
+    cp.optionxform = str  # keep the case of the keys
+    if path is not None and os.path.isfile(path):
+        with open(path) as f:
+            cp.read_file(f, source=path)
+        base = os.path.dirname(os.path.abspath(path))
+        for section in cp.sections():
+            for key, value in cp.items(section, raw=True):
+                if key in PATH_SETTINGS:
+                    cp.set(section, key, _absolute(value, base))
+
+    for section, settings in PROFILES[profile].items():
+        if not cp.has_section(section):
+            cp.add_section(section)
+        for key, value in settings.items():
+            if not cp.has_option(section, key):
+                if value == "auto" and key == "forks":
+                    value = str(forks(hosts))
+                cp.set(section, key, value)
+
+    out = io.StringIO()
+    cp.write(out)
+    return out.getvalue()
+
+
+def find(path=None):
+    "The ansible.cfg ansible would read, given the one asked for if any"
+
+    for candidate in ([path] if path else []) + list(SEARCH_PATH):
+        candidate = os.path.expanduser(candidate)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def get(path, section, key):
+    "The setting of the ansible.cfg, paths made absolute, None when not set"
+
+    cp = configparser.ConfigParser(interpolation=None)
+    try:
+        with open(path) as f:
+            cp.read_file(f, source=path)
+    except (OSError, configparser.Error):
+        return None
+    if not cp.has_option(section, key):
+        return None
+    value = cp.get(section, key, raw=True)
+    if key in PATH_SETTINGS:
+        value = _absolute(value, os.path.dirname(os.path.abspath(path)))
+    return value
+
+
+def name(text):
+    "File name of the generated config, derived from its content"
+
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return "ansible-{}.cfg".format(digest[:32])
+
+
+def write(directory, text):
+    "Writes the config in the directory unless already there, returns the path"
+
+    path = os.path.join(directory, name(text))
+    if os.path.isfile(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    return utils.atomic_write(path, text)
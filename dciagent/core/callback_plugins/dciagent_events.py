@@ -0,0 +1,133 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import select
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+__metaclass__ = type
+
+DOCUMENTATION = """
+    name: dciagent_events
+    type: aggregate
+    short_description: JSON events for dci-agent-ctl
+    description:
+      - Writes one JSON object per line for every playbook, play and task
+        start, host result and the final stats of every host, to the file
+        descriptor given by the agent.
+      - Does nothing unless DCIAGENT_EVENTS_FD is set.
+    requirements:
+      - Enabled by dci-agent-ctl, nothing to configure
+"""
+
+ENV = "DCIAGENT_EVENTS_FD"
+# the shards of a run share the pipe, an event is written at once as long
+# as its line, once encoded, is no longer than PIPE_BUF
+MAX_LINE = getattr(select, "PIPE_BUF", 512)
+MAX_MSG = 1024
+
+
+def _encode(fields):
+    "The event's line, its longest strings cut until it fits in MAX_LINE"
+
+    while True:
+        data = json.dumps(fields, separators=(",", ":"), default=str) + "\n"
+        data = data.encode("utf-8")
+        if len(data) <= MAX_LINE:
+            return data
+        strings = [k for k, v in fields.items() if isinstance(v, str) and v]
+        if not strings:
+            return None
+        key = max(strings, key=lambda k: len(fields[k]))
+        fields[key] = fields[key][: len(fields[key]) // 2]
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "dciagent_events"
+    # loaded as soon as it is in the callback plugins path
+    CALLBACK_NEEDS_ENABLED = False
+    CALLBACK_NEEDS_WHITELIST = False
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self._fd = None
+        try:
+            self._fd = int(os.environ[ENV])
+            # not for the commands run on localhost, only the agent may
+            # keep the pipe open
+            os.set_inheritable(self._fd, False)
+        except (KeyError, ValueError, OSError):
+            self._fd = None
+
+    def _emit(self, event, **fields):
+        if self._fd is None:
+            return
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        data = _encode(fields)
+        if data is None:
+            return
+        try:
+            os.write(self._fd, data)
+        except OSError:
+            self._fd = None  # the agent is gone, keep the playbook going
+
+    def _result(self, event, result, **fields):
+        task = result._task
+        self._emit(
+            event,
+            task=task.get_name(),
+            id=task._uuid,
+            host=result._host.get_name(),
+            **fields,
+        )
+
+    def v2_playbook_on_start(self, playbook):
+        self._emit("playbook_start", playbook=playbook._file_name)
+
+    def v2_playbook_on_play_start(self, play):
+        self._emit("play_start", play=play.get_name())
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._emit("task_start", task=task.get_name(), id=task._uuid)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._emit("task_start", task=task.get_name(), id=task._uuid, handler=True)
+
+    def v2_runner_on_ok(self, result):
+        event = "changed" if result._result.get("changed", False) else "ok"
+        self._result(event, result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        msg = result._result.get("msg") or result._result.get("stderr") or ""
+        self._result("failed", result, msg=str(msg)[:MAX_MSG], ignored=ignore_errors)
+
+    def v2_runner_on_skipped(self, result):
+        self._result("skipped", result)
+
+    def v2_runner_on_unreachable(self, result):
+        msg = result._result.get("msg") or ""
+        self._result("unreachable", result, msg=str(msg)[:MAX_MSG])
+
+    def v2_playbook_on_stats(self, stats):
+        # one event per host, whatever the size of the inventory
+        for host in sorted(stats.processed):
+            self._emit("stats", host=host, summary=stats.summarize(host))
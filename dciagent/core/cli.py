@@ -30,17 +30,27 @@ other utilities from DCI:
 """
 
 import argparse
-import distutils.util as dutils
-import importlib
 import os
 import sys
 
-import dciagent
+import dciagent.core.registry as registry
+import dciagent.core.utils as utils
 
+# top-level options are handed over to the agent as the environment variables
+# its own arguments read their defaults from
+EXPORTS = (
+    ("config_dir", "DCI_CONFIG_DIR"),
+    ("auth_file", "DCI_AUTH_FILE"),
+    ("playbook", "ANSIBLE_PLAYBOOK"),
+    ("prefix", "DCI_PREFIX"),
+    ("inventory", "ANSIBLE_INVENTORY"),
+    ("hooks_dir", "DCI_HOOKS_DIR"),
+    ("verbosity", "VERBOSITY"),
+    ("skip_validation", "NO_VALIDATION"),
+)
 
-def main():
-    "dci-agent-ctl"
 
+def _parser(agents):
     ap = argparse.ArgumentParser(
         prog=main.__doc__,
         description=__doc__,
@@ -95,37 +105,41 @@ def main():
         action="store_true",
         help="UNSAFE: do not validate the parameters before calling the playbook"
         ". (env: $DCI_SKIP_VALIDATION)",
-        default=dutils.strtobool(os.getenv("DCI_SKIP_VALIDATION", "false")),
+        default=utils.strtobool(os.getenv("DCI_SKIP_VALIDATION", "false")),
     )
 
-    # sub-commands
-    sp = ap.add_subparsers(help="Agent to run")
-    subs = {}
-    for sub in ("dummy", "openshift"):
-        m = importlib.import_module("dciagent.agents.{}".format(sub))
-        subs[sub] = sp.add_parser(
-            sub,
-            help=m.Agent.__doc__,  # long help is the module docstring
-            description=m.__doc__,  # short usage is the class' docstring
-            formatter_class=argparse.RawDescriptionHelpFormatter,
-        )
-        m.Agent._setup_subparser(
-            subs[sub]
-        )  # setup the sub-command extra arguments (if any)
-        subs[sub].set_defaults(
-            Class=m.Agent
-        )  # sets the appropriate routing to the sub-command's class
-
-    # parse arguments and run
-    args = ap.parse_args()
-    try:
-        agent = args.Class(**vars(args))
-        sys.exit(agent.run())
+    # sub-commands, only the selected agent is imported and it parses the
+    # rest of the command line by itself (including --help)
+    sp = ap.add_subparsers(dest="agent", metavar="AGENT", help="Agent to run")
+    for name, entry in agents.items():
+        sp.add_parser(name, help=entry.help, add_help=False)
+
+    return ap
+
+
+def main(argv=None):
+    "dci-agent-ctl"
+
+    argv = sys.argv[1:] if argv is None else argv
+
+    # plugin agents are only looked up when no builtin one is named
+    discover = not any(arg in registry.AGENTS for arg in argv)
+    ap = _parser(registry.agents(discover=discover))
+    args, rest = ap.parse_known_args(argv)
+
     # should trigger when you don't pass a sub-command
-    except AttributeError as ae:
-        print(ae)
+    if args.agent is None:
         ap.print_help()
+        return 1
+
+    for dest, env in EXPORTS:
+        value = getattr(args, dest)
+        if value:
+            os.environ[env] = str(value)
+
+    agent = registry.load(args.agent)()
+    return agent.run(rest)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Thin client for dci-agentd.
+
+usage: dci-agent-client AGENT [ARGS...]
+
+Submits the job to the daemon along with the current directory and
+environment, prints its output as it comes and exits with its return code.
+This module must stay free of any heavy import, its start-up time is the
+whole point.
+"""
+
+import json
+import os
+import socket
+import sys
+
+
+def socket_path():
+    return os.getenv(
+        "DCI_AGENTD_SOCKET",
+        os.path.join(os.getenv("XDG_RUNTIME_DIR", "/tmp"), "dci-agentd.sock"),
+    )
+
+
+def submit(agent, argv, env=None, path=None, cwd=None):
+    """
+    Sends the job to the daemon and yields the messages it replies with, the
+    last one holds the return code
+    """
+
+    request = {"agent": agent, "argv": list(argv), "env": env, "cwd": cwd}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path or socket_path())
+        s.sendall(json.dumps(request).encode() + b"\n")
+        with s.makefile("rb") as f:
+            for line in f:
+                yield json.loads(line.decode())
+
+
+def main():
+    "dci-agent-client"
+
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print(__doc__.strip())
+        return 1
+
+    rc = 1
+    files = {"stdout": sys.stdout, "stderr": sys.stderr}
+    for message in submit(sys.argv[1], sys.argv[2:], dict(os.environ), cwd=os.getcwd()):
+        if "line" in message:
+            print(message["line"], file=files[message["stream"]], flush=True)
+        elif "queued" in message:
+            print(
+                "Queued, {} job(s) waiting".format(message["queued"]), file=sys.stderr
+            )
+        elif "rc" in message:
+            rc = message["rc"]
+            if message.get("error"):
+                print(message["error"], file=sys.stderr)
+
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,12 +12,58 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections.abc
 import contextlib
 import os
 
 
+class Environment(collections.abc.Mapping):
+    """
+    Immutable environment for a child process: the parent environment
+    (os.environ by default) with some variables overridden, or removed when
+    the new value is None. Nothing is copied until the mapping is iterated,
+    which subprocess does only when the child is spawned.
+    """
+
+    def __init__(self, parent=None, **overrides):
+        self._parent = os.environ if parent is None else parent
+        self._overrides = dict(overrides)
+
+    def __getitem__(self, key):
+        if key in self._overrides:
+            value = self._overrides[key]
+            if value is None:
+                raise KeyError(key)
+            return value
+        return self._parent[key]
+
+    def __iter__(self):
+        for key in self._parent:
+            if key not in self._overrides:
+                yield key
+        for key, value in self._overrides.items():
+            if value is not None:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "<Environment {!r}>".format(self._overrides)
+
+    def layer(self, **overrides):
+        "Returns a new environment with these overrides on top of this one"
+
+        return Environment(self, **overrides)
+
+
 @contextlib.contextmanager
 def env(**new):
+    """
+    Patches os.environ for the duration of the context. This affects the whole
+    process and is not thread safe, pass an Environment() to the child instead.
+    """
+
     # take a snapshot of the variables affected by the new context
     orig = {key: os.getenv(key) for key in new}
 
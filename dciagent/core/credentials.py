@@ -0,0 +1,175 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Reading of the DCI credentials from dcirc.sh files.
+
+The usual `export DCI_KEY=value` files are parsed natively, anything more
+complex is sourced with /bin/sh. Results are cached in memory by path and
+validated against the file's stat and content hash, optionally on disk too.
+"""
+
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+
+import dciagent.core.utils as utils
+
+PREFIX = "DCI_"
+
+_ASSIGNMENT = re.compile(r"^(export\s+)?([A-Za-z_][A-Za-z0-9_]*)=(.*)$")
+_EXPORT = re.compile(r"^export((?:\s+[A-Za-z_][A-Za-z0-9_]*)+)$")
+_UNQUOTED = re.compile(r"^[^\s$`\\\"';&|<>(){}#*?~]*$")
+_SINGLE_QUOTED = re.compile(r"^'([^']*)'$")
+_DOUBLE_QUOTED = re.compile(r'^"([^"$`\\]*)"$')
+
+# path -> (stat key, content digest, variables)
+_cache = {}
+# sha256 -> variables of the files the native parser could read
+_contents = {}
+_lock = threading.Lock()
+
+
+def _value(raw):
+    for regex in (_SINGLE_QUOTED, _DOUBLE_QUOTED):
+        m = regex.match(raw)
+        if m:
+            return m.group(1)
+    if _UNQUOTED.match(raw):
+        return raw
+    return None
+
+
+def parse(data):
+    """
+    Parses the text of a simple dcirc.sh file, returns None when the file uses
+    anything beyond plain (exported) assignments and comments
+    """
+
+    assigned = {}
+    exported = set()
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        m = _ASSIGNMENT.match(line)
+        if m:
+            value = _value(m.group(3))
+            if value is None:
+                return None
+            assigned[m.group(2)] = value
+            if m.group(1):
+                exported.add(m.group(2))
+            continue
+
+        m = _EXPORT.match(line)
+        if m:
+            exported.update(m.group(1).split())
+            continue
+
+        return None
+
+    return {k: v for k, v in assigned.items() if k in exported and k.startswith(PREFIX)}
+
+
+def source(path):
+    "Sources the file with /bin/sh in a clean environment and returns its variables"
+
+    pipe = subprocess.Popen(
+        [
+            "/bin/sh",
+            "-c",
+            '. "$0"; env',
+            os.path.abspath(path),
+        ],
+        stdout=subprocess.PIPE,
+        env={},  # start with a clean environment
+        universal_newlines=True,
+    )
+    data = pipe.communicate()[0]
+    env = {}
+    for line in data.splitlines():
+        if line.startswith(PREFIX):
+            k, v = line.split("=", 1)
+            env[k] = v
+
+    return env
+
+
+def _disk_path(cache_dir, path, digest):
+    name = hashlib.sha256("{}\0{}".format(path, digest).encode()).hexdigest()
+    return os.path.join(cache_dir, "{}.json".format(name))
+
+
+def _load_disk(cache_dir, path, digest):
+    try:
+        with open(_disk_path(cache_dir, path, digest)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_disk(cache_dir, path, digest, env):
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    # these are secrets, only the owner can read them
+    utils.atomic_write(_disk_path(cache_dir, path, digest), json.dumps(env))
+
+
+def read(path, cache_dir=None):
+    """
+    Returns the DCI variables defined in the given dcirc.sh file. The file is
+    only parsed again when its stat and content hash changed, with a cache_dir
+    the result is also kept on disk for other processes.
+    """
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    with _lock:
+        hit = _cache.get(path)
+    if hit is not None and hit[0] == key:
+        return dict(hit[2])
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    if hit is not None and hit[1] == digest:
+        env = hit[2]  # touched but not modified
+    else:
+        env = None
+        if cache_dir is not None:
+            env = _load_disk(cache_dir, path, digest)
+        if env is None:
+            # identical files e.g. of several labs are only parsed once
+            with _lock:
+                env = _contents.get(digest)
+        if env is None:
+            env = parse(data.decode("utf-8", errors="replace"))
+            if env is not None:
+                with _lock:
+                    _contents[digest] = env
+            else:
+                env = source(path)  # may depend on the path, not shared
+            if cache_dir is not None:
+                _store_disk(cache_dir, path, digest, env)
+
+    with _lock:
+        _cache[path] = (key, digest, env)
+
+    return dict(env)
@@ -0,0 +1,291 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Resident agent daemon.
+
+Keeps the agent classes loaded and runs the jobs submitted over a Unix
+domain socket, streaming their output back to the client. Every request is
+one JSON line:
+
+    {"agent": "dummy", "argv": ["--dry-run"], "env": {...}, "cwd": "/home/dci"}
+
+where agent is a registered agent name or a "module:Class" spec. The replies
+are JSON lines too, {"stream": "stdout", "line": "..."} for every line of
+output and a final {"rc": 0} (with an "error" key if the job failed to run).
+
+The job runs in the client's working directory and environment, so relative
+paths and the executable are found as if the agent was run directly.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+
+import dciagent.core.client as client
+import dciagent.core.context as ctx
+import dciagent.core.registry as registry
+
+
+def _current_task():
+    try:
+        return asyncio.current_task()
+    except AttributeError:  # python < 3.7
+        return asyncio.Task.current_task()
+    except RuntimeError:  # not called from the event loop's thread
+        return None
+
+
+class _Dispatch(object):
+    """
+    Replacement for sys.stdout/sys.stderr sending what the jobs print (usage,
+    dry-run output, hooks) to their own client instead of the daemon's output
+    """
+
+    def __init__(self, fallback, stream):
+        self.fallback = fallback
+        self.stream = stream
+        self.outputs = {}
+
+    def write(self, text):
+        # the job's task, or the executor thread running one of its hooks
+        output = self.outputs.get(_current_task())
+        if output is None:
+            output = self.outputs.get(threading.get_ident())
+        if output is None:
+            return self.fallback.write(text)
+        return output.text(self.stream, text)
+
+    def flush(self):
+        self.fallback.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.fallback, name)
+
+
+class _Output(object):
+    """
+    Sends a job's output to its client, used as sink and for the printed
+    text, from the event loop or the executor's threads
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.pending = {"stdout": "", "stderr": ""}
+        self.closed = False
+        self._loop = asyncio.get_event_loop()
+        self._thread = threading.get_ident()
+
+    def _write(self, data):
+        if not self.closed:
+            self.writer.write(data)
+
+    def send(self, **message):
+        data = json.dumps(message).encode() + b"\n"
+        if threading.get_ident() == self._thread:
+            self._write(data)
+        else:
+            self._loop.call_soon_threadsafe(self._write, data)
+
+    async def drain(self):
+        "Waits for the client to catch up, the output doesn't pile up"
+
+        if self.closed:
+            return
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            self.closed = True  # gone, the rest of the output is dropped
+
+    def write(self, stream, line):
+        self.send(stream=stream, line=line)
+
+    def text(self, stream, text):
+        "Pieces of text written to sys.stdout/sys.stderr e.g. by print()"
+
+        lines = (self.pending[stream] + text).split("\n")
+        self.pending[stream] = lines.pop()
+        for line in lines:
+            self.send(stream=stream, line=line)
+        return len(text)
+
+    def flush(self):
+        for stream, text in self.pending.items():
+            if text:
+                self.send(stream=stream, line=text)
+                self.pending[stream] = ""
+
+    def close(self):
+        pass
+
+
+class _Executor(concurrent.futures.Executor):
+    "Runs the blocking hooks of a job, what they print goes to its client"
+
+    def __init__(self, pool, output, dispatches):
+        self.pool = pool
+        self.output = output
+        self.dispatches = dispatches
+
+    def _call(self, fn, args, kwargs):
+        ident = threading.get_ident()
+        for dispatch in self.dispatches:
+            dispatch.outputs[ident] = self.output
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            for dispatch in self.dispatches:
+                dispatch.outputs.pop(ident, None)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.pool.submit(self._call, fn, args, kwargs)
+
+
+class Daemon(object):
+    def __init__(self, path, jobs=None, queue_size=0):
+        self.path = path
+        self.jobs = jobs or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.running = 0
+        self.waiting = 0
+        self.slots = None
+        self.pool = None
+        self.stdout = self.stderr = None
+
+    def _agent(self, name):
+        if name in registry.AGENTS or ":" not in name:
+            return registry.load(name)
+        return registry.load_agent(name)
+
+    async def _run(self, request, output):
+        agent = self._agent(request["agent"])()
+        if request.get("env") is not None:
+            agent.parent_environment = ctx.Environment(request["env"])
+        agent.cwd = request.get("cwd")
+        agent.sinks = [output]
+        agent.executor = _Executor(self.pool, output, (self.stdout, self.stderr))
+        return await agent.run_async(request.get("argv", []))
+
+    async def handle(self, reader, writer):
+        output = _Output(writer)
+        task = _current_task()
+        try:
+            request = json.loads((await reader.readline()).decode())
+
+            if self.queue_size and self.waiting >= self.queue_size:
+                output.send(rc=1, error="Queue is full, try again later")
+                return
+
+            self.waiting += 1
+            try:
+                if self.running >= self.jobs:
+                    output.send(queued=self.waiting)
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+
+            self.running += 1
+            self.stdout.outputs[task] = self.stderr.outputs[task] = output
+            try:
+                rc = await self._run(request, output)
+                output.flush()
+                output.send(rc=rc)
+            finally:
+                self.stdout.outputs.pop(task, None)
+                self.stderr.outputs.pop(task, None)
+                self.running -= 1
+                self.slots.release()
+        except SystemExit as se:
+            # argparse exits on --help and on invalid arguments
+            output.flush()
+            output.send(rc=se.code if isinstance(se.code, int) else 1)
+        except Exception as e:
+            output.flush()
+            output.send(rc=1, error="{}: {}".format(type(e).__name__, e))
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def serve(self):
+        self.slots = asyncio.Semaphore(self.jobs)
+        # the hooks of all the running jobs, some may block for a while
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs)
+        self.stdout = sys.stdout = _Dispatch(sys.stdout, "stdout")
+        self.stderr = sys.stderr = _Dispatch(sys.stderr, "stderr")
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        try:
+            while True:
+                await asyncio.sleep(3600)
+        finally:
+            sys.stdout = self.stdout.fallback
+            sys.stderr = self.stderr.fallback
+            server.close()
+            os.unlink(self.path)
+            self.pool.shutdown(wait=False)
+
+
+def main():
+    "dci-agentd"
+
+    ap = argparse.ArgumentParser(
+        prog=main.__doc__,
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument(
+        "-s",
+        "--socket",
+        help="path to the Unix socket. (env: $DCI_AGENTD_SOCKET)",
+        default=client.socket_path(),
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="maximum number of jobs to run at the same time"
+        ". (env: $DCI_AGENTD_JOBS, default: number of CPUs)",
+        default=os.getenv("DCI_AGENTD_JOBS"),
+    )
+    ap.add_argument(
+        "-q",
+        "--queue-size",
+        type=int,
+        help="maximum number of jobs waiting for a slot, 0 for no limit"
+        ". (env: $DCI_AGENTD_QUEUE_SIZE)",
+        default=os.getenv("DCI_AGENTD_QUEUE_SIZE", 0),
+    )
+    args = ap.parse_args()
+
+    daemon = Daemon(args.socket, args.jobs and int(args.jobs), int(args.queue_size))
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(daemon.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
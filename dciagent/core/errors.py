@@ -26,3 +26,9 @@ class ArgumentError(Exception):
     "Raised when the defined argument is invalid"
 
     pass
+
+
+class UploadError(Exception):
+    "Raised when an artifact could not be uploaded"
+
+    pass
@@ -0,0 +1,121 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Events of a running playbook, as sent by the bundled callback plugin.
+
+The agent creates a pipe and hands its write end over to ansible-playbook
+(its number is in $DCIAGENT_EVENTS_FD), the dciagent_events callback plugin
+writes one compact JSON object per line to it:
+
+    {"event":"task_start","task":"Deploy","id":"...","time":1633082400.0}
+    {"event":"failed","task":"Deploy","host":"host1","msg":"...","ignored":false}
+
+The events are playbook_start, play_start, task_start, ok, changed, failed,
+skipped, unreachable and stats (one per host). The long strings are cut so
+that every line fits in PIPE_BUF, the events of shards sharing the pipe never
+mix. The agent reads them back from a thread as they come.
+"""
+
+import json
+import os
+import threading
+
+ENV = "DCIAGENT_EVENTS_FD"
+# written by the agent itself, tells when the events before it were read
+_SYNC = "dciagent_sync"
+PLUGIN_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "callback_plugins"
+)
+
+
+def read(f):
+    "Iterates over the events read from the binary file, until its end"
+
+    for line in f:
+        try:
+            event = json.loads(line.decode("utf-8", errors="replace"))
+        except ValueError:
+            continue  # cut short, e.g. the writer was killed
+        if isinstance(event, dict):
+            yield event
+
+
+class Pipe(object):
+    """
+    Pipe the events come through, the write end goes to the children with
+    pass_fds. on_event is called from a thread with every event.
+    """
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.count = 0
+        # not inherited by the other children of the process (PEP 446)
+        self._read, self.fd = os.pipe()
+        self._thread = None
+        self._synced = 0
+        self._cond = threading.Condition()
+
+    def environment(self):
+        return {ENV: str(self.fd)}
+
+    def _loop(self):
+        with os.fdopen(self._read, "rb") as f:
+            for event in read(f):
+                if event.get("event") == _SYNC:
+                    with self._cond:
+                        self._synced = event["n"]
+                        self._cond.notify_all()
+                    continue
+                self.count += 1
+                if self.on_event is not None:
+                    self.on_event(event)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def sync(self, timeout=5.0):
+        """
+        Waits until the events written so far went through on_event e.g.
+        once a child is gone. Returns False on timeout.
+        """
+
+        if self.fd is None or self._thread is None:
+            return False
+        with self._cond:
+            n = self._synced + 1
+        # not holding the lock, the reader may need it to empty a full pipe,
+        # on a line of its own even after a line cut short
+        marker = json.dumps({"event": _SYNC, "n": n}).encode()
+        os.write(self.fd, b"\n" + marker + b"\n")
+        with self._cond:
+            return self._cond.wait_for(lambda: self._synced >= n, timeout)
+
+    def close(self, timeout=5.0):
+        """
+        Closes our write end and waits for the events still in the pipe, the
+        reader stops once every child is gone
+        """
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self._thread is not None:
+            # a daemon left behind may keep the pipe open, don't wait forever
+            self._thread.join(timeout)
+            self._thread = None
+        elif self._read is not None:  # never started
+            os.close(self._read)
+        self._read = None
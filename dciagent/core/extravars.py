@@ -0,0 +1,133 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Extra variables merged in a single vars file.
+
+The key=value entries, inline JSON and @files given to ansible are merged in
+order, the later ones replacing the top-level keys of the earlier ones like
+ansible does, and written once in a JSON file named after its content so
+identical sets of variables share the file. The entries that can't be read
+here (e.g. @files with vault tags) are kept as they are, in their place so
+the precedence doesn't change.
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import threading
+
+import yaml
+
+import dciagent.core.utils as utils
+
+_ERRORS = (OSError, ValueError, yaml.YAMLError)
+
+# path -> (stat key, variables) of the @files already read
+_files = {}
+_lock = threading.Lock()
+
+
+def _key_value(entry):
+    "Variables of a key=value [key=value ...] entry, None if it isn't one"
+
+    if any(c in entry for c in " \t'\"\\"):
+        try:
+            tokens = shlex.split(entry)
+        except ValueError:
+            return None
+    else:  # the usual name=value, no need for shlex
+        tokens = [entry]
+    if not tokens or not all("=" in t and not t.startswith("=") for t in tokens):
+        return None
+    return dict(t.split("=", 1) for t in tokens)
+
+
+def _load(data):
+    return yaml.safe_load(data)
+
+
+def _file(path):
+    "Variables of an @file, cached until the file changes"
+
+    st = os.stat(path)
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        hit = _files.get(path)
+    if hit is not None and hit[0] == key:
+        return hit[1]
+
+    with open(path) as f:
+        variables = _load(f.read()) or {}
+    with _lock:
+        _files[path] = (key, variables)
+    return variables
+
+
+def _variables(entry):
+    "The variables of the entry, None when it must be given to ansible as is"
+
+    try:
+        if entry.startswith("@"):
+            variables = _file(entry[1:])
+        elif entry.lstrip().startswith(("{", "[")):
+            variables = _load(entry)
+        else:
+            variables = _key_value(entry)
+    except _ERRORS:
+        return None
+    return variables if isinstance(variables, dict) else None
+
+
+def merge(entries):
+    """
+    Merges the extra vars entries, returns a list of dicts (merged
+    variables) and strings (entries kept as they are), in order
+    """
+
+    if isinstance(entries, str):
+        entries = [entries]
+
+    merged = []
+    for entry in entries:
+        variables = _variables(entry)
+        if variables is None:
+            merged.append(entry)
+        elif merged and isinstance(merged[-1], dict):
+            merged[-1].update(variables)
+        else:
+            merged.append(dict(variables))
+    return merged
+
+
+def dump(variables):
+    "The JSON document and its file name, derived from the content"
+
+    # YAML dates are passed as strings
+    data = json.dumps(variables, sort_keys=True, separators=(",", ":"), default=str)
+    digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+    return data, "extra-vars-{}.json".format(digest[:32])
+
+
+def write(directory, variables):
+    "Writes the variables in the directory unless already there, returns the path"
+
+    data, name = dump(variables)
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    # the variables may hold secrets
+    return utils.atomic_write(path, data)
@@ -0,0 +1,145 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Persistent ansible fact cache shared by the runs against the same lab.
+
+Each lab (configuration directory and prefix) gets its own jsonfile cache
+directory under a common root. A run holds the lab's lock while it uses
+the cache, the expired facts are removed and the oldest ones evicted when
+the root grows past its size limit.
+"""
+
+import fcntl
+import hashlib
+import os
+import time
+
+
+def default_root():
+    cache = os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "dciagent", "facts")
+
+
+def lab_key(config_dir, prefix=""):
+    "Name of the lab's cache directory"
+
+    lab = "{}\0{}".format(os.path.realpath(config_dir or "."), prefix or "")
+    return hashlib.sha256(lab.encode("utf-8")).hexdigest()[:16]
+
+
+class FactCache(object):
+    """
+    The lab's cache, facts live `ttl` seconds and the whole root is kept
+    under `max_bytes`
+    """
+
+    def __init__(self, root, key, ttl=3600, max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.path = os.path.join(root, key)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = None
+
+    def environment(self, gathering=True):
+        """
+        The variables enabling the cache for ansible-playbook, gathering
+        switches to smart unless the user chose how facts are gathered
+        """
+
+        env = {
+            "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+            "ANSIBLE_CACHE_PLUGIN_CONNECTION": self.path,
+            "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(int(self.ttl)),
+        }
+        if gathering:
+            # only gather the facts not in the cache
+            env["ANSIBLE_GATHERING"] = "smart"
+        return env
+
+    def acquire(self):
+        """
+        Takes the lab's lock without waiting, returns False if another run
+        is using the cache
+        """
+
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock = fd
+        return True
+
+    def release(self):
+        if self._lock is not None:
+            os.close(self._lock)
+            self._lock = None
+
+    def prune(self, now=None):
+        """
+        Removes the expired facts of every lab, then the oldest ones until
+        the root fits in max_bytes, skipping the labs in use. Returns the
+        number of files removed.
+        """
+
+        entries = []
+        try:
+            labs = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+
+        for lab in labs:
+            path = os.path.join(self.root, lab)
+            if lab.endswith(".lock") or not os.path.isdir(path):
+                continue
+            if path != self.path and not _free(path):
+                continue
+            for name in os.listdir(path):
+                try:
+                    st = os.stat(os.path.join(path, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(path, name)))
+
+        removed = 0
+        total = sum(size for _, size, _ in entries)
+        deadline = (now if now is not None else time.time()) - self.ttl
+        for mtime, size, path in sorted(entries):
+            if mtime > deadline and total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+def _free(path):
+    "Whether no run holds the lab's lock"
+
+    try:
+        fd = os.open(path + ".lock", os.O_RDWR)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+    finally:
+        os.close(fd)
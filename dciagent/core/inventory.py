@@ -0,0 +1,187 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Minimal reader of static ansible inventories, INI or YAML.
+
+Only resolves the host names and the groups they belong to, variables are
+ignored. Dynamic inventories (scripts, plugins) are not supported.
+"""
+
+import collections
+import fnmatch
+import re
+
+import yaml
+
+_RANGE = re.compile(r"\[([0-9]+):([0-9]+)\]")
+
+
+def _expand(pattern):
+    "Expands the numeric host ranges e.g. node[01:03]"
+
+    m = _RANGE.search(pattern)
+    if m is None:
+        return [pattern]
+
+    start, end = m.group(1), m.group(2)
+    width = len(start) if start.startswith("0") else 0
+    hosts = []
+    for i in range(int(start), int(end) + 1):
+        prefix = pattern[: m.start()] + str(i).zfill(width)
+        hosts.extend(_expand(prefix + pattern[m.end() :]))
+    return hosts
+
+
+def _add(hosts, host, group):
+    groups = hosts.setdefault(host, [])
+    if group not in groups:
+        groups.append(group)
+
+
+def _parse_ini(text):
+    hosts = collections.OrderedDict()
+    children = collections.defaultdict(list)
+    group, kind = "ungrouped", "hosts"
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ";")):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            group, _, kind = line[1:-1].partition(":")
+            kind = kind or "hosts"
+            continue
+        name = line.split()[0]
+        if kind == "hosts":
+            for host in _expand(name):
+                _add(hosts, host, group)
+        elif kind == "children":
+            children[group].append(name)
+
+    # hosts of a child group are members of its parents too
+    changed = True
+    while changed:
+        changed = False
+        for parent, subgroups in children.items():
+            for groups in hosts.values():
+                if parent not in groups and any(g in groups for g in subgroups):
+                    groups.append(parent)
+                    changed = True
+
+    return hosts
+
+
+def _walk_yaml(hosts, group, data):
+    if not isinstance(data, dict):
+        return
+    for host in data.get("hosts") or {}:
+        for name in _expand(str(host)):
+            _add(hosts, name, group)
+    for child, sub in (data.get("children") or {}).items():
+        _walk_yaml(hosts, child, sub)
+        for groups in hosts.values():
+            if child in groups and group not in groups:
+                groups.append(group)
+
+
+class Loader(yaml.SafeLoader):
+    "Safe YAML loader also reading ansible's tags e.g. !vault or !unsafe"
+
+
+def _tagged(loader, suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node)
+    return loader.construct_mapping(node)
+
+
+Loader.add_multi_constructor("!", _tagged)
+
+
+def _parse_yaml(text):
+    data = yaml.load(text, Loader=Loader)
+    if not isinstance(data, dict):
+        raise ValueError("a YAML inventory must be a mapping of groups")
+
+    hosts = collections.OrderedDict()
+    for group, sub in data.items():
+        _walk_yaml(hosts, group, sub)
+    return hosts
+
+
+def parse(text):
+    """
+    Returns the host -> groups mapping of an inventory, the format is guessed
+    from the content
+    """
+
+    first = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith(("#", ";")):
+            first = line
+            break
+
+    if first == "---" or (first.endswith(":") and not first.startswith("[")):
+        return _parse_yaml(text)
+    return _parse_ini(text)
+
+
+def _matching(hosts, item):
+    if item.startswith("@"):
+        with open(item[1:]) as f:
+            names = set(line.strip() for line in f)
+        return set(h for h in hosts if h in names)
+
+    if item.startswith("~"):
+        match = re.compile(item[1:]).match
+    else:
+        match = lambda name: fnmatch.fnmatchcase(name, item)  # noqa: E731
+
+    return set(
+        h
+        for h, groups in hosts.items()
+        if item == "all" or match(h) or any(match(g) for g in groups)
+    )
+
+
+def select(hosts, pattern):
+    """
+    Returns the hosts of the mapping matching an ansible host pattern e.g.
+    web:&prod:!db01, in inventory order
+    """
+
+    include, intersect, exclude = set(), [], set()
+    for item in re.split(r"[:,]", pattern):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith("!"):
+            exclude |= _matching(hosts, item[1:])
+        elif item.startswith("&"):
+            intersect.append(_matching(hosts, item[1:]))
+        else:
+            include |= _matching(hosts, item)
+
+    for subset in intersect:
+        include &= subset
+    return [h for h in hosts if h in include and h not in exclude]
+
+
+def hosts(path):
+    "Reads the inventory file and returns its host -> groups mapping"
+
+    with open(path) as f:
+        return parse(f.read())
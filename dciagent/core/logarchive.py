@@ -0,0 +1,225 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Compressed archive of the ansible logs.
+
+The lines are compressed as they come in a series of independent gzip
+members (zstd frames for .zst files), the whole file is still a valid .gz
+or .zst file. A new member is started at a task boundary once the current
+one is big enough, and the index kept next to the archive (archive + .idx,
+JSON lines) records where each task starts, so a task can be read without
+decompressing everything before it. Consecutive repeated lines are stored
+once, followed by a "repeated N times" line.
+
+    dci-agent-log ansible.log.gz --list
+    dci-agent-log ansible.log.gz --task "Gathering Facts"
+"""
+
+import argparse
+import gzip
+import io
+import json
+import re
+import sys
+import zlib
+
+import dciagent.core.stream as stream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# start a new member at the next task once this much was compressed
+BLOCK_SIZE = 1024 * 1024
+_TASK = re.compile(r"\b(?:TASK|PLAY|RUNNING HANDLER) \[(.*)\]")
+_REPEATED = "--- last line repeated {} times ---"
+
+
+class _Gzip(object):
+    def __init__(self, level):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _Zstd(object):
+    def __init__(self, level):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush()
+
+
+def codec(path):
+    "The compressor used for the archive, zstd for .zst files and gzip otherwise"
+
+    if not path.endswith(".zst"):
+        return _Gzip
+    if zstandard is None:
+        raise ValueError(
+            "The zstandard module is needed for {}, use a .gz file".format(path)
+        )
+    return _Zstd
+
+
+class Writer(stream.Sink):
+    """
+    Compresses the lines in the archive at path, usable as an output sink or
+    fed directly through line()
+    """
+
+    def __init__(self, path, level=6, block_size=BLOCK_SIZE, dedup=True):
+        self.path = path
+        self.level = level
+        self.block_size = block_size
+        self.dedup = dedup
+        self._codec = codec(path)
+        self._f = open(path, "wb")
+        self._index = open(path + ".idx", "w")
+        self._c = None
+        self._member_offset = 0
+        self._member_size = 0
+        self._member_line = 0
+        self._lines = 0
+        self._last = None
+        self._repeats = 0
+
+    def _start(self):
+        "Ends the current member, the next lines go into a new one"
+
+        if self._c is not None:
+            self._f.write(self._c.flush())
+        self._c = self._codec(self.level)
+        self._member_offset = self._f.tell()
+        self._member_size = 0
+        self._member_line = self._lines
+
+    def _put(self, line):
+        m = _TASK.search(line)
+        if self._c is None or (m and self._member_size >= self.block_size):
+            self._start()
+        if m:
+            entry = {
+                "task": m.group(1),
+                "line": self._lines,
+                "offset": self._member_offset,
+                "first_line": self._member_line,
+            }
+            self._index.write(json.dumps(entry) + "\n")
+
+        data = (line + "\n").encode("utf-8")
+        self._member_size += len(data)
+        self._f.write(self._c.compress(data))
+        self._lines += 1
+
+    def _flush_repeats(self):
+        if self._repeats > 0:
+            self._put(_REPEATED.format(self._repeats))
+            self._repeats = 0
+
+    def line(self, line):
+        if self.dedup and line == self._last:
+            self._repeats += 1
+            return
+        self._flush_repeats()
+        self._last = line
+        self._put(line)
+
+    def write(self, stream, line):
+        self.line(line)
+
+    def close(self):
+        if self._f.closed:
+            return
+        self._flush_repeats()
+        if self._c is not None:
+            self._f.write(self._c.flush())
+        self._f.close()
+        self._index.close()
+
+
+def index(path):
+    "The task boundaries recorded for the archive"
+
+    with open(path + ".idx") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _reader(f, path):
+    if codec(path) is _Zstd:
+        raw = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        return io.TextIOWrapper(io.BufferedReader(raw), encoding="utf-8")
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=f), encoding="utf-8")
+
+
+def read(path, task=None):
+    """
+    Iterates over the lines of the archive, from the first occurrence of the
+    task if given, only decompressing from the member it starts in
+    """
+
+    skip, offset = 0, 0
+    if task is not None:
+        for entry in index(path):
+            if entry["task"] == task:
+                skip, offset = entry["line"] - entry["first_line"], entry["offset"]
+                break
+        else:
+            raise KeyError(task)
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for i, line in enumerate(_reader(f, path)):
+            if i >= skip:
+                yield line.rstrip("\n")
+
+
+def main():
+    "dci-agent-log"
+
+    ap = argparse.ArgumentParser(
+        prog=main.__doc__,
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument("-l", "--list", action="store_true", help="list the tasks")
+    ap.add_argument("-t", "--task", help="print the log from this task on")
+    ap.add_argument("archive", help="compressed log, .gz or .zst")
+    args = ap.parse_args()
+
+    try:
+        if args.list:
+            for entry in index(args.archive):
+                print("{:>10} {}".format(entry["line"], entry["task"]))
+        else:
+            for line in read(args.archive, args.task):
+                print(line)
+    except KeyError:
+        print("No task {} in {}".format(args.task, args.archive), file=sys.stderr)
+        return 1
+    except BrokenPipeError:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
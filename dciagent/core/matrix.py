@@ -0,0 +1,156 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Run an agent against many labs of the same configuration directory.
+
+The directory is listed once and every prefix with a complete set of files
+(e.g. lab1-dcirc.sh, lab1-hosts and lab1-settings.yml) is a lab. The
+selected labs run at the same time in one process, so the validation of
+identical files and the reading of identical credentials are shared, and a
+summary per lab is printed at the end.
+
+    dci-agent-matrix -C /etc/dci-openshift-agent -p 'lab*' \\
+        dciagent.agents.openshift:Agent -- --dry-run
+"""
+
+import argparse
+import collections
+import fnmatch
+import os
+import sys
+
+import dciagent.core.registry as registry
+import dciagent.core.runner as runner
+
+
+def _defaults(agent_cls):
+    "The auto-discovered file names, without prefix"
+
+    names = (
+        agent_cls.default_auth_file,
+        agent_cls.default_inventory,
+        agent_cls.default_settings_file,
+    )
+    return [name for name in names if name is not None]
+
+
+def scan(config_dir, agent_cls):
+    """
+    The labs of the configuration directory, an ordered mapping of prefix to
+    the list of its files
+    """
+
+    defaults = _defaults(agent_cls)
+    if not defaults:
+        return collections.OrderedDict()
+
+    names = set()
+    for entry in os.scandir(config_dir):
+        if entry.is_file():
+            names.add(entry.name)
+
+    labs = collections.OrderedDict()
+    first = defaults[0]
+    for name in sorted(names):
+        if not name.endswith(first):
+            continue
+        prefix = name[: -len(first)]
+        files = ["{}{}".format(prefix, default) for default in defaults]
+        if all(f in names for f in files):
+            labs[prefix] = [os.path.join(config_dir, f) for f in files]
+    return labs
+
+
+def select(prefixes, patterns=None):
+    "The prefixes matching any of the shell patterns, all without patterns"
+
+    if not patterns:
+        return list(prefixes)
+    return [p for p in prefixes if any(fnmatch.fnmatchcase(p, pat) for pat in patterns)]
+
+
+def jobs(agent, config_dir, prefixes, argv=None):
+    "One job per prefix, its output prefixed with the lab's name"
+
+    return [
+        runner.Job(
+            agent,
+            ["-C", config_dir, "--prefix", prefix] + list(argv or []),
+            name=prefix or "(no prefix)",
+            prefix_output=True,
+        )
+        for prefix in prefixes
+    ]
+
+
+def main():
+    "dci-agent-matrix"
+
+    ap = argparse.ArgumentParser(
+        prog=main.__doc__,
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument(
+        "-C",
+        "--config-dir",
+        help="configuration directory holding the labs"
+        ". (env: $DCI_CONFIG_DIR, default: the agent's)",
+        default=os.getenv("DCI_CONFIG_DIR"),
+    )
+    ap.add_argument(
+        "-p",
+        "--pattern",
+        action="append",
+        help="only run the prefixes matching this shell pattern, can be repeated",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="maximum number of labs to run at the same time"
+        ". (env: $DCI_BATCH_JOBS, default: number of CPUs)",
+        default=os.getenv("DCI_BATCH_JOBS"),
+    )
+    ap.add_argument("-l", "--list", action="store_true", help="list the labs and exit")
+    ap.add_argument("agent", help="agent class, module:Class")
+    ap.add_argument("argv", nargs=argparse.REMAINDER, help="agent arguments")
+    args = ap.parse_args()
+
+    agent_cls = registry.load_agent(args.agent)
+    config_dir = args.config_dir or getattr(agent_cls, "default_config_dir", None)
+    if config_dir is None:
+        ap.error("no configuration directory, use -C")
+
+    labs = scan(config_dir, agent_cls)
+    prefixes = select(labs, args.pattern)
+    if args.list:
+        for prefix in prefixes:
+            print("{:<20} {}".format(prefix, " ".join(labs[prefix])))
+        return 0
+    if not prefixes:
+        print("No lab found in {}".format(config_dir), file=sys.stderr)
+        return 1
+
+    argv = args.argv[1:] if args.argv[:1] == ["--"] else args.argv
+    results = runner.run(
+        jobs(args.agent, config_dir, prefixes, argv),
+        workers=args.jobs and int(args.jobs),
+    )
+    runner.summary(results)
+    return runner.returncode(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Registry of the agents reachable from dci-agent-ctl.
+
+The builtin agents are listed in a static manifest along with their short
+help, so the command line can be built without importing any of them. Other
+packages can add agents through the "dciagent.agents" entry points group,
+which is only scanned when a name is not in the manifest.
+"""
+
+import collections
+import importlib
+
+ENTRY_POINTS_GROUP = "dciagent.agents"
+
+Entry = collections.namedtuple("Entry", ["spec", "help"])
+
+AGENTS = collections.OrderedDict(
+    [
+        ("dummy", Entry("dciagent.agents.dummy:Agent", "Just a dummy test agent")),
+        (
+            "openshift",
+            Entry("dciagent.agents.openshift:Agent", "DCI agent for OpenShift"),
+        ),
+    ]
+)
+
+
+_classes = {}
+
+
+def load_agent(spec):
+    """
+    Returns the agent class for the given spec, either the class itself or a
+    "module:Class" string. Modules are imported only once per process.
+    """
+
+    if not isinstance(spec, str):
+        return spec
+
+    if spec not in _classes:
+        module, _, name = spec.partition(":")
+        m = importlib.import_module(module)
+        _classes[spec] = getattr(m, name or "Agent")
+
+    return _classes[spec]
+
+
+def _entry_points():
+    try:
+        import importlib.metadata as metadata
+    except ModuleNotFoundError:
+        import importlib_metadata as metadata
+
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=ENTRY_POINTS_GROUP)
+    return eps.get(ENTRY_POINTS_GROUP, [])
+
+
+def agents(discover=False):
+    """
+    Returns the name -> Entry mapping of the known agents, only looks at the
+    installed entry points when asked to
+    """
+
+    found = collections.OrderedDict(AGENTS)
+    if discover:
+        for ep in _entry_points():
+            found.setdefault(ep.name, Entry(ep.value, "(plugin) {}".format(ep.value)))
+    return found
+
+
+def load(name):
+    "Imports and returns the agent class registered under the given name"
+
+    entry = AGENTS.get(name)
+    if entry is None:
+        entry = agents(discover=True).get(name)
+    if entry is None:
+        raise KeyError("Unknown agent: {}".format(name))
+
+    return load_agent(entry.spec)
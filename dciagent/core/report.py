@@ -0,0 +1,125 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Machine-readable record of an agent run.
+
+Records are appended as JSON lines, one per run, so the reports of many runs
+can share a file and be aggregated without parsing any log.
+"""
+
+import fcntl
+import json
+import os
+
+# environment variables whose name contains one of these are never shown
+SECRETS = ("password", "secret", "token", "api_key")
+REDACTED = "<redacted>"
+
+
+def redact(environment):
+    "A copy of the environment without the values of the secret variables"
+
+    return {
+        k: REDACTED if any(s in k.lower() for s in SECRETS) else v
+        for k, v in environment.items()
+    }
+
+
+class Result(object):
+    "What happened during one run, as returned by the agent's result attribute"
+
+    def __init__(
+        self,
+        agent,
+        rc,
+        error=None,
+        timings=None,
+        command_line=None,
+        environment=None,
+        artifacts=None,
+        tail=None,
+        started=None,
+        attempts=1,
+        expired=None,
+    ):
+        self.agent = agent
+        self.rc = rc
+        self.error = error
+        self.timings = timings or {}
+        self.command_line = list(command_line or [])
+        self.environment = redact(environment or {})
+        self.artifacts = dict(artifacts or {})
+        self.tail = list(tail or [])
+        self.started = started
+        self.attempts = attempts
+        self.expired = expired
+
+    @property
+    def ok(self):
+        return self.error is None and self.rc == 0
+
+    def to_dict(self):
+        return {
+            "agent": self.agent,
+            "started": self.started,
+            "rc": self.rc,
+            "error": self.error,
+            "attempts": self.attempts,
+            "expired": self.expired,
+            "timings": self.timings,
+            "command_line": self.command_line,
+            "environment": self.environment,
+            "artifacts": self.artifacts,
+            "tail": self.tail,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["agent"],
+            data["rc"],
+            error=data.get("error"),
+            timings=data.get("timings"),
+            command_line=data.get("command_line"),
+            environment=data.get("environment"),
+            artifacts=data.get("artifacts"),
+            tail=data.get("tail"),
+            started=data.get("started"),
+            attempts=data.get("attempts", 1),
+            expired=data.get("expired"),
+        )
+
+
+def append(path, result):
+    """
+    Appends the result to the file as one JSON line, the file is locked so
+    concurrent runs can share it
+    """
+
+    line = json.dumps(result.to_dict(), separators=(",", ":")) + "\n"
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+def load(path):
+    "Iterates over the results recorded in the file"
+
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield Result.from_dict(json.loads(line))
@@ -0,0 +1,61 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+When and how soon a failed run is attempted again.
+"""
+
+import re
+
+
+def parse_codes(text):
+    "Return codes from a comma separated list e.g. 2,4"
+
+    if not text:
+        return frozenset()
+    return frozenset(int(code) for code in text.split(",") if code.strip())
+
+
+class Policy(object):
+    """
+    Retries up to `retries` times the runs that failed with one of the codes
+    (any failure when empty) and whose output matches the pattern (if any),
+    waiting `delay` seconds the first time, then `factor` times longer every
+    attempt, up to `max_delay`
+    """
+
+    def __init__(
+        self, retries=0, delay=0.0, factor=2.0, max_delay=600.0, codes=(), pattern=None
+    ):
+        self.retries = retries
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.codes = frozenset(codes)
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def retryable(self, attempt, rc, lines=()):
+        "Whether the given attempt (from 1) is worth another one"
+
+        if rc == 0 or attempt > self.retries:
+            return False
+        if self.codes and rc not in self.codes:
+            return False
+        if self.pattern is not None:
+            return any(self.pattern.search(line) for line in lines)
+        return True
+
+    def wait(self, attempt):
+        "Seconds to wait before the attempt following the given one"
+
+        return min(self.delay * self.factor ** (attempt - 1), self.max_delay)
@@ -0,0 +1,261 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Run many agent jobs from a single process.
+
+Each job is an agent class plus the argv it would get on the command line,
+jobs are executed by a bounded pool of workers and the individual return
+codes are collected and summarized at the end. Jobs start when the CPU
+slots, memory and locks they ask for are available, two jobs using the same
+lab (configuration directory and prefix) never run at the same time.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import dciagent.core.printer as printer
+import dciagent.core.registry as registry
+import dciagent.core.scheduler as scheduler
+import dciagent.core.stream as stream
+
+
+def _lab(agent, argv):
+    """
+    The lab lock of the agent run with these arguments, from its own parser
+    and the environment. None when the agent has no configuration directory.
+    """
+
+    try:
+        cls = registry.load_agent(agent)
+        args = cls.peek(argv)
+    except (ImportError, AttributeError, ValueError, SystemExit):
+        return None  # the job fails once run, it can't drive a lab
+    config_dir = getattr(args, "config_dir", None)
+    if config_dir is None:
+        config_dir = getattr(cls, "default_config_dir", None)
+    if config_dir is None:
+        return None
+    return "lab:{}:{}".format(
+        os.path.realpath(config_dir), getattr(args, "prefix", None) or ""
+    )
+
+
+class Job(object):
+    """
+    An agent class and the command line arguments to run it with, plus the
+    CPU slots, memory (MiB) and locks it needs and its priority (higher
+    first). The lab, configuration directory and prefix, is always locked.
+    The output can be prefixed with the job's name to tell the jobs apart.
+    """
+
+    def __init__(
+        self,
+        agent,
+        argv=None,
+        name=None,
+        cpus=1,
+        memory=0,
+        locks=(),
+        priority=0,
+        prefix_output=False,
+    ):
+        self.agent = agent
+        self.argv = list(argv or [])
+        self.name = name if name is not None else " ".join([str(agent)] + self.argv)
+        self.cpus = cpus
+        self.memory = memory
+        self.priority = priority
+        self.prefix_output = prefix_output
+        self.locks = set(locks)
+        lab = _lab(agent, self.argv)
+        if lab is not None:
+            self.locks.add(lab)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["agent"],
+            argv=data.get("argv"),
+            name=data.get("name"),
+            cpus=data.get("cpus", 1),
+            memory=data.get("memory", 0),
+            locks=data.get("locks", ()),
+            priority=data.get("priority", 0),
+        )
+
+    def __repr__(self):
+        return "<Job {}>".format(self.name)
+
+
+class Result(object):
+    "The outcome of a single job"
+
+    def __init__(self, job, rc, elapsed, error=None):
+        self.job = job
+        self.rc = rc
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.rc == 0
+
+    def __repr__(self):
+        return "<Result {} rc={}>".format(self.job.name, self.rc)
+
+
+def execute(job):
+    "Runs one job, never raises, the failure is recorded in the result instead"
+
+    start = time.monotonic()
+    error = None
+    try:
+        agent = registry.load_agent(job.agent)()
+        if job.prefix_output:
+            prefix = "[{}] ".format(job.name)
+            agent.sinks = [stream.Prefixed(prefix, agent.sinks or [stream.Terminal()])]
+        rc = agent.run(job.argv)
+    except SystemExit as se:
+        # argparse exits on --help and on invalid arguments
+        rc = se.code if isinstance(se.code, int) else 1
+    except Exception as e:
+        rc = 1
+        error = "{}: {}".format(type(e).__name__, e)
+
+    return Result(job, rc, time.monotonic() - start, error)
+
+
+def run(jobs, workers=None, cpus=None, memory=None):
+    """
+    Runs the jobs with at most `workers` of them at the same time, within
+    `cpus` slots (default: number of CPUs) and `memory` MiB (default: no
+    limit), returns the list of results in the same order as the jobs
+    """
+
+    jobs = list(jobs)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs) or 1))
+    if cpus is None:
+        cpus = os.cpu_count() or 1
+
+    admission = scheduler.Scheduler(cpus, memory)
+    for i, job in enumerate(jobs):
+        admission.submit(i, job)
+
+    results = [None] * len(jobs)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        while len(admission) or running:
+            for i, job in admission.admit(workers - len(running)):
+                running[pool.submit(execute, job)] = (i, job)
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                i, job = running.pop(future)
+                results[i] = future.result()
+                admission.release(job)
+
+    return results
+
+
+def returncode(results):
+    "Aggregated return code: the first failing job's, or 0 if all passed"
+
+    for result in results:
+        if not result.ok:
+            return result.rc
+    return 0
+
+
+def summary(results):
+    with printer.section("Ran {} job(s):".format(len(results))):
+        for result in results:
+            status = "ok" if result.ok else "FAILED rc={}".format(result.rc)
+            print(
+                "{:<10} {:>8.1f}s  {}".format(status, result.elapsed, result.job.name)
+            )
+            if result.error is not None:
+                print("           {}".format(result.error))
+
+
+def load_jobs(path):
+    """
+    Reads job specs from a file, either a JSON list or one JSON object per
+    line, e.g.: {"agent": "module:Agent", "argv": ["--dry-run"], "cpus": 2,
+    "memory": 2048, "locks": ["lab1"], "priority": 10}
+    """
+
+    with open(path) as f:
+        data = f.read()
+
+    if data.lstrip().startswith("["):
+        specs = json.loads(data)
+    else:
+        specs = [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    return [Job.from_dict(spec) for spec in specs]
+
+
+def main():
+    "dci-agent-batch"
+
+    ap = argparse.ArgumentParser(
+        prog=main.__doc__,
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="maximum number of jobs to run at the same time"
+        ". (env: $DCI_BATCH_JOBS, default: number of CPUs)",
+        default=os.getenv("DCI_BATCH_JOBS"),
+    )
+    ap.add_argument(
+        "--cpus",
+        type=int,
+        help="CPU slots shared by the running jobs"
+        ". (env: $DCI_BATCH_CPUS, default: number of CPUs)",
+        default=os.getenv("DCI_BATCH_CPUS"),
+    )
+    ap.add_argument(
+        "--memory",
+        type=int,
+        help="memory in MiB shared by the running jobs"
+        ". (env: $DCI_BATCH_MEMORY, default: no limit)",
+        default=os.getenv("DCI_BATCH_MEMORY"),
+    )
+    ap.add_argument("file", help="job specs file, JSON list or JSON lines")
+    args = ap.parse_args()
+
+    results = run(
+        load_jobs(args.file),
+        workers=args.jobs and int(args.jobs),
+        cpus=args.cpus and int(args.cpus),
+        memory=args.memory and int(args.memory),
+    )
+    summary(results)
+    return returncode(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
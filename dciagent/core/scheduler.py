@@ -0,0 +1,94 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Admission of the jobs according to the resources they need.
+
+Every job asks for CPU slots, an amount of memory and named locks (e.g. the
+lab it runs against). Jobs are considered by priority, then in submission
+order. A job waiting for CPU or memory holds back the ones behind it, so a
+big job is never starved by a stream of small ones, while a job waiting for
+a lock lets the others through.
+"""
+
+import heapq
+
+
+class Scheduler(object):
+    """
+    Tracks the resources in use, `cpus` slots and `memory` MiB (None for no
+    limit), not thread-safe: meant to be driven by a single dispatcher
+    """
+
+    def __init__(self, cpus=None, memory=None):
+        self.cpus = cpus
+        self.memory = memory
+        self.used_cpus = 0
+        self.used_memory = 0
+        self.locks = set()
+        self._queue = []
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _request(self, job):
+        "What the job needs, capped to the limits so it can run alone at least"
+
+        cpus = job.cpus
+        if self.cpus is not None:
+            cpus = min(cpus, self.cpus)
+        memory = job.memory
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return cpus, memory
+
+    def submit(self, key, job):
+        heapq.heappush(self._queue, (-job.priority, self._seq, key, job))
+        self._seq += 1
+
+    def _fits(self, cpus, memory):
+        if self.cpus is not None and self.used_cpus + cpus > self.cpus:
+            return False
+        if self.memory is not None and self.used_memory + memory > self.memory:
+            return False
+        return True
+
+    def admit(self, limit=None):
+        "Reserves the resources of the jobs that can start now, returns them"
+
+        admitted, waiting = [], []
+        while self._queue and (limit is None or len(admitted) < limit):
+            entry = heapq.heappop(self._queue)
+            job = entry[3]
+            if self.locks.intersection(job.locks):
+                waiting.append(entry)
+                continue
+            cpus, memory = self._request(job)
+            if not self._fits(cpus, memory):
+                waiting.append(entry)
+                break
+            self.used_cpus += cpus
+            self.used_memory += memory
+            self.locks.update(job.locks)
+            admitted.append((entry[2], job))
+
+        for entry in waiting:
+            heapq.heappush(self._queue, entry)
+        return admitted
+
+    def release(self, job):
+        cpus, memory = self._request(job)
+        self.used_cpus -= cpus
+        self.used_memory -= memory
+        self.locks.difference_update(job.locks)
@@ -0,0 +1,82 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Partitioning of the inventory hosts in shards, each one run by its own
+ansible-playbook process with a --limit.
+"""
+
+import collections
+import zlib
+
+STRATEGIES = ("count", "group", "hash")
+
+
+def _by_count(names, shards):
+    "Contiguous slices of (almost) the same size, in inventory order"
+
+    size, extra = divmod(len(names), shards)
+    parts, start = [], 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        parts.append(names[start:end])
+        start = end
+    return parts
+
+
+def _by_hash(names, shards):
+    "Stable across runs, a host stays in its shard when others are added"
+
+    parts = [[] for _ in range(shards)]
+    for name in names:
+        parts[zlib.crc32(name.encode("utf-8")) % shards].append(name)
+    return parts
+
+
+def _by_group(hosts, shards):
+    """
+    Keeps the hosts of a group together, using their first (most specific)
+    group, the biggest groups are handed first to the smallest shard
+    """
+
+    groups = collections.OrderedDict()
+    for name, memberships in hosts.items():
+        group = memberships[0] if memberships else "ungrouped"
+        groups.setdefault(group, []).append(name)
+
+    parts = [[] for _ in range(shards)]
+    for members in sorted(groups.values(), key=len, reverse=True):
+        min(parts, key=len).extend(members)
+
+    order = {name: i for i, name in enumerate(hosts)}
+    return [sorted(part, key=order.get) for part in parts]
+
+
+def partition(hosts, shards, strategy="count"):
+    """
+    Splits the host -> groups mapping in at most `shards` lists of host names,
+    empty shards are dropped
+    """
+
+    if strategy not in STRATEGIES:
+        raise ValueError("Unknown sharding strategy {}".format(strategy))
+    shards = max(1, shards)
+
+    if strategy == "group":
+        parts = _by_group(hosts, shards)
+    elif strategy == "hash":
+        parts = _by_hash(list(hosts), shards)
+    else:
+        parts = _by_count(list(hosts), shards)
+
+    return [part for part in parts if part]
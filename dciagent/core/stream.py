@@ -0,0 +1,200 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Incremental capture of a child process' output.
+
+The output is read as it is produced and each line is handed to every sink,
+a sink is any object with a write(stream, line) and a close() method. Sinks
+writing to something slower e.g. a socket may also have a drain() coroutine,
+awaited by pump_async() between two chunks.
+"""
+
+import collections
+import os
+import selectors
+import sys
+
+# read size for every chunk taken from the pipes
+CHUNK_SIZE = 64 * 1024
+# longer lines are split so a runaway line can't eat all the memory
+MAX_LINE = 64 * 1024
+
+
+class Sink(object):
+    "Base sink, receives every output line of the child process"
+
+    def write(self, stream, line):
+        raise NotImplementedError("Define the write() method in your sink")
+
+    def close(self):
+        pass
+
+
+class Terminal(Sink):
+    "Echoes the lines to our own stdout/stderr"
+
+    def __init__(self, stdout=None, stderr=None):
+        self.files = {
+            "stdout": stdout or sys.stdout,
+            "stderr": stderr or sys.stderr,
+        }
+
+    def write(self, stream, line):
+        f = self.files[stream]
+        f.write(line)
+        f.write("\n")
+        f.flush()
+
+
+class RotatingFile(Sink):
+    "Appends the lines to a file, rotating it once it grows past max_bytes"
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._f = open(path, "a")
+        self._size = self._f.tell()
+
+    def _rotate(self):
+        self._f.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = "{}.{}".format(self.path, i)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self.path, i + 1))
+        if self.backups > 0:
+            os.replace(self.path, "{}.1".format(self.path))
+        self._f = open(self.path, "w")
+        self._size = 0
+
+    def write(self, stream, line):
+        if self.max_bytes and self._size + len(line) + 1 > self.max_bytes:
+            self._rotate()
+        self._f.write(line)
+        self._f.write("\n")
+        self._size += len(line) + 1
+
+    def close(self):
+        self._f.close()
+
+
+class RingBuffer(Sink):
+    "Keeps the last N lines in memory e.g. for failure reports"
+
+    def __init__(self, size=100):
+        self.buffer = collections.deque(maxlen=size)
+
+    def write(self, stream, line):
+        self.buffer.append((stream, line))
+
+    def lines(self):
+        return [line for _, line in self.buffer]
+
+
+class Prefixed(Sink):
+    "Hands the lines to other sinks with a prefix e.g. to tell children apart"
+
+    def __init__(self, prefix, sinks):
+        self.prefix = prefix
+        self.sinks = sinks
+
+    def write(self, stream, line):
+        for sink in self.sinks:
+            sink.write(stream, self.prefix + line)
+
+    async def drain(self):
+        await drain(self.sinks)
+
+
+class _Lines(object):
+    "Splits the chunks read from one pipe in lines and hands them to the sinks"
+
+    def __init__(self, stream, sinks, max_line):
+        self.stream = stream
+        self.sinks = sinks
+        self.max_line = max_line
+        self.pending = b""
+
+    def _emit(self, data):
+        for i in range(0, max(len(data), 1), self.max_line):
+            line = data[i : i + self.max_line].decode("utf-8", errors="replace")
+            for sink in self.sinks:
+                sink.write(self.stream, line)
+
+    def feed(self, chunk):
+        lines = (self.pending + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            self._emit(line)
+        if len(rest) > self.max_line:
+            cut = len(rest) - len(rest) % self.max_line
+            self._emit(rest[:cut])
+            rest = rest[cut:]
+        self.pending = rest
+
+    def flush(self):
+        if self.pending:
+            self._emit(self.pending)
+            self.pending = b""
+
+
+def pump(process, sinks, max_line=MAX_LINE):
+    """
+    Reads the child's stdout and stderr pipes until both are closed, fanning
+    out every line to the sinks. Only one partial line per pipe is buffered.
+    """
+
+    sel = selectors.DefaultSelector()
+    for stream in ("stdout", "stderr"):
+        pipe = getattr(process, stream)
+        if pipe is not None:
+            sel.register(pipe, selectors.EVENT_READ, _Lines(stream, sinks, max_line))
+
+    try:
+        while sel.get_map():
+            for key, _ in sel.select():
+                chunk = os.read(key.fd, CHUNK_SIZE)
+                if chunk:
+                    key.data.feed(chunk)
+                else:
+                    sel.unregister(key.fileobj)
+                    key.fileobj.close()
+                    key.data.flush()
+    finally:
+        sel.close()
+
+
+async def drain(sinks):
+    "Waits for the sinks that can't keep up"
+
+    for sink in sinks:
+        if hasattr(sink, "drain"):
+            await sink.drain()
+
+
+async def pump_async(reader, stream, sinks, max_line=MAX_LINE):
+    """
+    Same as pump() for one asyncio.StreamReader of an asyncio subprocess, the
+    child is not read further until the sinks drained
+    """
+
+    lines = _Lines(stream, sinks, max_line)
+    while True:
+        chunk = await reader.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        lines.feed(chunk)
+        await drain(sinks)
+    lines.flush()
+    await drain(sinks)
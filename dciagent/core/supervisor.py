@@ -0,0 +1,113 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Supervision of a child started in its own process group.
+
+The whole group is signalled, so the processes forked by ansible go away
+with it, escalating from SIGINT to SIGTERM then SIGKILL when the child runs
+for too long, stays silent for too long or we get interrupted.
+"""
+
+import os
+import signal
+import threading
+import time
+
+import dciagent.core.stream as stream
+
+ESCALATION = (signal.SIGINT, signal.SIGTERM, signal.SIGKILL)
+
+
+def signal_group(process, sig):
+    "Sends the signal to the process group led by the process"
+
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:  # all gone already
+        pass
+
+
+class Supervisor(stream.Sink):
+    """
+    Enforces a total timeout and an idle timeout (no output line for that
+    long) on the process, in seconds. As an output sink it sees the lines
+    the child writes. stop() must be called once the child was reaped.
+    """
+
+    def __init__(self, process, timeout=None, idle_timeout=None, grace=10):
+        self.process = process
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.grace = grace
+        # why the group was signalled: timeout, idle or interrupted
+        self.expired = None
+        self._started = self._activity = time.monotonic()
+        self._done = threading.Event()
+        self._thread = None
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self._started
+
+    def write(self, stream, line):
+        self._activity = time.monotonic()
+
+    def _expiry(self):
+        "The next deadline and its reason"
+
+        deadlines = []
+        if self.timeout:
+            deadlines.append((self._started + self.timeout, "timeout"))
+        if self.idle_timeout:
+            deadlines.append((self._activity + self.idle_timeout, "idle"))
+        return min(deadlines)
+
+    def _loop(self):
+        while True:
+            when, reason = self._expiry()
+            now = time.monotonic()
+            if now >= when:
+                self.expired = reason
+                self.escalate()
+                return
+            if self._done.wait(min(when - now, 1.0)):
+                return
+
+    def escalate(self):
+        "Signals the group harder and harder until the child is reaped"
+
+        for sig in ESCALATION:
+            signal_group(self.process, sig)
+            if self._done.wait(self.grace):
+                break
+        # the child is gone, not necessarily the rest of its group
+        signal_group(self.process, signal.SIGKILL)
+
+    def interrupt(self):
+        "We got interrupted, escalates from a thread while the child is reaped"
+
+        self.expired = "interrupted"
+        threading.Thread(target=self.escalate, daemon=True).start()
+
+    def start(self):
+        if self.timeout or self.idle_timeout:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
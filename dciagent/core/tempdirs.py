@@ -0,0 +1,142 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Working directories of the agents and their removal.
+
+A directory is discarded by renaming it into a trash directory next to it,
+which is instant, the actual removal is then done right away, by a detached
+process or later on by the sweeper:
+
+    dci-agent-sweep --root /dev/shm --older-than 3600
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import dciagent.core.utils as utils
+
+# how a discarded directory is removed
+MODES = ("sync", "background", "defer")
+TRASH = ".dci-trash"
+
+
+def create(root=None, prefix="dci-"):
+    "Creates a working directory, under root if given e.g. a tmpfs"
+
+    if root is not None:
+        os.makedirs(root, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=root)
+
+
+def trash_dir(root=None):
+    "The user's own trash directory, the root may be shared"
+
+    return os.path.join(
+        root or tempfile.gettempdir(), "{}-{}".format(TRASH, os.getuid())
+    )
+
+
+def discard(path, mode="sync"):
+    """
+    Removes the directory: sync deletes it before returning, background
+    leaves it to a detached rm and defer to the next sweep. Returns where it
+    is until then, None once removed.
+    """
+
+    if mode not in MODES:
+        raise ValueError("Unknown cleanup mode {}".format(mode))
+
+    if mode == "sync":
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+
+    try:
+        trash = utils.private_dir(trash_dir(os.path.dirname(path)))
+    except PermissionError:
+        shutil.rmtree(path, ignore_errors=True)  # not ours, can't move it there
+        return None
+    dest = os.path.join(trash, os.path.basename(path))
+    os.replace(path, dest)
+
+    if mode == "background":
+        # in its own session so it outlives us and never gets our signals
+        subprocess.Popen(
+            ["rm", "-rf", "--", dest],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        return None
+    return dest
+
+
+def sweep(root=None, older_than=0):
+    "Removes the discarded directories, returns the paths removed"
+
+    trash = trash_dir(root)
+    try:
+        names = os.listdir(trash)
+    except FileNotFoundError:
+        return []
+
+    removed = []
+    deadline = time.time() - older_than
+    for name in sorted(names):
+        path = os.path.join(trash, name)
+        try:
+            if os.lstat(path).st_mtime > deadline:
+                continue
+        except FileNotFoundError:  # a background rm got it first
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(path)
+    return removed
+
+
+def main():
+    "dci-agent-sweep"
+
+    ap = argparse.ArgumentParser(
+        prog=main.__doc__,
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    ap.add_argument(
+        "-r",
+        "--root",
+        help="directory the working directories are created in"
+        ". (env: $DCI_TEMPDIR_ROOT, default: the system temporary directory)",
+        default=os.getenv("DCI_TEMPDIR_ROOT"),
+    )
+    ap.add_argument(
+        "--older-than",
+        type=float,
+        default=0,
+        help="only remove the directories discarded this many seconds ago",
+    )
+    args = ap.parse_args()
+
+    for path in sweep(args.root, args.older_than):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
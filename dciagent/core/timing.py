@@ -0,0 +1,105 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Timing of the agent run phases and resource usage of the child process.
+"""
+
+import collections
+import contextlib
+import json
+import os
+import time
+
+# file extensions written in the OpenMetrics text format, JSON otherwise
+OPENMETRICS_EXTENSIONS = (".prom", ".om", ".txt")
+
+
+class Timer(object):
+    "Accumulates the wall time spent in each named phase"
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.child = {}
+        self._start = time.perf_counter()
+        self._end = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def stop(self):
+        self._end = time.perf_counter()
+
+    def to_dict(self):
+        end = self._end if self._end is not None else time.perf_counter()
+        return {
+            "total": end - self._start,
+            "phases": dict(self.phases),
+            "child": dict(self.child),
+        }
+
+
+def wait(process):
+    """
+    Waits for a subprocess.Popen with os.wait4() to get the child's resource
+    usage, returns the return code and sets it on the process object
+    """
+
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:  # already reaped
+        return process.wait(), {}
+
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+
+    usage = {
+        "user_cpu": rusage.ru_utime,
+        "system_cpu": rusage.ru_stime,
+        "max_rss_kb": rusage.ru_maxrss,
+    }
+    return process.returncode, usage
+
+
+def openmetrics(data):
+    lines = ["# TYPE dciagent_run_seconds gauge"]
+    lines.append("dciagent_run_seconds {}".format(data["total"]))
+    lines.append("# TYPE dciagent_phase_seconds gauge")
+    for phase, seconds in data["phases"].items():
+        lines.append('dciagent_phase_seconds{{phase="{}"}} {}'.format(phase, seconds))
+    for name, value in data["child"].items():
+        metric = "dciagent_child_{}".format(name)
+        lines.append("# TYPE {} gauge".format(metric))
+        lines.append("{} {}".format(metric, value))
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write(path, data):
+    "Writes the timings as JSON or OpenMetrics, depending on the file extension"
+
+    if path.endswith(OPENMETRICS_EXTENSIONS):
+        text = openmetrics(data)
+    else:
+        text = json.dumps(data, indent=2) + "\n"
+
+    with open(path, "w") as f:
+        f.write(text)
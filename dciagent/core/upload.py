@@ -0,0 +1,228 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Upload of the artifacts of a run while it is still going.
+
+Files are handed over as soon as they are complete and sent by a bounded
+set of workers, each file is streamed with a chunked PUT to <url>/<name>
+over keep-alive connections taken from a pool, the failed uploads are tried
+again with backoff. Everything sent must be waited for before the files go
+away.
+"""
+
+import base64
+import collections
+import concurrent.futures
+import http.client
+import os
+import threading
+import time
+import urllib.parse
+
+import dciagent.core.errors as errors
+import dciagent.core.retry as retry
+
+CHUNK_SIZE = 64 * 1024
+# worth trying again, the server was busy or restarting
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+_ERRORS = (OSError, http.client.HTTPException)
+
+
+class Pool(object):
+    "Keep-alive HTTP connections to one server, shared between threads"
+
+    def __init__(self, url, size=4, timeout=60.0):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Unsupported upload URL {}".format(url))
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.created = 0
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.scheme == "https":
+            cls = http.client.HTTPSConnection
+        else:
+            cls = http.client.HTTPConnection
+        self.created += 1
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def put(self, conn):
+        "Gives the connection back once its response was read"
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def request(self, method, name, body=None, headers=None):
+        """
+        Sends the request on a pooled connection, returns the status and body
+        of the response. A broken connection is dropped, not given back.
+        """
+
+        conn = self.get()
+        try:
+            conn.request(
+                method,
+                "{}/{}".format(self.path, urllib.parse.quote(name)),
+                body=body,
+                # without a length, iterables are sent chunked
+                headers=headers or {},
+            )
+            response = conn.getresponse()
+            data = response.read()
+        except _ERRORS:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.put(conn)
+        return response.status, data
+
+
+def _chunks(path, size):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class Uploader(object):
+    """
+    Uploads the submitted files to url with up to `workers` of them at the
+    same time, failed uploads are tried again according to the policy
+    """
+
+    def __init__(
+        self,
+        url,
+        workers=4,
+        policy=None,
+        chunk_size=CHUNK_SIZE,
+        headers=None,
+        timeout=60.0,
+    ):
+        self.check(url, headers)
+        self.pool = Pool(url, size=workers, timeout=timeout)
+        self.policy = policy or retry.Policy(retries=3, delay=1.0, codes=RETRY_STATUSES)
+        self.chunk_size = chunk_size
+        self.headers = dict(headers or {})
+        self.sent = []
+        self.failed = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check(url, headers=None):
+        "Raises a ValueError unless the files can be uploaded to url safely"
+
+        scheme = Pool(url).scheme
+        if "Authorization" in (headers or {}) and scheme != "https":
+            raise ValueError(
+                "Refusing to send credentials over {}, use https".format(scheme)
+            )
+
+    def submit(self, path, name=None):
+        "Queues the file for upload, once per name"
+
+        name = name or os.path.basename(path)
+        with self._lock:
+            if name in self._futures:
+                return self._futures[name]
+            future = self._executor.submit(self._upload, path, name)
+            self._futures[name] = future
+            return future
+
+    def _send(self, path, name):
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/octet-stream"
+        headers["X-File-Size"] = str(os.path.getsize(path))
+        return self.pool.request(
+            "PUT", name, body=_chunks(path, self.chunk_size), headers=headers
+        )
+
+    def _upload(self, path, name):
+        attempt = 1
+        while True:
+            try:
+                status, data = self._send(path, name)
+                error = None
+            except FileNotFoundError as e:
+                status, error = None, e
+                break  # removed in the meantime, nothing to try again
+            except _ERRORS as e:
+                status, error = None, e
+
+            if status is not None and 200 <= status < 300:
+                self.sent.append(name)
+                return status
+
+            if status is None:  # connection errors are worth another attempt
+                again = attempt <= self.policy.retries
+            else:
+                again = self.policy.retryable(attempt, status)
+            if not again:
+                break
+            time.sleep(self.policy.wait(attempt))
+            attempt += 1
+
+        if error is None:
+            error = "HTTP {}: {}".format(status, data[:200].decode(errors="replace"))
+        self.failed.append((name, str(error)))
+        raise errors.UploadError("Cannot upload {}: {}".format(name, error))
+
+    def wait(self, timeout=None):
+        """
+        Waits for every upload submitted so far, returns the (name, error) of
+        those that failed
+        """
+
+        with self._lock:
+            futures = list(self._futures.values())
+        concurrent.futures.wait(futures, timeout=timeout)
+        return list(self.failed)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def basic_auth(user, password):
+    "Authorization header for the user and password"
+
+    token = "{}:{}".format(user, password).encode("utf-8")
+    return {"Authorization": "Basic {}".format(base64.b64encode(token).decode())}
@@ -0,0 +1,74 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import stat
+import tempfile
+
+
+def strtobool(value):
+    """
+    Same as distutils.util.strtobool(), importing distutils costs more than
+    the rest of the start-up (it drags setuptools in) and it is going away
+    """
+
+    value = str(value).lower()
+    if value in ("y", "yes", "t", "true", "on", "1"):
+        return 1
+    elif value in ("n", "no", "f", "false", "off", "0"):
+        return 0
+    raise ValueError("invalid truth value {!r}".format(value))
+
+
+def private_dir(path):
+    """
+    Creates the directory only we may use unless already there, raises a
+    PermissionError if it is not ours e.g. in a shared /tmp
+    """
+
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError("{} is not owned by us".format(path))
+    return path
+
+
+def environ(parent=None):
+    "The environment the agent runs in, os.environ unless given a parent one"
+
+    return os.environ if parent is None else parent
+
+
+def atomic_write(path, data, mode=0o600):
+    """
+    Writes the text to the file through a temporary one in the same
+    directory, readers never see it half written. Only the owner may read it
+    by default, it may hold secrets.
+    """
+
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=".{}.".format(os.path.basename(path)),
+        suffix=".tmp",
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            if mode != 0o600:
+                os.fchmod(f.fileno(), mode)
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
@@ -0,0 +1,176 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Validation of the files handed over to ansible.
+
+Playbooks, inventories, settings and ansible.cfg are parsed and checked, the
+verdict is cached by path and validated against the file's inode, mtime and
+size, then its content hash. Only changed files are checked again.
+"""
+
+import configparser
+import hashlib
+import json
+import os
+import threading
+
+import yaml
+
+import dciagent.core.errors as errors
+import dciagent.core.inventory as inventory
+import dciagent.core.utils as utils
+
+# (kind, path) -> (stat key, content digest, error message or None)
+_cache = {}
+# (kind, content digest) found valid whatever the path e.g. identical files
+# of several labs
+_valid = set()
+_lock = threading.Lock()
+
+PLAY_KEYS = (
+    "hosts",
+    "import_playbook",
+    "ansible.builtin.import_playbook",
+    "include",
+)
+
+
+def _yaml(data, what):
+    try:
+        return yaml.load(data, Loader=inventory.Loader)
+    except yaml.YAMLError as e:
+        raise errors.ValidationError("Invalid YAML in {}: {}".format(what, e))
+
+
+def check_playbook(path, data):
+    plays = _yaml(data, "ansible playbook {}".format(path))
+    if not isinstance(plays, list) or not plays:
+        raise errors.ValidationError(
+            "Ansible playbook {} is not a list of plays".format(path)
+        )
+    for play in plays:
+        if not isinstance(play, dict) or not any(k in play for k in PLAY_KEYS):
+            raise errors.ValidationError(
+                "Ansible playbook {} has a play without hosts".format(path)
+            )
+
+
+def check_inventory(path, data):
+    if os.access(path, os.X_OK):
+        return  # dynamic inventory script, can't tell without running it
+    try:
+        inventory.parse(data.decode("utf-8", errors="replace"))
+    except ValueError as e:
+        raise errors.ValidationError(
+            "Cannot parse ansible inventory file {}: {}".format(path, e)
+        )
+
+
+def check_settings(path, data):
+    settings = _yaml(data, "settings file {}".format(path))
+    if settings is not None and not isinstance(settings, dict):
+        raise errors.ValidationError(
+            "Settings file {} is not a mapping of variables".format(path)
+        )
+
+
+def check_config(path, data):
+    cp = configparser.ConfigParser(interpolation=None)
+    try:
+        cp.read_string(data.decode("utf-8", errors="replace"), source=path)
+    except configparser.Error as e:
+        raise errors.ValidationError(
+            "Cannot parse ansible config {}: {}".format(path, e)
+        )
+
+
+CHECKS = {
+    "playbook": check_playbook,
+    "inventory": check_inventory,
+    "settings": check_settings,
+    "config": check_config,
+}
+
+
+def _disk_path(cache_dir, kind, path):
+    name = hashlib.sha256("{}\0{}".format(kind, path).encode()).hexdigest()
+    return os.path.join(cache_dir, "{}.json".format(name))
+
+
+def _load_disk(cache_dir, kind, path):
+    try:
+        with open(_disk_path(cache_dir, kind, path)) as f:
+            entry = json.load(f)
+        return (tuple(entry["key"]), entry["digest"], entry["error"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _store_disk(cache_dir, kind, path, entry):
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    data = json.dumps({"key": entry[0], "digest": entry[1], "error": entry[2]})
+    utils.atomic_write(_disk_path(cache_dir, kind, path), data)
+
+
+def check(kind, path, cache_dir=None):
+    """
+    Checks the file as the given kind (playbook, inventory, settings or
+    config), raises a ValidationError when it is not valid. With a cache_dir
+    the verdicts are also kept on disk for other processes.
+    """
+
+    path = os.path.abspath(path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    if st is None or not os.path.isfile(path):
+        raise errors.ValidationError("Cannot read {} file {}".format(kind, path))
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    with _lock:
+        hit = _cache.get((kind, path))
+    if hit is None and cache_dir is not None:
+        hit = _load_disk(cache_dir, kind, path)
+
+    if hit is not None and hit[0] == key:
+        entry = hit
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        if hit is not None and hit[1] == digest:
+            entry = (key, digest, hit[2])  # touched but not modified
+        elif (kind, digest) in _valid:
+            entry = (key, digest, None)
+        else:
+            try:
+                CHECKS[kind](path, data)
+                entry = (key, digest, None)
+                # an executable inventory is not even looked at
+                if kind != "inventory" or not os.access(path, os.X_OK):
+                    with _lock:
+                        _valid.add((kind, digest))
+            except errors.ValidationError as e:
+                entry = (key, digest, str(e))
+
+        if cache_dir is not None:
+            _store_disk(cache_dir, kind, path, entry)
+
+    with _lock:
+        _cache[(kind, path)] = entry
+
+    if entry[2] is not None:
+        raise errors.ValidationError(entry[2])
@@ -0,0 +1,279 @@
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Live progress of a running playbook.
+
+Tails ansible.log and picks up the JUnit XML files as they are written,
+with cheap polling, keeping track of the tasks run so far and the failures.
+Once the events of the playbook come in, they are used instead of the log.
+"""
+
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+_TASK = re.compile(r"\bTASK \[(.*)\]")
+_FAILED = re.compile(r"\b(?:fatal|failed): \[([^\]]+)\]")
+_IGNORING = "...ignoring"
+
+
+class Progress(object):
+    "What is known about the run so far"
+
+    def __init__(self):
+        self.tasks = []
+        self.failures = []
+        self.testcases = 0
+        self.junit_files = []
+
+    @property
+    def task(self):
+        return self.tasks[-1] if self.tasks else None
+
+    def to_dict(self):
+        return {
+            "task": self.task,
+            "tasks": len(self.tasks),
+            "testcases": self.testcases,
+            "failures": list(self.failures),
+        }
+
+
+class _Log(object):
+    "A log file being tailed and what was read of it so far"
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        self.partial = b""
+        self.suspect = None  # failed task line, unless "...ignoring" follows
+
+
+class Watcher(object):
+    """
+    Polls the log file and the JUnit directory every `interval` seconds from
+    a background thread, on_failure is called with every failure found,
+    on_line with every line of the log and on_junit with every complete
+    JUnit file. More of them can be watched e.g. those of the shards.
+    """
+
+    def __init__(
+        self,
+        log_path=None,
+        junit_dir=None,
+        interval=2.0,
+        on_failure=None,
+        on_line=None,
+        on_junit=None,
+    ):
+        self._lock = threading.Lock()
+        self.logs = []
+        self.junit_dirs = []
+        self.watch(log_path, junit_dir)
+        self.interval = interval
+        self.on_failure = on_failure
+        self.on_line = on_line
+        self.on_junit = on_junit
+        self.progress = Progress()
+        self._sizes = {}
+        self._seen = set()
+        self._events = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, log_path=None, junit_dir=None):
+        "Also watches this log file and JUnit directory"
+
+        with self._lock:
+            if log_path is not None and all(log.path != log_path for log in self.logs):
+                self.logs.append(_Log(log_path))
+            if junit_dir is not None and junit_dir not in self.junit_dirs:
+                self.junit_dirs.append(junit_dir)
+
+    def unwatch(self, log_path=None, junit_dir=None):
+        "Stops watching this log file and JUnit directory"
+
+        with self._lock:
+            self.logs = [log for log in self.logs if log.path != log_path]
+            if junit_dir in self.junit_dirs:
+                self.junit_dirs.remove(junit_dir)
+
+    def _failure(self, failure):
+        self.progress.failures.append(failure)
+        if self.on_failure is not None:
+            self.on_failure(failure)
+
+    def _confirm(self, log, line=None):
+        if log.suspect is not None:
+            if line is None or _IGNORING not in line:
+                self._failure(log.suspect)
+            log.suspect = None
+
+    def _line(self, log, line):
+        if self.on_line is not None:
+            self.on_line(line)
+        if self._events:
+            return
+        self._confirm(log, line)
+
+        m = _TASK.search(line)
+        if m:
+            self.progress.tasks.append(m.group(1))
+            return
+
+        m = _FAILED.search(line)
+        if m:
+            log.suspect = {
+                "source": "log",
+                "task": self.progress.task,
+                "host": m.group(1),
+                "message": line[m.end() :].strip(": "),
+            }
+
+    def event(self, event):
+        "Goes through an event of the playbook, the log isn't parsed anymore"
+
+        self._events = True
+        kind = event.get("event")
+        if kind == "task_start":
+            self.progress.tasks.append(event.get("task"))
+        elif kind == "unreachable" or (kind == "failed" and not event.get("ignored")):
+            self._failure(
+                {
+                    "source": "events",
+                    "task": event.get("task"),
+                    "host": event.get("host"),
+                    "message": event.get("msg"),
+                }
+            )
+
+    def feed(self, lines):
+        "Goes through log lines obtained some other way"
+
+        log = _Log(None)
+        for line in lines:
+            self._line(log, line)
+        self._confirm(log)
+
+    def _tail(self, log):
+        try:
+            st = os.stat(log.path)
+        except OSError:
+            return
+        size = st.st_size
+        if size < log.offset or st.st_ino != log.inode:  # truncated or replaced
+            log.inode, log.offset, log.partial = st.st_ino, 0, b""
+        if size == log.offset:
+            return
+
+        with open(log.path, "rb") as f:
+            f.seek(log.offset)
+            data = f.read(size - log.offset)
+        log.offset += len(data)
+
+        lines = (log.partial + data).split(b"\n")
+        log.partial = lines.pop()
+        for line in lines:
+            self._line(log, line.decode("utf-8", errors="replace"))
+
+    def _junit(self, path):
+        "Streams through a JUnit file, only keeping the current testcase"
+
+        testcases = 0
+        failures = []
+        for _, elem in ET.iterparse(path):
+            if elem.tag != "testcase":
+                continue
+            testcases += 1
+            for child in elem:
+                if child.tag in ("failure", "error"):
+                    failures.append(
+                        {
+                            "source": "junit",
+                            "task": elem.get("name"),
+                            "host": elem.get("classname"),
+                            "message": child.get("message") or child.text,
+                        }
+                    )
+            elem.clear()
+
+        self.progress.testcases += testcases
+        self.progress.junit_files.append(path)
+        for failure in failures:
+            self._failure(failure)
+        if self.on_junit is not None:
+            self.on_junit(path)
+
+    def _scan(self, junit_dir, final=False):
+        try:
+            names = os.listdir(junit_dir)
+        except OSError:
+            return
+
+        for name in sorted(names):
+            path = os.path.join(junit_dir, name)
+            if not name.endswith(".xml") or path in self._seen:
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            # only parse files that stopped growing since the last poll
+            if final or self._sizes.get(path) == size:
+                self._seen.add(path)
+                try:
+                    self._junit(path)
+                except ET.ParseError:
+                    if not final:  # still being written after all
+                        self._seen.discard(path)
+            else:
+                self._sizes[path] = size
+
+    def poll(self, final=False):
+        # also called from the agent's thread e.g. before the files go away
+        with self._lock:
+            for log in self.logs:
+                self._tail(log)
+                if final:
+                    if log.partial:
+                        partial = log.partial.decode("utf-8", errors="replace")
+                        self._line(log, partial)
+                        log.partial = b""
+                    self._confirm(log)
+            for junit_dir in self.junit_dirs:
+                self._scan(junit_dir, final)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        "Stops polling and picks up whatever was written in the meantime, once"
+
+        if self._stopped:
+            return self.progress
+        self._stopped = True
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.poll(final=True)
+        return self.progress
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+from dciagent.core import stream
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+
+
+class Agent(Base):
+    "test-ctl"
+
+    executable = "sh"
+    script = Argument("shell script to run", long="--script", default="true")
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+        self.hooks = []
+
+    async def _pre(self):
+        self.hooks.append("pre")
+
+    def _post(self):
+        self.hooks.append("post")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", self.script]
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_run_async():
+    agent = Agent()
+    agent.sinks = [stream.RingBuffer()]
+    rc = _run(agent.run_async(["--script", "echo hello; exit 4"]))
+    assert rc == 4
+    assert agent.sinks[0].lines() == ["hello"]
+    assert agent.hooks == ["pre", "post"]
+
+
+def test_run_async_cancel():
+    agent = Agent()
+    argv = ["--script", "trap '' TERM; sleep 30"]
+
+    async def cancel():
+        task = asyncio.ensure_future(agent.run_async(argv, grace=0.2))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    _run(cancel())
+    assert time.monotonic() - start < 5
+    assert agent.process.returncode == -9
+    assert agent.hooks == ["pre", "post"]
+
+
+def test_arguments_from_environment(monkeypatch):
+    from dciagent.core.agents.ansible import Agent as AnsibleAgent
+
+    class Ansible(AnsibleAgent):
+        def __init__(self):
+            super().__init__("ansible-ctl", "test agent", "0.1")
+
+    monkeypatch.setenv("ANSIBLE_PLAYBOOK", "env.yml")
+    monkeypatch.setenv("ANSIBLE_LIMIT", "web")
+    monkeypatch.setenv("VERBOSITY", "2")
+
+    first, second = Ansible(), Ansible()
+    assert first.ap is second.ap
+
+    first._load_args(vars(first._cli([])))
+    assert first.playbook == "env.yml"
+    assert first.ansible_limit == "web"
+    assert first.verbosity == 2
+    assert first.dry_run is False
+
+    second._load_args(vars(second._cli(["-l", "db", "--dry-run", "site.yml"])))
+    assert second.playbook == "site.yml"
+    assert second.ansible_limit == "db"
+    assert second.dry_run is True
+    assert Ansible.playbook.help.startswith("path to the ansible playbook")
+
+
+class SyncAgent(Agent):
+    def _pre(self):
+        self.hooks.append("pre")
+
+
+def test_timings(tmp_path):
+    path = tmp_path / "timings.prom"
+    agent = SyncAgent()
+    rc = agent.run(["--script", "exit 2", "--timings-file", str(path)])
+
+    assert rc == 2
+    timings = agent.timings
+    assert list(timings["phases"]) == [
+        "cli",
+        "normalize",
+        "validate",
+        "pre",
+        "build_command",
+        "build_env",
+        "execute",
+        "post",
+    ]
+    assert set(timings["child"]) == {"user_cpu", "system_cpu", "max_rss_kb", "wall"}
+    assert 'dciagent_phase_seconds{phase="execute"}' in path.read_text()
+
+
+def test_report(tmp_path, capsys):
+    from dciagent.core import report
+
+    path = tmp_path / "runs.jsonl"
+    agent = SyncAgent()
+    agent.environment = {"API_TOKEN": "xyz", "FOO": "bar"}
+    script = "for i in 1 2 3; do echo line $i; done; exit 3"
+    assert agent.run(["--script", script, "--report-file", str(path)]) == 3
+    assert agent.run(["--dry-run", "--report-file", str(path)]) == 0
+
+    assert capsys.readouterr().out.startswith("line 1\nline 2\nline 3\n")
+    assert agent.sinks == []
+
+    first, second = list(report.load(str(path)))
+    assert first.rc == 3 and not first.ok
+    assert first.command_line[1:] == ["-c", script]
+    assert first.environment == {"API_TOKEN": "<redacted>", "FOO": "bar"}
+    assert first.tail == ["line 1", "line 2", "line 3"]
+    assert "execute" in first.timings["phases"]
+    assert second.ok and second.tail == []
+    assert agent.result.to_dict() == second.to_dict()
+
+
+def test_no_asyncio_on_startup():
+    # only the async runs pay for it
+    code = "import sys, dciagent.core.agents.dci; print('asyncio' in sys.modules)"
+    out = subprocess.check_output([sys.executable, "-c", code])
+    assert out.strip() == b"False"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import configparser
+import os
+
+import pytest
+
+from dciagent.core import ansiblecfg
+from dciagent.core import errors
+from dciagent.core.agents import ansible
+
+USER_CFG = """[defaults]
+roles_path = ./roles:/usr/share/roles
+callback_whitelist = junit
+forks = 7
+
+[ssh_connection]
+ssh_args = -o ForwardAgent=yes
+"""
+
+
+def _parse(text):
+    cp = configparser.ConfigParser(interpolation=None)
+    cp.read_string(text)
+    return cp
+
+
+def test_overlay(tmp_path):
+    cfg = tmp_path / "ansible.cfg"
+    cfg.write_text(USER_CFG)
+
+    cp = _parse(ansiblecfg.overlay(str(cfg), "fast"))
+    assert cp["defaults"]["forks"] == "7"
+    assert cp["defaults"]["roles_path"] == "{}/roles:/usr/share/roles".format(tmp_path)
+    assert cp["defaults"]["callback_whitelist"] == "junit"
+    assert cp["defaults"]["gathering"] == "smart"
+    assert cp["ssh_connection"]["ssh_args"] == "-o ForwardAgent=yes"
+    assert cp["ssh_connection"]["pipelining"] == "True"
+    assert cp["ssh_connection"]["control_path"] == "%(directory)s/%%h-%%p-%%r"
+
+    cp = _parse(ansiblecfg.overlay(None, "safe", hosts=2))
+    assert cp["defaults"]["forks"] == str(min(2, ansiblecfg.forks()))
+    assert "pipelining" not in cp["ssh_connection"]
+
+
+class Agent(ansible.Agent):
+    executable = "true"
+
+    def __init__(self, directory):
+        super().__init__("test-ctl", "test agent", "0.1")
+        self.directory = directory
+
+    def _generated_dir(self):
+        return self.directory
+
+
+def test_agent(tmp_path):
+    (tmp_path / "hosts").write_text("node[1:3]\n")
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text(USER_CFG)
+    argv = [
+        "-i",
+        str(tmp_path / "hosts"),
+        "-c",
+        str(tmp_path / "ansible.cfg"),
+        str(tmp_path / "site.yml"),
+    ]
+    generated = str(tmp_path / "generated")
+
+    agent = Agent(generated)
+    assert agent.run(argv + ["--ansible-profile", "free"]) == 0
+    path = agent.environment["ANSIBLE_CONFIG"]
+    assert os.path.dirname(path) == generated
+    with open(path) as f:
+        assert _parse(f.read())["defaults"]["strategy"] == "free"
+
+    agent.run(argv + ["--ansible-profile", "free"])
+    assert agent.environment["ANSIBLE_CONFIG"] == path
+    assert len(os.listdir(generated)) == 1
+
+    with pytest.raises(errors.ValidationError, match="Unknown ansible profile"):
+        agent.run(argv + ["--ansible-profile", "turbo"])
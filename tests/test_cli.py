@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import os
+import sys
+
+from dciagent.core import cli
+from dciagent.core import registry
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+
+
+class Agent(Base):
+    "test-ctl"
+
+    executable = "true"
+    config_dir = Argument("config dir", long="--config-dir", env="DCI_CONFIG_DIR")
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+
+    def _build_command(self):
+        type(self).seen = self.config_dir
+        self.command_line = [self.executable]
+
+
+def test_main_imports_only_the_selected_agent(monkeypatch):
+    agents = collections.OrderedDict(registry.AGENTS)
+    agents["test"] = registry.Entry("{}:Agent".format(__name__), "test agent")
+    monkeypatch.setattr(registry, "AGENTS", agents)
+    monkeypatch.delenv("DCI_CONFIG_DIR", raising=False)
+
+    rc = cli.main(["-C", "/etc/dci", "test", "--dry-run"])
+
+    assert rc == 0
+    assert Agent.seen == "/etc/dci"
+    assert "dciagent.agents.dummy" not in sys.modules
+    os.environ.pop("DCI_CONFIG_DIR")
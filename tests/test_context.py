@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import subprocess
+
+from dciagent.core import context as ctx
+
+
+def test_environment_layers():
+    base = ctx.Environment({"A": "1", "B": "2"}, C="3")
+    top = base.layer(A="10", B=None)
+
+    assert dict(base) == {"A": "1", "B": "2", "C": "3"}
+    assert dict(top) == {"A": "10", "C": "3"}
+    assert "B" not in top
+    assert len(top) == 2
+
+
+def test_environment_child(monkeypatch):
+    monkeypatch.setenv("DCI_TEST_PARENT", "parent")
+    env = ctx.Environment(DCI_TEST_CHILD="child")
+    out = subprocess.check_output(
+        ["sh", "-c", 'echo "$DCI_TEST_PARENT $DCI_TEST_CHILD"'],
+        env=env,
+        universal_newlines=True,
+    )
+    assert out == "parent child\n"
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import pytest
+
+from dciagent.core import credentials
+from dciagent.core import errors
+from dciagent.core.agents import dci
+
+DCIRC = """# DCI credentials
+export DCI_CLIENT_ID='remoteci/1234'
+export DCI_API_SECRET="s3cr=t"
+DCI_CS_URL=https://api.distributed-ci.io
+export DCI_CS_URL
+OTHER=ignored
+export OTHER
+"""
+
+EXPECTED = {
+    "DCI_CLIENT_ID": "remoteci/1234",
+    "DCI_API_SECRET": "s3cr=t",
+    "DCI_CS_URL": "https://api.distributed-ci.io",
+}
+
+
+def test_parse():
+    assert credentials.parse(DCIRC) == EXPECTED
+    assert credentials.parse("export DCI_CLIENT_ID=$(cat id)") is None
+    assert credentials.parse("if true; then export DCI_X=1; fi") is None
+
+
+def test_parse_matches_shell(tmp_path):
+    path = tmp_path / "dcirc.sh"
+    path.write_text(DCIRC)
+    assert credentials.source(str(path)) == EXPECTED
+
+
+def test_read_falls_back_to_shell(tmp_path):
+    path = tmp_path / "dcirc.sh"
+    path.write_text('X=remoteci\nexport DCI_CLIENT_ID="$X/1234"\n')
+    assert credentials.read(str(path)) == {"DCI_CLIENT_ID": "remoteci/1234"}
+
+
+def test_read_cache(tmp_path, monkeypatch):
+    path = tmp_path / "dcirc.sh"
+    path.write_text(DCIRC)
+    cache = str(tmp_path / "cache")
+    assert credentials.read(str(path), cache_dir=cache) == EXPECTED
+    assert len(os.listdir(cache)) == 1
+
+    # unchanged file, nothing gets parsed again
+    monkeypatch.setattr(credentials, "parse", None)
+    assert credentials.read(str(path), cache_dir=cache) == EXPECTED
+
+    # same content, different stat: served from disk by content hash
+    credentials._cache.clear()
+    assert credentials.read(str(path), cache_dir=cache) == EXPECTED
+    monkeypatch.undo()
+
+    path.write_text("export DCI_CLIENT_ID=other\n")
+    os.utime(str(path), (0, 0))
+    assert credentials.read(str(path)) == {"DCI_CLIENT_ID": "other"}
+
+
+class Agent(dci.Agent):
+    executable = "sh"
+
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_missing_auth_file(tmp_path):
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "hosts").write_text("node1\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+    agent = Agent()
+    argv = ["-C", str(tmp_path), "-i", str(tmp_path / "hosts")]
+    argv += ["-c", str(tmp_path / "ansible.cfg")]
+    with pytest.raises(errors.ValidationError, match="authentication file"):
+        agent.run(argv + ["--dry-run", str(tmp_path / "site.yml")])
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import contextlib
+import os
+import threading
+import time
+
+from dciagent.core import client
+from dciagent.core import daemon
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+
+
+class Agent(Base):
+    "test-ctl"
+
+    executable = "sh"
+    message = Argument("what to echo", long="--message", env="DCI_TEST_MESSAGE")
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", "echo $0; exit 3", self.message]
+
+
+def _serve(loop, task):
+    try:
+        loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        pass
+
+
+@contextlib.contextmanager
+def _daemon(tmp_path):
+    # started from the test itself: the daemon replaces sys.stdout, which
+    # pytest resets between the setup and call phases
+    path = str(tmp_path / "agentd.sock")
+    loop = asyncio.new_event_loop()
+    d = daemon.Daemon(path, jobs=2)
+    task = loop.create_task(d.serve())
+    thread = threading.Thread(target=_serve, args=(loop, task))
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+
+    yield path
+
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join()
+    loop.close()
+
+
+def _submit(path, argv, env=None):
+    return list(client.submit("{}:Agent".format(__name__), argv, env, path=path))
+
+
+def test_job_output(tmp_path):
+    with _daemon(tmp_path) as path:
+        messages = _submit(path, [], {"DCI_TEST_MESSAGE": "hello"})
+    assert messages == [{"stream": "stdout", "line": "hello"}, {"rc": 3}]
+
+
+def test_printed_output(tmp_path):
+    with _daemon(tmp_path) as path:
+        messages = _submit(path, ["--message", "hi", "--dry-run"])
+    lines = [m["line"] for m in messages if "line" in m]
+    assert "Dry-run mode, should execute this command:" in lines
+    assert messages[-1] == {"rc": 0}
+
+
+def test_invalid_arguments(tmp_path):
+    with _daemon(tmp_path) as path:
+        messages = _submit(path, ["--unknown"])
+    assert messages[-1] == {"rc": 2}
+    assert any("unrecognized arguments" in m.get("line", "") for m in messages)
+
+
+class Slow(Agent):
+    "slow-ctl"
+
+    def _pre(self):
+        time.sleep(1)  # e.g. joining a thread, waiting for uploads
+        print("pre done")
+
+
+def test_blocking_hooks(tmp_path):
+    finished = {}
+
+    def submit(path, agent, name):
+        messages = list(client.submit(agent, ["--message", name], path=path))
+        finished[name] = (time.monotonic(), messages)
+
+    with _daemon(tmp_path) as path:
+        slow = threading.Thread(
+            target=submit, args=(path, "{}:Slow".format(__name__), "slow")
+        )
+        slow.start()
+        time.sleep(0.2)
+        submit(path, "{}:Agent".format(__name__), "fast")
+        slow.join()
+
+    # the other job went on while the slow one was blocked in its hook
+    assert finished["fast"][0] < finished["slow"][0]
+    assert {"stream": "stdout", "line": "pre done"} in finished["slow"][1]
+    assert finished["slow"][1][-1] == {"rc": 3}
+
+
+class Tool(Base):
+    "tool-ctl"
+
+    executable = "dci-test-tool"
+    data = Argument("file to read", long="--data", path=True)
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+
+    def _validate(self):
+        super()._validate()
+        if not os.path.isfile(self.data):
+            raise FileNotFoundError(self.data)
+
+    def _build_command(self):
+        self.command_line = [self.executable, self.data, "relative"]
+
+
+def test_client_directory(tmp_path):
+    work = tmp_path / "work"
+    (work / "bin").mkdir(parents=True)
+    tool = work / "bin" / "dci-test-tool"
+    tool.write_text('#!/bin/sh\ncat "$1" "$2"\n')
+    tool.chmod(0o755)
+    (work / "data").write_text("from the data file\n")
+    (work / "relative").write_text("from the working directory\n")
+    env = {"PATH": "{}:{}".format(work / "bin", os.environ["PATH"])}
+
+    # the daemon runs elsewhere, the paths are the client's
+    with _daemon(tmp_path) as path:
+        messages = list(
+            client.submit(
+                "{}:Tool".format(__name__),
+                ["--data", "data"],
+                env,
+                path=path,
+                cwd=str(work),
+            )
+        )
+    assert messages == [
+        {"stream": "stdout", "line": "from the data file"},
+        {"stream": "stdout", "line": "from the working directory"},
+        {"rc": 0},
+    ]
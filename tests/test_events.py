@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import subprocess
+import sys
+
+from dciagent.core import events
+from dciagent.core import watch
+from dciagent.core.agents import ansible
+
+EVENTS = [
+    {"event": "task_start", "task": "setup"},
+    {"event": "failed", "task": "setup", "host": "node1", "ignored": True},
+    {"event": "task_start", "task": "app : deploy"},
+    {"event": "failed", "task": "app : deploy", "host": "node1", "msg": "boom"},
+]
+
+# fake ansible-playbook sending the events the callback plugin would
+PLAYBOOK_CMD = """#!{}
+import json
+import os
+import sys
+
+log = os.environ["ANSIBLE_LOG_PATH"]
+with open(log + ".args", "a") as f:
+    print(" ".join(sys.argv[1:]), file=f)
+with open(log + ".plugins", "w") as f:
+    f.write(os.environ["ANSIBLE_CALLBACK_PLUGINS"])
+if "--start-at-task" in sys.argv:
+    sys.exit(0)
+fd = int(os.environ["DCIAGENT_EVENTS_FD"])
+for event in {!r}:
+    os.write(fd, json.dumps(event).encode() + b"\\n")
+sys.exit(2)
+""".format(sys.executable, EVENTS)
+
+
+def test_pipe():
+    received = []
+    pipe = events.Pipe(received.append).start()
+    script = "import os, sys; os.write({}, sys.argv[1].encode())".format(pipe.fd)
+    data = '{"event": "task_start", "task": "a"}\n{"cut'
+    subprocess.check_call([sys.executable, "-c", script, data], pass_fds=(pipe.fd,))
+    assert pipe.sync()
+    assert received == [{"event": "task_start", "task": "a"}]
+    assert pipe.count == 1
+    pipe.close()
+    assert pipe.fd is None
+
+
+def test_watcher_events(tmp_path):
+    log = tmp_path / "ansible.log"
+    failures = []
+    w = watch.Watcher(str(log), on_failure=failures.append)
+    w.event({"event": "task_start", "task": "deploy"})
+    w.event({"event": "failed", "task": "deploy", "host": "h1", "ignored": True})
+    w.event({"event": "unreachable", "task": "deploy", "host": "h2", "msg": "no"})
+
+    # the log is not parsed anymore
+    log.write_text("TASK [deploy] ***\nfatal: [h3]: FAILED! => {}\n")
+    progress = w.stop()
+    assert progress.tasks == ["deploy"]
+    assert [(f["source"], f["host"], f["message"]) for f in failures] == [
+        ("events", "h2", "no")
+    ]
+
+
+class Agent(ansible.Agent):
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+    def _build_env(self):
+        super()._build_env()
+        self.environment["ANSIBLE_LOG_PATH"] = self.log_path
+
+
+def test_agent_events(tmp_path, monkeypatch):
+    monkeypatch.delenv("ANSIBLE_CALLBACK_PLUGINS", raising=False)
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PLAYBOOK_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "hosts").write_text("node1\n")
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\ncallback_plugins = plugins\n")
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.log_path = str(tmp_path / "ansible.log")
+    argv = ["-i", str(tmp_path / "hosts"), "-c", str(tmp_path / "ansible.cfg")]
+    rc = agent.run(
+        argv + ["--retries", "1", "--resume", "task", str(tmp_path / "site.yml")]
+    )
+
+    assert rc == 0
+    assert agent.events is None
+    # the failed task comes from the events, the log is empty
+    with open(agent.log_path + ".args") as f:
+        second = f.read().splitlines()[1]
+    assert "--start-at-task app : deploy" in second
+    with open(agent.log_path + ".plugins") as f:
+        plugins = f.read().strip()
+    assert plugins == os.pathsep.join([events.PLUGIN_DIR, str(tmp_path / "plugins")])
+
+
+def _load_plugin(monkeypatch):
+    import importlib.util
+    import types
+
+    try:
+        import ansible.plugins.callback  # noqa: F401
+    except ImportError:  # only CallbackBase is needed
+        callback = types.ModuleType("ansible.plugins.callback")
+        callback.CallbackBase = object
+        for name in ("ansible", "ansible.plugins"):
+            monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+        monkeypatch.setitem(sys.modules, "ansible.plugins.callback", callback)
+
+    spec = importlib.util.spec_from_file_location(
+        "dciagent_events", os.path.join(events.PLUGIN_DIR, "dciagent_events.py")
+    )
+    plugin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+class _Task(object):
+    _uuid = "1234"
+
+    def __init__(self, name="deploy"):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class _Host(object):
+    def get_name(self):
+        return "node1"
+
+
+class _Result(object):
+    def __init__(self, msg, task=None):
+        self._task = task or _Task()
+        self._host = _Host()
+        self._result = {"msg": msg}
+
+
+def test_callback_plugin(monkeypatch):
+    plugin = _load_plugin(monkeypatch)
+
+    received = []
+    pipe = events.Pipe(received.append).start()
+    monkeypatch.setenv(events.ENV, str(pipe.fd))
+    callback = plugin.CallbackModule()
+    callback.v2_playbook_on_task_start(_Task(), False)
+    callback.v2_runner_on_failed(_Result("boom"))
+    assert pipe.sync()
+    pipe.close()
+
+    assert [(e["event"], e["task"]) for e in received] == [
+        ("task_start", "deploy"),
+        ("failed", "deploy"),
+    ]
+    assert received[1]["host"] == "node1"
+    assert received[1]["msg"] == "boom"
+
+
+def test_callback_plugin_line_size(monkeypatch):
+    plugin = _load_plugin(monkeypatch)
+    read, write = os.pipe()
+    monkeypatch.setenv(events.ENV, str(write))
+    callback = plugin.CallbackModule()
+
+    class Stats(object):
+        processed = {"host{}".format(i): 1 for i in range(200)}
+
+        def summarize(self, host):
+            return {"ok": 1, "changed": 0, "failures": 0, "unreachable": 0}
+
+    # escaped once encoded, each of these characters takes 6 bytes
+    callback.v2_runner_on_failed(_Result("\x01" * 4096, _Task("é" * 4096)))
+    callback.v2_playbook_on_stats(Stats())
+    os.close(write)
+    with os.fdopen(read, "rb") as f:
+        lines = f.readlines()
+
+    assert all(len(line) <= plugin.MAX_LINE for line in lines)
+    failed, stats = lines[0], list(events.read(iter(lines[1:])))
+    assert b'"event":"failed"' in failed and b'"host":"node1"' in failed
+    assert len(stats) == 200
+    assert stats[0]["host"] == "host0" and stats[0]["summary"]["ok"] == 1
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+from dciagent.core import extravars
+from dciagent.core import stream
+from dciagent.core.agents import ansible
+from dciagent.core.agents import dci
+
+
+def test_merge(tmp_path):
+    settings = tmp_path / "settings.yml"
+    settings.write_text("a: from-file\nlist: [1, 2]\n")
+    vault = tmp_path / "vault.yml"
+    vault.write_text("secret: !vault |\n  $ANSIBLE_VAULT;1.1;AES256\n")
+
+    merged = extravars.merge(
+        [
+            "a=1 b='two words'",
+            '{"c": {"d": 3}}',
+            "@{}".format(settings),
+            "@{}".format(vault),
+            "e=5",
+            "not a var",
+        ]
+    )
+    assert merged == [
+        {"a": "from-file", "b": "two words", "c": {"d": 3}, "list": [1, 2]},
+        "@{}".format(vault),
+        {"e": "5"},
+        "not a var",
+    ]
+    assert extravars.merge("x=1") == [{"x": "1"}]
+
+
+def test_write(tmp_path):
+    first = extravars.write(str(tmp_path), {"b": 1, "a": "x"})
+    second = extravars.write(str(tmp_path), {"a": "x", "b": 1})
+    assert first == second
+    assert os.stat(first).st_mode & 0o777 == 0o600
+    assert os.listdir(str(tmp_path)) == [os.path.basename(first)]
+    with open(first) as f:
+        assert json.load(f) == {"a": "x", "b": 1}
+
+
+class Agent(ansible.Agent):
+    executable = "true"
+
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_build_command(tmp_path):
+    agent = Agent()
+    argv = ["--extra-vars-dir", str(tmp_path), "site.yml"]
+    for i in range(500):
+        argv[:0] = ["-e", "var{}=value-{}".format(i, i)]
+    agent._load_args(vars(agent._cli(argv)))
+    agent._build_command()
+
+    i = agent.command_line.index("--extra-vars")
+    assert agent.command_line.count("--extra-vars") == 1
+    path = agent.command_line[i + 1][1:]
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path) as f:
+        assert len(json.load(f)) == 500
+
+
+# fake ansible-playbook printing the generated extra vars file
+PRINT_VARS_CMD = """#!/bin/sh
+while [ "$1" != "--extra-vars" ]; do shift; done
+path="${2#@}"
+echo "$path"
+cat "$path"
+"""
+
+
+def test_generated_files_removed(tmp_path):
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PRINT_VARS_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "hosts").write_text("node1\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.sinks = [stream.RingBuffer()]
+    argv = ["-i", str(tmp_path / "hosts"), "-c", str(tmp_path / "ansible.cfg")]
+    assert agent.run(argv + ["-e", "secret=1", str(tmp_path / "site.yml")]) == 0
+
+    path, content = agent.sinks[0].lines()
+    assert json.loads(content) == {"secret": "1"}
+    # written for the run only
+    assert not os.path.exists(os.path.dirname(path))
+
+
+class DciAgent(dci.Agent):
+    executable = "true"
+    default_config_dir = None
+    default_auth_file = None
+    default_inventory = None
+
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_extra_vars_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("ANSIBLE_EXTRA_VARS", "a=1")
+    settings = "@{}".format(tmp_path / "settings.yml")
+
+    agent = DciAgent()
+    argv = ["-C", str(tmp_path), "-e", "b=2", "site.yml"]
+    agent._load_args(vars(agent._cli(argv)))
+    agent._normalize()
+    assert agent.ansible_extra_vars == ["a=1", "b=2", settings]
+
+    # as given by a job, without going through the parser
+    agent = DciAgent()
+    agent._load_args(vars(agent._cli(["-C", str(tmp_path), "site.yml"])))
+    agent.ansible_extra_vars = "a=1"
+    agent._normalize()
+    assert agent.ansible_extra_vars == ["a=1", settings]
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+from dciagent.core import factcache
+from dciagent.core.agents import dci
+
+
+def _facts(cache, host, mtime, size=100):
+    path = os.path.join(cache.path, host)
+    with open(path, "w") as f:
+        f.write("x" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_prune(tmp_path):
+    root = str(tmp_path)
+    lab1 = factcache.FactCache(root, factcache.lab_key("/labs", "lab1-"), 100, 150)
+    lab2 = factcache.FactCache(root, factcache.lab_key("/labs", "lab2-"), 100, 150)
+    assert lab1.path != lab2.path
+
+    assert lab1.acquire()
+    assert not factcache.FactCache(root, os.path.basename(lab1.path)).acquire()
+    assert lab2.acquire()
+    for i, mtime in enumerate((1000, 1500, 1910, 1920)):
+        _facts(lab1, "host{}".format(i), mtime)
+    _facts(lab2, "other", 1000)
+
+    # lab2 is in use, host0 and host1 expired, then host2 goes for the size
+    assert lab1.prune(now=2000) == 3
+    assert os.listdir(lab1.path) == ["host3"]
+    assert os.listdir(lab2.path) == ["other"]
+
+    lab2.release()
+    assert lab1.prune(now=2000) == 1
+    assert os.listdir(lab2.path) == []
+    lab1.release()
+
+
+class Agent(dci.Agent):
+    executable = "sh"
+
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_agent(tmp_path, monkeypatch):
+    monkeypatch.delenv("ANSIBLE_CACHE_PLUGIN", raising=False)
+    (tmp_path / "dcirc.sh").write_text("export DCI_CLIENT_ID=id\n")
+    argv = ["-C", str(tmp_path), "--fact-cache-dir", str(tmp_path / "facts")]
+
+    agent = Agent()
+    agent._load_args(vars(agent._cli(argv + ["--prefix", "lab1-"])))
+    agent._normalize()
+    env = agent._fact_cache_env()
+    assert env["ANSIBLE_CACHE_PLUGIN"] == "jsonfile"
+    assert os.path.dirname(env["ANSIBLE_CACHE_PLUGIN_CONNECTION"]) == str(
+        tmp_path / "facts"
+    )
+
+    # the same lab from another run
+    other = Agent()
+    other._load_args(vars(other._cli(argv + ["--prefix", "lab1-"])))
+    other._normalize()
+    assert other._fact_cache_env() == {}
+    agent._post()
+    assert other._fact_cache_env() == env
+    other._post()
+
+
+def test_agent_user_config(tmp_path, monkeypatch):
+    monkeypatch.delenv("ANSIBLE_CACHE_PLUGIN", raising=False)
+    monkeypatch.delenv("ANSIBLE_GATHERING", raising=False)
+    (tmp_path / "dcirc.sh").write_text("export DCI_CLIENT_ID=id\n")
+    cfg = tmp_path / "ansible.cfg"
+    argv = ["-C", str(tmp_path), "--fact-cache-dir", str(tmp_path / "facts")]
+    argv += ["-c", str(cfg)]
+
+    agent = Agent()
+    agent._load_args(vars(agent._cli(argv)))
+    agent._normalize()
+
+    # the user's own cache is kept
+    cfg.write_text("[defaults]\nfact_caching = redis\n")
+    assert agent._fact_cache_env() == {}
+
+    # and so is the way facts are gathered
+    cfg.write_text("[defaults]\ngathering = explicit\n")
+    env = agent._fact_cache_env()
+    assert env["ANSIBLE_CACHE_PLUGIN"] == "jsonfile"
+    assert "ANSIBLE_GATHERING" not in env
+    agent._post()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+
+from dciagent.core import logarchive
+
+
+def _log():
+    for task in range(20):
+        yield "TASK [task {}] ****".format(task)
+        for i in range(50):
+            yield "ok: [host{}] => {}".format(i, "x" * 40)
+        for _ in range(10):
+            yield "waiting..."
+
+
+def test_archive(tmp_path):
+    path = str(tmp_path / "ansible.log.gz")
+    writer = logarchive.Writer(path, block_size=8 * 1024)
+    for line in _log():
+        writer.line(line)
+    writer.close()
+
+    lines = list(logarchive.read(path))
+    assert lines[:3] == [
+        "TASK [task 0] ****",
+        "ok: [host0] => " + "x" * 40,
+        "ok: [host1] => " + "x" * 40,
+    ]
+    assert lines[51:54] == [
+        "waiting...",
+        "--- last line repeated 9 times ---",
+        "TASK [task 1] ****",
+    ]
+    assert len(lines) == 20 * 53
+
+    # a plain gzip file too
+    with gzip.open(path, "rt") as f:
+        assert f.read().splitlines() == lines
+
+    entries = logarchive.index(path)
+    assert [e["task"] for e in entries] == ["task {}".format(i) for i in range(20)]
+    assert len(set(e["offset"] for e in entries)) > 1
+    assert any(e["line"] != e["first_line"] for e in entries)
+    for e in entries:
+        tail = list(logarchive.read(path, e["task"]))
+        assert tail == lines[e["line"] :]
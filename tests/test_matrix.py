@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from dciagent.core import matrix
+from dciagent.core import registry
+from dciagent.core import runner
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+
+
+class Agent(Base):
+    "lab-ctl"
+
+    default_auth_file = "dcirc.sh"
+    default_inventory = "hosts"
+    default_settings_file = "settings.yml"
+    executable = "echo"
+    prefix = Argument("prefix", "-P", "--prefix", default="")
+    config_dir = Argument("config dir", short="-C", long="--config-dir")
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "running {}".format(self.prefix)]
+
+
+def _lab(path, prefix, files=("dcirc.sh", "hosts", "settings.yml")):
+    for name in files:
+        (path / "{}{}".format(prefix, name)).write_text("")
+
+
+def test_scan(tmp_path):
+    _lab(tmp_path, "lab1-")
+    _lab(tmp_path, "lab2-")
+    _lab(tmp_path, "")
+    _lab(tmp_path, "incomplete-", ("dcirc.sh", "hosts"))
+
+    labs = matrix.scan(str(tmp_path), Agent)
+    assert list(labs) == ["", "lab1-", "lab2-"]
+    assert labs["lab1-"] == [
+        str(tmp_path / "lab1-dcirc.sh"),
+        str(tmp_path / "lab1-hosts"),
+        str(tmp_path / "lab1-settings.yml"),
+    ]
+    assert matrix.select(labs, ["lab*"]) == ["lab1-", "lab2-"]
+    assert matrix.select(labs, ["*2-", ""]) == ["", "lab2-"]
+    assert matrix.select(labs) == ["", "lab1-", "lab2-"]
+
+
+def test_run(tmp_path, capsys):
+    _lab(tmp_path, "lab1-")
+    _lab(tmp_path, "lab2-")
+    registry._classes["test_matrix:Agent"] = Agent
+
+    jobs = matrix.jobs("test_matrix:Agent", str(tmp_path), ["lab1-", "lab2-"])
+    assert jobs[0].locks != jobs[1].locks
+    results = runner.run(jobs, workers=2)
+
+    assert [r.rc for r in results] == [0, 0]
+    out = capsys.readouterr().out
+    assert "[lab1-] running lab1-" in out
+    assert "[lab2-] running lab2-" in out
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pytest
+
+from dciagent.core import errors
+from dciagent.core import retry
+from dciagent.core.agents import ansible
+
+from .test_agents import SyncAgent
+
+# fake ansible-playbook, fails at the deploy task unless told to start there
+PLAYBOOK_CMD = """#!/bin/sh
+echo "$@" >> "$ANSIBLE_LOG_PATH.args"
+case "$*" in
+*--start-at-task*) exit 0;;
+esac
+echo "TASK [setup] ***" >> "$ANSIBLE_LOG_PATH"
+echo "TASK [app : deploy] ***" >> "$ANSIBLE_LOG_PATH"
+echo "fatal: [node1]: FAILED! => {}" >> "$ANSIBLE_LOG_PATH"
+exit 2
+"""
+
+
+def test_policy():
+    policy = retry.Policy(3, delay=1, codes=retry.parse_codes("2,4"), pattern="UNREACH")
+    assert policy.retryable(1, 2, ["fatal: UNREACHABLE!"])
+    assert not policy.retryable(1, 2, ["fatal: FAILED!"])
+    assert not policy.retryable(1, 1, ["fatal: UNREACHABLE!"])
+    assert not policy.retryable(4, 2, ["fatal: UNREACHABLE!"])
+    assert not policy.retryable(1, 0)
+    assert [policy.wait(i) for i in (1, 2, 3)] == [1, 2, 4]
+
+
+def test_retries(tmp_path):
+    counter = tmp_path / "count"
+    script = "echo x >> {0}; [ $(wc -l < {0}) -ge 3 ] || exit 3".format(counter)
+
+    agent = SyncAgent()
+    assert agent.run(["--script", script, "--retries", "5"]) == 0
+    assert agent.attempts == 3
+
+    counter.unlink()
+    argv = ["--script", script, "--retries", "5", "--retry-codes", "4"]
+    assert agent.run(argv) == 3
+    assert agent.attempts == 1
+
+    counter.unlink()
+    argv = ["--script", "echo transient; " + script, "--retries", "1"]
+    assert agent.run(argv + ["--retry-pattern", "^trans"]) == 3
+    assert agent.attempts == 2
+
+    with pytest.raises(errors.ValidationError):
+        agent.run(["--retries", "1", "--retry-codes", "two"])
+
+
+class Agent(ansible.Agent):
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+    def _build_env(self):
+        super()._build_env()
+        self.environment["ANSIBLE_LOG_PATH"] = self.log_path
+
+
+def test_resume_task(tmp_path):
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PLAYBOOK_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "hosts").write_text("node1\n")
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.log_path = str(tmp_path / "ansible.log")
+    argv = ["-i", str(tmp_path / "hosts"), "-c", str(tmp_path / "ansible.cfg")]
+    rc = agent.run(
+        argv + ["--retries", "2", "--resume", "task", str(tmp_path / "site.yml")]
+    )
+
+    assert rc == 0
+    assert agent.attempts == 2
+    with open(agent.log_path + ".args") as f:
+        second = f.read().splitlines()[1]
+    assert second.endswith(
+        "--start-at-task app : deploy {}".format(tmp_path / "site.yml")
+    )
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import time
+
+from dciagent.core import registry
+from dciagent.core import runner
+from dciagent.core.agents import Argument
+from dciagent.core.agents import Base
+from dciagent.core.agents import dci
+
+
+class Agent(Base):
+    "test-ctl"
+
+    executable = "sh"
+    exit_code = Argument("exit code", long="--exit-code", type=int, default=0)
+
+    def __init__(self):
+        super().__init__(self.__doc__, "test agent", "0.1")
+
+    def _build_command(self):
+        self.command_line = [self.executable, "-c", "exit {}".format(self.exit_code)]
+
+
+def test_run_collects_return_codes():
+    jobs = [runner.Job(Agent, ["--exit-code", str(rc)]) for rc in (0, 3, 0, 5)]
+    results = runner.run(jobs, workers=2)
+    assert [r.rc for r in results] == [0, 3, 0, 5]
+    assert runner.returncode(results) == 3
+
+
+def test_run_records_errors():
+    results = runner.run([runner.Job(Agent, ["--unknown"])])
+    assert results[0].rc == 2
+    assert not results[0].ok
+
+
+def test_load_jobs(tmp_path):
+    path = tmp_path / "jobs.json"
+    path.write_text(
+        "\n".join(
+            json.dumps({"agent": "{}:Agent".format(__name__), "argv": [a]})
+            for a in ("--dry-run", "-v")
+        )
+    )
+    jobs = runner.load_jobs(str(path))
+    assert [j.argv for j in jobs] == [["--dry-run"], ["-v"]]
+    assert registry.load_agent(jobs[0].agent) is Agent
+
+
+def test_scheduler():
+    from dciagent.core import scheduler
+
+    admission = scheduler.Scheduler(cpus=4, memory=1000)
+    jobs = [
+        runner.Job("a", cpus=2, locks=["lab1"]),
+        runner.Job("b", cpus=1, locks=["lab1"], priority=5),
+        runner.Job("c", cpus=3),
+        runner.Job("d", cpus=8, memory=5000),
+        runner.Job("e", cpus=1),
+    ]
+    for i, job in enumerate(jobs):
+        admission.submit(i, job)
+
+    def admit():
+        return [i for i, _ in admission.admit()]
+
+    # b first (priority), a waits for lab1, c fits
+    assert admit() == [1, 2]
+    admission.release(jobs[2])
+    # d needs the whole box (capped to the limits), e can't jump ahead
+    assert admit() == []
+    admission.release(jobs[1])
+    assert admit() == [0]
+    admission.release(jobs[0])
+    assert admit() == [3]
+    admission.release(jobs[3])
+    assert admit() == [4]
+    assert len(admission) == 0
+
+
+class Lab(dci.Agent):
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_lab_from_environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("DCI_CONFIG_DIR", str(tmp_path))
+    monkeypatch.setenv("DCI_PREFIX", "lab1-")
+    assert runner.Job(Lab).locks == {"lab:{}:lab1-".format(tmp_path)}
+
+    monkeypatch.delenv("DCI_CONFIG_DIR")
+    monkeypatch.setattr(Lab, "default_config_dir", str(tmp_path / "."))
+    assert runner.Job(Lab, ["-P", "lab2-"]).locks == {"lab:{}:lab2-".format(tmp_path)}
+
+
+def test_run_locks(tmp_path):
+    class Sleep(Agent):
+        def _build_command(self):
+            self.command_line = [self.executable, "-c", "sleep 0.3"]
+
+    lab = "lab:{}:lab1-".format(tmp_path)
+    a = runner.Job(Lab, ["-C", str(tmp_path), "-P", "lab1-"])
+    b = runner.Job(Lab, ["--config-dir={}/".format(tmp_path), "--prefix=lab1-"])
+    c = runner.Job(Lab, ["-C{}".format(tmp_path), "-Plab1-", "--unknown"])
+    d = runner.Job(Lab, ["-C", str(tmp_path)])
+    assert a.locks == b.locks == c.locks == {lab}
+    assert d.locks == {"lab:{}:".format(tmp_path)}
+    # not an agent, nothing to lock
+    assert runner.Job("a", ["-C", str(tmp_path)]).locks == set()
+
+    start = time.monotonic()
+    results = runner.run([runner.Job(Sleep, locks=["lab"]) for _ in range(2)])
+    assert time.monotonic() - start > 0.6
+    assert runner.returncode(results) == 0
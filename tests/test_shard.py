@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import signal
+import subprocess
+
+import pytest
+
+from dciagent.core import errors
+from dciagent.core import inventory
+from dciagent.core import shard
+from dciagent.core import stream
+from dciagent.core import watch
+from dciagent.core.agents import ansible
+from dciagent.core.agents import dci
+
+INVENTORY = """[web]
+web[1:4]
+[db]
+db1
+db2
+[prod:children]
+web
+"""
+
+# fake ansible-playbook, logs and exits with the number of hosts it got
+PLAYBOOK_CMD = """#!/bin/sh
+while [ "$1" != "--limit" ]; do shift; done
+echo "TASK [ping $2]" >> "$ANSIBLE_LOG_PATH"
+echo "hosts $2"
+exit $(echo "$2" | tr ',' '\\n' | wc -l)
+"""
+
+
+def test_partition():
+    hosts = inventory.parse(INVENTORY)
+    assert shard.partition(hosts, 4) == [
+        ["web1", "web2"],
+        ["web3", "web4"],
+        ["db1"],
+        ["db2"],
+    ]
+    assert shard.partition(hosts, 2, "group") == [
+        ["web1", "web2", "web3", "web4"],
+        ["db1", "db2"],
+    ]
+    parts = shard.partition(hosts, 3, "hash")
+    assert sorted(sum(parts, [])) == sorted(hosts)
+    assert parts == shard.partition(hosts, 3, "hash")
+    assert shard.partition(hosts, 10) == [[h] for h in hosts]
+
+
+def test_select():
+    hosts = inventory.parse(INVENTORY)
+    assert inventory.select(hosts, "prod:!web2") == ["web1", "web3", "web4"]
+    assert inventory.select(hosts, "web*,db1:&web[13]") == ["web1", "web3"]
+    assert inventory.select(hosts, "all:!~^web") == ["db1", "db2"]
+
+
+class Agent(ansible.Agent):
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+    def _build_env(self):
+        super()._build_env()
+        self.environment["ANSIBLE_LOG_PATH"] = self.log_path
+
+
+def test_sharded_run(tmp_path):
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PLAYBOOK_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "hosts").write_text(INVENTORY)
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.log_path = str(tmp_path / "ansible.log")
+    agent.sinks = [stream.RingBuffer()]
+    rc = agent.run(
+        [
+            "-i",
+            str(tmp_path / "hosts"),
+            "-c",
+            str(tmp_path / "ansible.cfg"),
+            "--ansible-limit",
+            "prod:db1",
+            "--shards",
+            "2",
+            str(tmp_path / "site.yml"),
+        ]
+    )
+
+    assert rc == 3
+    assert sorted(agent.sinks[0].lines()) == [
+        "[shard 0] hosts web1,web2,web3",
+        "[shard 1] hosts web4,db1",
+    ]
+    with open(agent.log_path) as f:
+        assert f.read().splitlines() == [
+            "TASK [ping web1,web2,web3]",
+            "TASK [ping web4,db1]",
+        ]
+    assert not os.path.exists(agent.log_path + ".shard-0")
+    assert "user_cpu" in agent.timings["child"]
+
+
+# fake ansible-playbook, killed when given db1
+KILLED_CMD = """#!/bin/sh
+case "$*" in
+*db1*) kill -9 $$;;
+esac
+exit 0
+"""
+
+
+def test_sharded_run_failures(tmp_path):
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(KILLED_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "hosts").write_text(INVENTORY)
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+    argv = ["-i", str(tmp_path / "hosts"), "-c", str(tmp_path / "ansible.cfg")]
+    argv += ["--shards", "2", str(tmp_path / "site.yml")]
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.log_path = str(tmp_path / "ansible.log")
+    # the killed shard is not a success
+    assert agent.run(argv) == -9
+
+    # no host selected, no run on all of them
+    with pytest.raises(errors.ValidationError, match="No host"):
+        agent.run(argv + ["--ansible-limit", "nomatch"])
+
+
+class Full(stream.Sink):
+    def write(self, stream, line):
+        raise OSError("No space left on device")
+
+
+def test_sharded_run_sink_failure(tmp_path):
+    executable = tmp_path / "ansible-playbook"
+    executable.write_text(PLAYBOOK_CMD)
+    executable.chmod(0o755)
+    (tmp_path / "hosts").write_text(INVENTORY)
+    (tmp_path / "site.yml").write_text("- hosts: all\n  tasks: []\n")
+    (tmp_path / "ansible.cfg").write_text("[defaults]\n")
+    argv = ["-i", str(tmp_path / "hosts"), "-c", str(tmp_path / "ansible.cfg")]
+    argv += ["--shards", "2", str(tmp_path / "site.yml")]
+
+    agent = Agent()
+    agent.executable = str(executable)
+    agent.log_path = str(tmp_path / "ansible.log")
+    agent.sinks = [Full()]
+    with pytest.raises(OSError, match="No space left"):
+        agent.run(argv)
+
+
+class DciAgent(dci.Agent):
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_sharded_dci_agent(tmp_path):
+    log = str(tmp_path / "ansible.log")
+    agent = DciAgent()
+    agent.abort_on_failure = True
+    agent.shard_commands = [(["node1"], []), (["node2"], [])]
+    agent.environment = {"ANSIBLE_LOG_PATH": log, "JUNIT_OUTPUT_DIR": str(tmp_path)}
+    agent.watcher = watch.Watcher(log, str(tmp_path))
+
+    # the watcher follows the files of the shards
+    env = agent._shard_env(1)
+    assert [w.path for w in agent.watcher.logs] == [log + ".shard-1"]
+    assert agent.watcher.junit_dirs == [str(tmp_path / "shard-1")]
+    os.mkdir(env["JUNIT_OUTPUT_DIR"])
+    with open(env["ANSIBLE_LOG_PATH"], "w") as f:
+        f.write("TASK [deploy] ***\n")
+    with open(os.path.join(env["JUNIT_OUTPUT_DIR"], "site.xml"), "w") as f:
+        f.write('<testsuite><testcase name="test_deploy"/></testsuite>\n')
+    agent._merge_shards()
+    progress = agent.watcher.stop()
+    assert progress.tasks == ["deploy"]
+    assert progress.junit_files == [str(tmp_path / "shard-1" / "site.xml")]
+    assert os.path.isfile(str(tmp_path / "shard-1-site.xml"))
+
+    # every shard is aborted
+    agent.processes = [
+        subprocess.Popen(["sleep", "10"], start_new_session=True) for _ in range(2)
+    ]
+    agent._on_failure({"task": "deploy", "host": "node1"})
+    assert [p.wait(5) for p in agent.processes] == [-signal.SIGTERM] * 2
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import subprocess
+
+from dciagent.core import stream
+
+
+def _run(script, sinks, **kwargs):
+    p = subprocess.Popen(
+        ["sh", "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stream.pump(p, sinks, **kwargs)
+    return p.wait()
+
+
+def test_pump_fans_out_lines():
+    ring = stream.RingBuffer(2)
+    everything = stream.RingBuffer(100)
+    rc = _run(
+        "echo one; echo two; echo err >&2; echo three; printf four", [ring, everything]
+    )
+    assert rc == 0
+    assert ring.lines()[-1] == "four"
+    assert ("stderr", "err") in everything.buffer
+    assert [line for s, line in everything.buffer if s == "stdout"] == [
+        "one",
+        "two",
+        "three",
+        "four",
+    ]
+
+
+def test_pump_splits_long_lines():
+    ring = stream.RingBuffer(10)
+    _run("printf '%0100d\\n' 0", [ring], max_line=40)
+    assert [len(line) for line in ring.lines()] == [40, 40, 20]
+
+
+def test_rotating_file(tmp_path):
+    path = str(tmp_path / "out.log")
+    sink = stream.RotatingFile(path, max_bytes=10, backups=1)
+    for line in ("aaaa", "bbbb", "cccc"):
+        sink.write("stdout", line)
+    sink.close()
+    assert open(path).read() == "cccc\n"
+    assert open(path + ".1").read() == "aaaa\nbbbb\n"
+
+
+def test_pump_async_drains():
+    class Slow(stream.RingBuffer):
+        drained = 0
+
+        async def drain(self):
+            self.drained += 1
+
+    async def run():
+        p = await asyncio.create_subprocess_exec(
+            "sh", "-c", "echo one; echo two", stdout=asyncio.subprocess.PIPE
+        )
+        await stream.pump_async(p.stdout, "stdout", [stream.Prefixed("> ", [slow])])
+        await p.wait()
+
+    slow = Slow(10)
+    asyncio.get_event_loop_policy().new_event_loop().run_until_complete(run())
+    assert slow.lines() == ["> one", "> two"]
+    assert slow.drained >= 2
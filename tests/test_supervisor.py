@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+from .test_agents import SyncAgent
+
+
+def _alive(pid):
+    "Whether the process is still running, zombies waiting for init are not"
+
+    for _ in range(20):
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                state = f.read().rsplit(")", 1)[1].split()[0]
+        except FileNotFoundError:
+            return False
+        if state == "Z":
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def test_timeout(tmp_path):
+    pidfile = tmp_path / "pid"
+    # the background sleep must go away with its parent
+    script = "sleep 30 & echo $! > {}; wait".format(pidfile)
+
+    agent = SyncAgent()
+    start = time.monotonic()
+    rc = agent.run(["--script", script, "--timeout", "0.5"])
+
+    assert time.monotonic() - start < 5
+    assert rc < 0
+    assert agent.expired == "timeout"
+    assert agent.hooks == ["pre", "post"]
+    assert not _alive(int(pidfile.read_text()))
+
+
+def test_idle_timeout(capsys):
+    agent = SyncAgent()
+    agent.termination_grace = 0.2
+    script = "trap '' INT; for i in 1 2 3; do echo $i; sleep 0.2; done; sleep 30"
+    start = time.monotonic()
+    rc = agent.run(["--script", script, "--idle-timeout", "1"])
+
+    assert 1.4 < time.monotonic() - start < 5
+    assert rc == -15
+    assert agent.expired == "idle"
+    assert "reason: idle" in capsys.readouterr().out
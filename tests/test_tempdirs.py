@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import time
+
+import pytest
+
+from dciagent.core import tempdirs
+from dciagent.core.agents import dci
+
+
+def _populated(root):
+    path = tempdirs.create(str(root))
+    os.makedirs(os.path.join(path, "junit"))
+    with open(os.path.join(path, "junit", "a.xml"), "w") as f:
+        f.write("<testsuites/>")
+    return path
+
+
+def test_discard(tmp_path):
+    path = _populated(tmp_path)
+    tempdirs.discard(path)
+    assert not os.path.exists(path)
+
+    path = _populated(tmp_path)
+    tempdirs.discard(path, "defer")
+    assert not os.path.exists(path)
+    trashed = os.path.join(tempdirs.trash_dir(str(tmp_path)), os.path.basename(path))
+    assert os.path.isdir(trashed)
+    assert tempdirs.sweep(str(tmp_path), older_than=3600) == []
+    assert tempdirs.sweep(str(tmp_path)) == [trashed]
+    assert not os.path.exists(trashed)
+
+    path = _populated(tmp_path)
+    tempdirs.discard(path, "background")
+    assert not os.path.exists(path)
+    trash = tempdirs.trash_dir(str(tmp_path))
+    assert os.stat(trash).st_mode & 0o777 == 0o700
+    for _ in range(50):
+        if not os.listdir(trash):
+            break
+        time.sleep(0.1)
+    assert os.listdir(trash) == []
+
+
+class Agent(dci.Agent):
+    executable = "sh"
+
+    def __init__(self):
+        super().__init__("test-ctl", "test agent", "0.1")
+
+
+def test_lazy_tempdir(tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "dcirc.sh").write_text("export DCI_CLIENT_ID=id\n")
+    root = tmp_path / "tmpfs"
+    argv = ["-C", str(tmp_path), "--tempdir-root", str(root), "--no-validation"]
+
+    agent = Agent()
+    assert agent.run(argv + ["--dry-run", "site.yml"]) == 0
+    assert "@<tempdir>/extra-vars-" in capsys.readouterr().out
+    assert not root.exists()
+
+    assert agent.run(argv + ["--cleanup", "defer", "site.yml"]) != 0
+    assert os.listdir(str(root)) == [os.path.basename(tempdirs.trash_dir())]
+    assert len(os.listdir(tempdirs.trash_dir(str(root)))) == 1
+
+
+def test_artifacts_after_cleanup(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "dcirc.sh").write_text("export DCI_CLIENT_ID=id\n")
+    root = tmp_path / "tmpfs"
+    argv = ["-C", str(tmp_path), "--tempdir-root", str(root), "--no-validation"]
+    argv += ["--report-file", str(tmp_path / "report.jsonl")]
+
+    # removed by default, nothing is left to point at
+    agent = Agent()
+    agent.run(argv + ["site.yml"])
+    assert agent.result.artifacts == {}
+
+    # moved to the trash until the next sweep
+    agent = Agent()
+    agent.run(argv + ["--cleanup", "defer", "site.yml"])
+    trash = tempdirs.trash_dir(str(root))
+    assert agent.result.artifacts["tempdir"].startswith(trash + os.sep)
+    assert all(os.path.exists(p) for p in agent.result.artifacts.values())
+
+
+def test_failed_build_cleans_up(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    root = tmp_path / "tmpfs"
+    # no dcirc.sh, reading the credentials fails once the tempdir exists
+    argv = ["-C", str(tmp_path), "--tempdir-root", str(root), "--no-validation"]
+
+    agent = Agent()
+    with pytest.raises(OSError):
+        agent.run(argv + ["site.yml"])
+    assert os.listdir(str(root)) == []
+    assert agent.watcher._thread is None
+    assert "FileNotFoundError" in agent.result.error
+
+
+@pytest.mark.skipif(os.getuid() != 0, reason="needs to chown")
+def test_discard_foreign_trash(tmp_path):
+    trash = tempdirs.trash_dir(str(tmp_path))
+    os.makedirs(trash)
+    os.chown(trash, 65534, 65534)
+
+    path = _populated(tmp_path)
+    tempdirs.discard(path, "defer")
+    assert not os.path.exists(path)
+    assert os.listdir(trash) == []
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import http.server
+import socketserver
+import threading
+
+import pytest
+
+from dciagent.core import retry
+from dciagent.core import upload
+from dciagent.core.agents import dci
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        data = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunk = self.rfile.read(size + 2)[:size]
+            if size == 0:
+                return data
+            data += chunk
+
+    def do_PUT(self):
+        server = self.server
+        body = self._body()
+        with server.lock:
+            server.connections.add(self.client_address)
+            status = server.statuses.pop(0) if server.statuses else 201
+            if status < 300:
+                server.files[self.path] = body
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def server():
+    s = Server(("127.0.0.1", 0), Handler)
+    s.lock = threading.Lock()
+    s.files = {}
+    s.statuses = []
+    s.connections = set()
+    thread = threading.Thread(target=s.serve_forever, daemon=True)
+    thread.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def _url(server):
+    return "http://127.0.0.1:{}/jobs/1/files".format(server.server_port)
+
+
+def test_upload(tmp_path, server):
+    uploader = upload.Uploader(_url(server), workers=2, chunk_size=7)
+    for i in range(6):
+        path = tmp_path / "junit-{}.xml".format(i)
+        path.write_text("<testsuite name='{}'/>".format(i) * 10)
+        uploader.submit(str(path))
+        uploader.submit(str(path))  # only once
+    assert uploader.wait() == []
+    uploader.close()
+
+    assert len(server.files) == 6
+    assert (
+        server.files["/jobs/1/files/junit-3.xml"]
+        == ("<testsuite name='3'/>" * 10).encode()
+    )
+    # the connections are kept open and reused
+    assert uploader.pool.created <= 2
+    assert len(server.connections) <= 2
+
+
+def test_upload_retries(tmp_path, server):
+    server.statuses = [503, 502]
+    path = tmp_path / "ansible.log"
+    path.write_text("TASK [x]\n")
+    policy = retry.Policy(retries=2, delay=0.01, codes=upload.RETRY_STATUSES)
+
+    uploader = upload.Uploader(_url(server), workers=1, policy=policy)
+    uploader.submit(str(path))
+    assert uploader.wait() == []
+    assert uploader.sent == ["ansible.log"]
+    assert server.files["/jobs/1/files/ansible.log"] == b"TASK [x]\n"
+
+
+def test_upload_failure(tmp_path, server):
+    server.statuses = [403, 201]
+    path = tmp_path / "ansible.log"
+    path.write_text("TASK [x]\n")
+
+    uploader = upload.Uploader(_url(server), workers=1)
+    uploader.submit(str(path))
+    failed = uploader.wait()
+    # not worth another attempt
+    assert [name for name, _ in failed] == ["ansible.log"]
+    assert "HTTP 403" in failed[0][1]
+    assert server.files == {}
+
+
+def test_credentials_need_https(monkeypatch):
+    auth = upload.basic_auth("user", "secret")
+    with pytest.raises(ValueError, match="Refusing to send credentials"):
+        upload.Uploader("http://example.com/files", headers=auth)
+    upload.Uploader.check("https://example.com/files", auth)
+    upload.Uploader.check("http://example.com/files")
+
+    class Agent(dci.Agent):
+        def __init__(self):
+            super().__init__("test-ctl", "test agent", "0.1")
+
+    agent = Agent()
+    monkeypatch.setenv("DCI_UPLOAD_PASSWORD", "secret")
+    agent._load_args(vars(agent._cli(["--upload-url", "https://example.com"])))
+    assert agent._upload_headers() == {}
+    agent._load_args(vars(agent._cli(["--upload-user", "user"])))
+    assert agent._upload_headers() == auth
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import pytest
+
+from dciagent.core import errors
+from dciagent.core import inventory
+from dciagent.core import validation
+
+INI = """ungrouped1
+[web]
+node[01:03] ansible_host=10.0.0.1
+[app:children]
+web
+[app:vars]
+foo=bar
+"""
+
+YAML = """all:
+  hosts:
+    jumphost:
+  children:
+    web:
+      hosts:
+        node1:
+"""
+
+
+def test_inventory_ini():
+    hosts = inventory.parse(INI)
+    assert list(hosts) == ["ungrouped1", "node01", "node02", "node03"]
+    assert hosts["node02"] == ["web", "app"]
+
+
+def test_inventory_yaml():
+    hosts = inventory.parse(YAML)
+    assert hosts == {"jumphost": ["all"], "node1": ["web", "all"]}
+
+
+def test_check_cached(tmp_path, monkeypatch):
+    path = tmp_path / "site.yml"
+    path.write_text("- hosts: all\n  tasks: []\n")
+    cache = str(tmp_path / "cache")
+    validation.check("playbook", str(path), cache)
+
+    calls = []
+    monkeypatch.setitem(validation.CHECKS, "playbook", lambda *a: calls.append(a))
+    monkeypatch.setattr(validation, "_valid", set())
+    validation.check("playbook", str(path), cache)
+    validation._cache.clear()
+    validation.check("playbook", str(path), cache)  # from disk
+    os.utime(str(path), (0, 0))
+    validation.check("playbook", str(path), cache)  # same content hash
+    assert calls == []
+
+    path.write_text("- tasks: []\n")
+    validation.check("playbook", str(path), cache)
+    assert len(calls) == 1
+
+
+def test_check_errors(tmp_path):
+    path = tmp_path / "site.yml"
+    path.write_text("- tasks: []\n")
+    with pytest.raises(errors.ValidationError, match="play without hosts"):
+        validation.check("playbook", str(path))
+    # negative verdicts are cached too
+    with pytest.raises(errors.ValidationError, match="play without hosts"):
+        validation.check("playbook", str(path))
+
+    cfg = tmp_path / "ansible.cfg"
+    cfg.write_text("forks = 10\n")
+    with pytest.raises(errors.ValidationError, match="Cannot parse ansible config"):
+        validation.check("config", str(cfg))
+
+
+def test_check_ansible_tags(tmp_path):
+    settings = tmp_path / "settings.yml"
+    settings.write_text(
+        "password: !vault |\n"
+        "  $ANSIBLE_VAULT;1.1;AES256\n"
+        "  62313365396662343061393464336163383764373764613633653634306231386433\n"
+    )
+    validation.check("settings", str(settings))
+
+    playbook = tmp_path / "site.yml"
+    playbook.write_text(
+        "- hosts: all\n  vars:\n    raw: !unsafe '{{ not a template }}'\n  tasks: []\n"
+    )
+    validation.check("playbook", str(playbook))
+
+
+def test_check_empty_inventory(tmp_path):
+    path = tmp_path / "hosts"
+    path.write_text("[web]\n")
+    validation.check("inventory", str(path))
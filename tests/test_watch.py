@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Red Hat, Inc
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from dciagent.core import watch
+
+LOG = """2021-10-01 10:00:00,000 p=1 u=dci n=ansible | TASK [Get hostname] ***
+2021-10-01 10:00:01,000 p=1 u=dci n=ansible | ok: [host1]
+2021-10-01 10:00:02,000 p=1 u=dci n=ansible | TASK [Optional step] ***
+2021-10-01 10:00:03,000 p=1 u=dci n=ansible | fatal: [host1]: FAILED! => {}
+2021-10-01 10:00:03,000 p=1 u=dci n=ansible | ...ignoring
+2021-10-01 10:00:04,000 p=1 u=dci n=ansible | TASK [Deploy] ***
+"""
+
+JUNIT = """<?xml version="1.0" ?>
+<testsuites>
+  <testsuite name="playbook" tests="2">
+    <testcase classname="host1" name="test_get_hostname"/>
+    <testcase classname="host1" name="test_deploy">
+      <failure message="boom"/>
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+def test_watcher(tmp_path):
+    log = tmp_path / "ansible.log"
+    failures = []
+    junit = []
+    w = watch.Watcher(
+        str(log), str(tmp_path), on_failure=failures.append, on_junit=junit.append
+    )
+
+    log.write_text(LOG)
+    w.poll()
+    assert w.progress.tasks == ["Get hostname", "Optional step", "Deploy"]
+    assert failures == []
+
+    with log.open("a") as f:
+        f.write("2021-10-01 10:00:05,000 | fatal: [host2]: FAILED! => {}\n")
+    (tmp_path / "playbook.xml").write_text(JUNIT)
+    w.poll()
+    assert failures == []  # the JUnit file may still be written
+    assert junit == []
+
+    progress = w.stop()
+    assert progress.testcases == 2
+    assert [(f["source"], f["task"], f["host"]) for f in failures] == [
+        ("log", "Deploy", "host2"),
+        ("junit", "test_deploy", "host1"),
+    ]
+    assert junit == [str(tmp_path / "playbook.xml")]